@@ -0,0 +1,163 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from datos import VENTANA_IDS, leer_paginado
+
+# Versión del formato en disco: al cambiarla se descartan los archivos existentes
+VERSION_FORMATO = 1
+
+# Directorio de la caché persistente (sobrevive a reinicios del proceso)
+DIRECTORIO = os.getenv("DPANDOS_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache_datos"))
+
+# Tiempo máximo antes de forzar una recarga completa (detecta filas eliminadas)
+EDAD_MAXIMA_COMPLETA = 24 * 60 * 60
+
+# Margen por debajo de las marcas por fecha que se vuelve a leer en cada revalidación: updated_at se fija
+# al inicio de la transacción, y una transacción larga confirma con una marca anterior a la ya leída
+VENTANA_SEGUNDOS = 10 * 60
+
+# Columna usada como marca de agua para revalidar cada tabla de forma incremental
+# 'id' para tablas de solo inserción, 'updated_at' para tablas que se modifican
+MARCAS = {
+    'insumos': 'updated_at',
+    'categorias': 'updated_at',
+    'productos': 'updated_at',
+    'historico_precios': 'id',
+    'produccion': 'id',
+    'compras': 'id',
+    'compra_detalles': 'id',
+    'consumos': 'id',
+    'consumo_detalles': 'id',
+    'receta_versiones': 'id',
+    'proveedores': 'updated_at',
+    'sucursales': 'updated_at',
+    'stock_sucursal': 'updated_at',
+}
+
+_candados = {}
+_candado_global = threading.Lock()
+
+
+def _candado(nombre):
+    with _candado_global:
+        return _candados.setdefault(nombre, threading.Lock())
+
+
+def _rutas(nombre):
+    return os.path.join(DIRECTORIO, f"{nombre}.parquet"), os.path.join(DIRECTORIO, f"{nombre}.json")
+
+
+def _leer(nombre):
+    ruta_datos, ruta_meta = _rutas(nombre)
+    try:
+        with open(ruta_meta, encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('formato') != VERSION_FORMATO:
+            return None, None
+        return pq.read_table(ruta_datos, memory_map=True).to_pandas(), meta
+    except (OSError, ValueError, pa.ArrowException):
+        return None, None
+
+
+# Función para escribir un archivo en un temporal de nombre único y reemplazar el destino: no quedan
+# archivos a medias y la aplicación y servicio_api (procesos distintos) no pisan el temporal del otro
+def _reemplazar(ruta, escribir):
+    descriptor, temporal = tempfile.mkstemp(dir=DIRECTORIO, suffix='.tmp')
+    os.close(descriptor)
+    try:
+        escribir(temporal)
+        os.replace(temporal, ruta)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+
+def _escribir(nombre, df, meta):
+    os.makedirs(DIRECTORIO, exist_ok=True)
+    ruta_datos, ruta_meta = _rutas(nombre)
+
+    def escribir_meta(temporal):
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump(dict(meta, formato=VERSION_FORMATO, guardado=time.time()), f)
+
+    _reemplazar(ruta_datos, lambda temporal: pq.write_table(pa.Table.from_pandas(df, preserve_index=False), temporal))
+    _reemplazar(ruta_meta, escribir_meta)
+
+
+def _marca_de_agua(df, columna):
+    if df.empty or columna not in df.columns:
+        return None
+    marca = df[columna].max()
+    return None if pd.isna(marca) else (int(marca) if columna == 'id' else str(marca))
+
+
+def _desde(marca, columna):
+    if columna == 'id':
+        return marca - VENTANA_IDS
+    return (pd.Timestamp(marca) - pd.Timedelta(seconds=VENTANA_SEGUNDOS)).isoformat()
+
+
+def _descargar(sb, tabla, filtros=None):
+    paginas = list(leer_paginado(sb, tabla, filtros=filtros))
+    return pd.concat(paginas, ignore_index=True) if paginas else pd.DataFrame()
+
+
+# Función para cargar una tabla desde la caché en disco, trayendo solo las filas nuevas o modificadas
+# Con sucursal se cargan solo las filas de esa sucursal, en un archivo aparte
+def cargar_tabla(sb, tabla, sucursal=None):
+    columna = MARCAS[tabla]
+    nombre = tabla if sucursal is None else f"{tabla}_sucursal_{sucursal}"
+    filtros = [] if sucursal is None else [('eq', 'sucursal_id', sucursal)]
+    with _candado(nombre):
+        df, meta = _leer(nombre)
+        completa = df is None or meta.get('marca') is None or time.time() - meta.get('completa', 0) > EDAD_MAXIMA_COMPLETA
+
+        if completa:
+            df = _descargar(sb, tabla, filtros)
+            meta = {'completa': time.time()}
+        else:
+            # Se vuelve a leer una ventana bajo la marca para no perder filas confirmadas tarde;
+            # solo cuentan como nuevas las filas (o versiones de fila) que aún no están en la caché
+            clave = ['id'] if columna == 'id' else ['id', columna]
+            nuevas = _descargar(sb, tabla, filtros + [('gt', columna, _desde(meta['marca'], columna))])
+            if not nuevas.empty:
+                nuevas = nuevas.merge(df[clave].drop_duplicates(), on=clave, how='left', indicator=True)
+                nuevas = nuevas[nuevas['_merge'] == 'left_only'].drop(columns='_merge')
+            if nuevas.empty:
+                return df
+            df = pd.concat([df, nuevas], ignore_index=True).drop_duplicates('id', keep='last').reset_index(drop=True)
+
+        meta['marca'] = _marca_de_agua(df, columna)
+        _escribir(nombre, df, meta)
+        return df
+
+
+# Funciones para guardar y leer datos derivados (índices, resúmenes) asociados a una versión
+def guardar_derivado(nombre, df, version):
+    with _candado(nombre):
+        _escribir(nombre, df, {'version': version})
+
+
+def leer_derivado(nombre, version):
+    with _candado(nombre):
+        df, meta = _leer(nombre)
+    if df is None or meta.get('version') != version:
+        return None
+    return df
+
+
+# Función para leer un dato derivado junto con la versión con la que se guardó: (df, version)
+def leer_derivado_con_version(nombre):
+    with _candado(nombre):
+        df, meta = _leer(nombre)
+    if df is None:
+        return None, None
+    return df, meta.get('version')
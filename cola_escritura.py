@@ -0,0 +1,270 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import pandas as pd
+from postgrest.exceptions import APIError
+
+from costos import costo_congelado
+from stock import StockInsuficiente, registrar_consumo, registrar_produccion
+from sucursales import SUCURSAL_PRINCIPAL
+
+# Archivo SQLite de la cola de escrituras pendientes (sobrevive a reinicios y cortes de conexión)
+RUTA = os.getenv("DPANDOS_COLA_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cola_escritura.sqlite3"))
+
+# Operaciones enviadas por ciclo del proceso en segundo plano
+TAMANO_LOTE = 20
+
+# Espera exponencial entre reintentos de errores de conexión o del servidor (se reintenta sin límite)
+ESPERA_BASE = 2
+ESPERA_MAXIMA = 300
+
+# Segundos que se conservan las operaciones enviadas: alcanza para que la sesión consulte su estado y
+# resultado; después se borran (la clave de idempotencia queda guardada en el servidor)
+RETENCION_ENVIADAS = 7 * 24 * 60 * 60
+
+# Errores que se repetirían igual en cada reintento: datos inválidos (clase 22), restricciones (clase 23)
+# y excepciones lanzadas por las funciones de registro (P0001, por ejemplo stock insuficiente)
+CODIGOS_RECHAZO = ('22', '23', 'P0001')
+
+PENDIENTE = 'pendiente'
+ENVIADO = 'enviado'
+RECHAZADO = 'rechazado'
+
+
+# Manejadores por tipo de operación; todos son idempotentes gracias a la clave de la operación
+# Las operaciones encoladas antes de existir sucursales se registran en la sucursal principal
+def _enviar_compra(sb, clave, datos):
+    return sb.rpc('registrar_compra', {
+        'clave': clave,
+        'compra': datos['compra'],
+        'detalles': datos['detalles'],
+        'sucursal': datos.get('sucursal', SUCURSAL_PRINCIPAL),
+    }).execute().data
+
+
+def _enviar_consumo(sb, clave, datos):
+    return registrar_consumo(
+        sb, datos['detalles'], datos['fecha'], datos['observaciones'], clave, datos.get('sucursal', SUCURSAL_PRINCIPAL)
+    )
+
+
+def _enviar_produccion(sb, clave, datos):
+    # El costo congelado se escribe en la misma transacción que la producción
+    lineas_costo = pd.DataFrame(datos['lineas_costo'], columns=['insumo_id', 'cantidad', 'precio'])
+    return registrar_produccion(
+        sb,
+        datos['producto_id'],
+        datos['cantidad'],
+        datos['costo_total'],
+        datos['detalles'],
+        datos['fecha'],
+        datos['observaciones'],
+        clave,
+        datos.get('sucursal', SUCURSAL_PRINCIPAL),
+        costo_congelado(datos['precio_venta'], lineas_costo, datos['costo_adicional'])
+    )
+
+
+def _enviar_insumo(sb, clave, datos):
+    return sb.rpc('registrar_insumo', {
+        'clave': clave,
+        'insumo': datos['insumo'],
+        'fecha': datos['fecha'],
+        'sucursal': datos.get('sucursal', SUCURSAL_PRINCIPAL),
+    }).execute().data
+
+
+# Función para distinguir un rechazo del servidor (no se reintenta) de un error de transporte
+def _es_rechazo(error):
+    if isinstance(error, StockInsuficiente):
+        return True
+    return isinstance(error, APIError) and str(error.code or '').startswith(CODIGOS_RECHAZO)
+
+
+def _json(valor):
+    # Escalares de numpy/pandas a tipos nativos; fechas y otros objetos como texto
+    return valor.item() if hasattr(valor, 'item') else str(valor)
+
+
+MANEJADORES = {
+    'compra': _enviar_compra,
+    'consumo': _enviar_consumo,
+    'produccion': _enviar_produccion,
+    'insumo': _enviar_insumo,
+}
+
+
+class ColaEscritura:
+    def __init__(self, sb, ruta=RUTA, manejadores=None, al_enviar=None):
+        self._sb = sb
+        self._ruta = ruta
+        self._manejadores = manejadores or MANEJADORES
+        self._al_enviar = al_enviar
+        self._candado = threading.Lock()
+        self._cambio = threading.Condition()
+        self._despertar = threading.Event()
+        self._hilo = None
+
+        with self._conexion() as conexion:
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute("""
+                CREATE TABLE IF NOT EXISTS operaciones (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    clave TEXT NOT NULL UNIQUE,
+                    tipo TEXT NOT NULL,
+                    datos TEXT NOT NULL,
+                    estado TEXT NOT NULL,
+                    intentos INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    resultado TEXT,
+                    creado REAL NOT NULL,
+                    proximo_intento REAL NOT NULL
+                )
+            """)
+            conexion.execute("CREATE INDEX IF NOT EXISTS operaciones_estado_idx ON operaciones (estado, proximo_intento)")
+
+    @contextmanager
+    def _conexion(self):
+        conexion = sqlite3.connect(self._ruta, timeout=30)
+        try:
+            with conexion:
+                yield conexion
+        finally:
+            conexion.close()
+
+    # Función para iniciar el proceso en segundo plano que envía las operaciones pendientes
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._ciclo, name="cola-escritura", daemon=True)
+            self._hilo.start()
+
+    # Función para guardar una operación localmente; devuelve su clave de idempotencia
+    def encolar(self, tipo, datos):
+        if tipo not in self._manejadores:
+            raise ValueError(f"Tipo de operación desconocido: {tipo}")
+        clave = str(uuid.uuid4())
+        ahora = time.time()
+        with self._candado, self._conexion() as conexion:
+            conexion.execute(
+                "INSERT INTO operaciones (clave, tipo, datos, estado, creado, proximo_intento) VALUES (?, ?, ?, ?, ?, ?)",
+                (clave, tipo, json.dumps(datos, default=_json), PENDIENTE, ahora, ahora)
+            )
+        self._despertar.set()
+        return clave
+
+    # Función para consultar el estado de una operación: (estado, error, resultado)
+    def estado(self, clave):
+        with self._conexion() as conexion:
+            fila = conexion.execute("SELECT estado, error, resultado FROM operaciones WHERE clave = ?", (clave,)).fetchone()
+        if fila is None:
+            return None, None, None
+        return fila[0], fila[1], json.loads(fila[2]) if fila[2] else None
+
+    # Función para esperar brevemente a que una operación se envíe (con buena conexión responde de inmediato)
+    def esperar(self, clave, tiempo_maximo=2.0):
+        limite = time.time() + tiempo_maximo
+        with self._cambio:
+            while True:
+                estado = self.estado(clave)
+                restante = limite - time.time()
+                if estado[0] != PENDIENTE or restante <= 0:
+                    return estado
+                self._cambio.wait(restante)
+
+    def resumen(self):
+        with self._conexion() as conexion:
+            return dict(conexion.execute("SELECT estado, COUNT(*) FROM operaciones GROUP BY estado").fetchall())
+
+    def rechazadas(self):
+        with self._conexion() as conexion:
+            filas = conexion.execute(
+                "SELECT clave, tipo, datos, error, creado FROM operaciones WHERE estado = ? ORDER BY id", (RECHAZADO,)
+            ).fetchall()
+        return [
+            {'clave': clave, 'tipo': tipo, 'datos': json.loads(datos), 'error': error, 'creado': creado}
+            for clave, tipo, datos, error, creado in filas
+        ]
+
+    def descartar(self, clave):
+        with self._candado, self._conexion() as conexion:
+            conexion.execute("DELETE FROM operaciones WHERE clave = ? AND estado = ?", (clave, RECHAZADO))
+
+    # Función para volver a enviar una operación rechazada (por ejemplo después de reponer stock)
+    def reintentar(self, clave):
+        with self._candado, self._conexion() as conexion:
+            conexion.execute(
+                "UPDATE operaciones SET estado = ?, intentos = 0, proximo_intento = ? WHERE clave = ? AND estado = ?",
+                (PENDIENTE, time.time(), clave, RECHAZADO)
+            )
+        self._despertar.set()
+
+    # Función para borrar las operaciones enviadas hace más de RETENCION_ENVIADAS; devuelve cuántas borró
+    def purgar_enviadas(self):
+        with self._candado, self._conexion() as conexion:
+            return conexion.execute(
+                "DELETE FROM operaciones WHERE estado = ? AND creado < ?", (ENVIADO, time.time() - RETENCION_ENVIADAS)
+            ).rowcount
+
+    def _pendientes(self):
+        with self._conexion() as conexion:
+            return conexion.execute(
+                "SELECT clave, tipo, datos, intentos FROM operaciones WHERE estado = ? AND proximo_intento <= ? ORDER BY id LIMIT ?",
+                (PENDIENTE, time.time(), TAMANO_LOTE)
+            ).fetchall()
+
+    def _proxima_espera(self):
+        with self._conexion() as conexion:
+            fila = conexion.execute("SELECT MIN(proximo_intento) FROM operaciones WHERE estado = ?", (PENDIENTE,)).fetchone()
+        if fila[0] is None:
+            return ESPERA_MAXIMA
+        return min(max(fila[0] - time.time(), 0), ESPERA_MAXIMA)
+
+    def _actualizar(self, clave, **campos):
+        columnas = ", ".join(f"{columna} = ?" for columna in campos)
+        with self._candado, self._conexion() as conexion:
+            conexion.execute(f"UPDATE operaciones SET {columnas} WHERE clave = ?", (*campos.values(), clave))
+
+    # Función que envía un lote de operaciones en orden; devuelve cuántas se enviaron
+    def procesar_lote(self):
+        enviadas = 0
+        for clave, tipo, datos, intentos in self._pendientes():
+            try:
+                resultado = self._manejadores[tipo](self._sb, clave, json.loads(datos))
+            except Exception as e:
+                intentos += 1
+                if _es_rechazo(e):
+                    self._actualizar(clave, estado=RECHAZADO, error=str(e), intentos=intentos)
+                else:
+                    # Errores de red o del servidor: se reintenta más tarde con espera exponencial
+                    espera = min(ESPERA_BASE ** min(intentos, 16), ESPERA_MAXIMA)
+                    self._actualizar(clave, error=str(e), intentos=intentos, proximo_intento=time.time() + espera)
+                    # Si falla la conexión no tiene sentido seguir con el resto del lote
+                    break
+            else:
+                self._actualizar(clave, estado=ENVIADO, error=None, intentos=intentos + 1,
+                                 resultado=json.dumps(resultado, default=_json))
+                enviadas += 1
+            finally:
+                with self._cambio:
+                    self._cambio.notify_all()
+
+        if enviadas and self._al_enviar is not None:
+            self._al_enviar()
+        return enviadas
+
+    def _ciclo(self):
+        while True:
+            self._despertar.wait(self._proxima_espera())
+            self._despertar.clear()
+            try:
+                while self.procesar_lote() == TAMANO_LOTE:
+                    pass
+                self.purgar_enviadas()
+            except Exception:
+                # Un error inesperado (por ejemplo del archivo local) no debe detener el proceso
+                time.sleep(ESPERA_BASE)
@@ -0,0 +1,11 @@
+import os
+
+from dotenv import load_dotenv
+from supabase import create_client
+
+
+# Función para crear el cliente de Supabase fuera de Streamlit (servicio API, procesos programados)
+# Usa SUPABASE_URL y SUPABASE_KEY del entorno o del archivo .env
+def crear_cliente():
+    load_dotenv()
+    return create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
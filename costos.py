@@ -0,0 +1,189 @@
+import numpy as np
+import pandas as pd
+
+
+# Función para obtener el desglose de costo de una receta por unidad producida, con los precios actuales
+# Devuelve (lineas, costo_adicional); lineas tiene las columnas insumo_id, cantidad y precio
+def desglose_costo(receta_insumos, insumos, costos_adicionales):
+    if receta_insumos.empty or insumos.empty:
+        lineas = pd.DataFrame(columns=['insumo_id', 'cantidad', 'precio'])
+    else:
+        precios = insumos[['id', 'precio_actual']].rename(columns={'id': 'insumo_id', 'precio_actual': 'precio'})
+        lineas = receta_insumos[['insumo_id', 'cantidad']].merge(precios, on='insumo_id', how='inner')
+
+    costo_adicional = float(costos_adicionales['costo'].sum()) if not costos_adicionales.empty else 0.0
+    return lineas, costo_adicional
+
+
+# Función para calcular el costo unitario actual de varias recetas a la vez
+# receta_insumos y costos_adicionales pueden incluir líneas de muchos productos (columna producto_id);
+# devuelve una fila por producto con costo_insumos, costo_adicional y costo_total
+def costo_recetas(producto_ids, receta_insumos, insumos, costos_adicionales):
+    costos = pd.DataFrame({'producto_id': list(producto_ids)})
+
+    if receta_insumos.empty or insumos.empty:
+        costos['costo_insumos'] = 0.0
+    else:
+        precios = insumos[['id', 'precio_actual']].rename(columns={'id': 'insumo_id'})
+        lineas = receta_insumos[receta_insumos['producto_id'].isin(costos['producto_id'])][['producto_id', 'insumo_id', 'cantidad']]
+        lineas = lineas.merge(precios, on='insumo_id', how='inner')
+        lineas['subtotal'] = lineas['cantidad'].astype(float) * lineas['precio_actual'].astype(float)
+        costos['costo_insumos'] = costos['producto_id'].map(lineas.groupby('producto_id')['subtotal'].sum()).fillna(0.0)
+
+    if costos_adicionales.empty:
+        costos['costo_adicional'] = 0.0
+    else:
+        adicionales = costos_adicionales.groupby('producto_id')['costo'].sum().astype(float)
+        costos['costo_adicional'] = costos['producto_id'].map(adicionales).fillna(0.0)
+
+    costos['costo_total'] = costos['costo_insumos'] + costos['costo_adicional']
+    return costos
+
+
+# Función para calcular el margen actual de todos los productos (costo de receta con precios actuales)
+def margenes_productos(productos, insumos, receta_insumos, costos_adicionales):
+    costos = costo_recetas(productos['id'].tolist(), receta_insumos, insumos, costos_adicionales)
+    margenes = pd.DataFrame({
+        'producto_id': productos['id'].values,
+        'producto': productos['nombre'].values,
+        'costo': costos['costo_total'].values,
+        'precio_venta': productos['precio_venta'].astype(float).values,
+    })
+    margenes['margen'] = margenes['precio_venta'] - margenes['costo']
+    margenes['margen_porcentaje'] = (margenes['margen'] / margenes['precio_venta'] * 100).where(margenes['precio_venta'] > 0, 0.0)
+    return margenes
+
+
+# Función para armar el costo congelado de una producción con los precios del momento de registrarla
+# El desglose se guarda en columnas de arreglos (una fila por producción) en produccion_costos;
+# registrar_produccion lo escribe en la misma transacción que la producción (sql/013)
+def costo_congelado(precio_venta, lineas, costo_adicional):
+    costo_insumos = float((lineas['cantidad'] * lineas['precio']).sum()) if not lineas.empty else 0.0
+    return {
+        'precio_venta': float(precio_venta),
+        'insumo_ids': [int(x) for x in lineas['insumo_id']],
+        'cantidades': [float(x) for x in lineas['cantidad']],
+        'precios': [float(x) for x in lineas['precio']],
+        'costo_adicional': float(costo_adicional),
+        'costo_unitario': costo_insumos + float(costo_adicional),
+    }
+
+
+# Función para calcular márgenes por producto a partir de los costos congelados
+def margenes_historicos(costos):
+    df = costos.assign(
+        costo_total=costos['costo_unitario'] * costos['cantidad'],
+        ingreso=costos['precio_venta'] * costos['cantidad'],
+    )
+    resumen = df.groupby('producto_id').agg(
+        unidades=('cantidad', 'sum'),
+        costo=('costo_total', 'sum'),
+        ingreso=('ingreso', 'sum'),
+    ).reset_index()
+    resumen['margen'] = resumen['ingreso'] - resumen['costo']
+    resumen['margen_porcentaje'] = (resumen['margen'] / resumen['ingreso'] * 100).where(resumen['ingreso'] > 0, 0.0)
+    return resumen
+
+
+# Función para calcular el costo de insumos consumidos (costo de ventas) a partir de los costos congelados
+def costo_insumos_producidos(costos):
+    lineas = costos[['cantidad', 'insumo_ids', 'cantidades', 'precios']].explode(['insumo_ids', 'cantidades', 'precios'])
+    lineas = lineas.dropna(subset=['insumo_ids'])
+    if lineas.empty:
+        return pd.DataFrame(columns=['insumo_id', 'cantidad', 'costo'])
+
+    cantidad = lineas['cantidad'].astype(float) * lineas['cantidades'].astype(float)
+    resumen = pd.DataFrame({
+        'insumo_id': lineas['insumo_ids'].astype(int),
+        'cantidad': cantidad,
+        'costo': cantidad * lineas['precios'].astype(float),
+    }).groupby('insumo_id', as_index=False).sum()
+    return resumen.sort_values('costo', ascending=False)
+
+
+# Índice para costear productos en una fecha pasada
+# Combina la versión de receta vigente con el precio de cada insumo vigente en esa fecha;
+# ambas búsquedas son binarias sobre arreglos ordenados por fecha
+class IndiceCostoHistorico:
+    def __init__(self, versiones, historico_precios):
+        self._recetas = {}
+        if not versiones.empty:
+            versiones = versiones.assign(vigente_desde=_fechas(versiones['vigente_desde']))
+            for producto_id, grupo in versiones.sort_values(['vigente_desde', 'version']).groupby('producto_id'):
+                self._recetas[producto_id] = (grupo['vigente_desde'].to_numpy(), grupo.to_dict('records'))
+
+        self._precios = {}
+        if not historico_precios.empty:
+            historico = historico_precios.assign(fecha=_fechas(historico_precios['fecha']))
+            for insumo_id, grupo in historico.sort_values(['fecha', 'id']).groupby('insumo_id'):
+                self._precios[insumo_id] = (grupo['fecha'].to_numpy(), grupo['precio'].to_numpy(dtype=float))
+
+    @staticmethod
+    def _vigente(fechas, fecha):
+        # Último registro con fecha anterior al fin del día consultado; None si todos son posteriores
+        limite = np.datetime64(pd.Timestamp(fecha).normalize() + pd.Timedelta(days=1))
+        indice = int(np.searchsorted(fechas, limite, side='left')) - 1
+        return None if indice < 0 else indice
+
+    # Función para obtener la versión de receta vigente en una fecha (o None si no hay historial hasta esa fecha)
+    def receta(self, producto_id, fecha):
+        if producto_id not in self._recetas:
+            return None
+        fechas, versiones = self._recetas[producto_id]
+        indice = self._vigente(fechas, fecha)
+        return None if indice is None else versiones[indice]
+
+    # Función para obtener el precio de un insumo vigente en una fecha (o None si no hay historial hasta esa fecha)
+    def precio(self, insumo_id, fecha):
+        if insumo_id not in self._precios:
+            return None
+        fechas, precios = self._precios[insumo_id]
+        indice = self._vigente(fechas, fecha)
+        return None if indice is None else float(precios[indice])
+
+    # Función para calcular el costo unitario de un producto en una fecha
+    # Devuelve (costo_total, detalles, sin_precio): costo_total y detalles como calcular_costo_receta, con insumo_id
+    # en lugar del nombre del insumo, y sin_precio los insumo_id sin precio registrado hasta esa fecha
+    # (el costo_total no los incluye); si el producto no tiene receta registrada hasta esa fecha devuelve (None, [], [])
+    def costo(self, producto_id, fecha):
+        receta = self.receta(producto_id, fecha)
+        if receta is None:
+            return None, [], []
+
+        costo_total = 0.0
+        detalles = []
+        sin_precio = []
+        for insumo_id, cantidad, unidad in zip(receta['insumo_ids'], receta['cantidades'], receta['unidades']):
+            precio = self.precio(insumo_id, fecha)
+            if precio is None:
+                sin_precio.append(int(insumo_id))
+                continue
+            subtotal = precio * cantidad
+            costo_total += subtotal
+            detalles.append({
+                'insumo_id': insumo_id,
+                'insumo': None,
+                'cantidad': cantidad,
+                'unidad': unidad,
+                'precio_unitario': precio,
+                'subtotal': subtotal
+            })
+
+        for concepto, costo in zip(receta['conceptos'], receta['costos']):
+            costo_total += costo
+            detalles.append({
+                'insumo_id': None,
+                'insumo': concepto,
+                'cantidad': 1,
+                'unidad': 'servicio',
+                'precio_unitario': costo,
+                'subtotal': costo
+            })
+
+        return costo_total, detalles, sin_precio
+
+
+def _fechas(serie):
+    # Fechas sin zona horaria para poder compararlas con np.searchsorted
+    fechas = pd.to_datetime(serie, utc=True)
+    return fechas.dt.tz_localize(None)
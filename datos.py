@@ -0,0 +1,67 @@
+import pandas as pd
+
+# Tamaño de página por defecto (PostgREST devuelve como máximo 1000 filas por consulta)
+TAMANO_PAGINA = 1000
+
+# Ids por consulta en los filtros in_ (van en la URL de PostgREST, que tiene un largo máximo)
+TAMANO_LOTE_IDS = 500
+
+# Función para leer una tabla por páginas, usando paginación por clave (id > último id leído)
+# Los filtros son tuplas (método, columna, valor), por ejemplo ('gte', 'fecha', '2024-01-01')
+def leer_paginado(sb, tabla, columnas='*', filtros=None, tam_pagina=TAMANO_PAGINA, clave='id'):
+    ultimo = None
+    while True:
+        consulta = sb.table(tabla).select(columnas)
+        for metodo, columna, valor in filtros or []:
+            consulta = getattr(consulta, metodo)(columna, valor)
+        if ultimo is not None:
+            consulta = consulta.gt(clave, ultimo)
+        filas = consulta.order(clave).limit(tam_pagina).execute().data
+
+        if not filas:
+            break
+        yield pd.DataFrame(filas)
+
+        if len(filas) < tam_pagina:
+            break
+        ultimo = filas[-1][clave]
+
+
+# Ids por debajo del último procesado que se vuelven a leer en cada lectura incremental: una transacción
+# que obtuvo su id antes que otra pero confirmó después queda por debajo del último id ya leído
+VENTANA_IDS = 500
+
+
+# Función para leer las filas con id dentro de la ventana o mayor a ultimo_id, descartando las ya procesadas
+# vistos son los ids ya procesados dentro de la ventana (ver ids_en_ventana)
+def leer_filas_nuevas(sb, tabla, ultimo_id, vistos, columnas='*', filtros=None):
+    paginas = list(leer_paginado(sb, tabla, columnas, (filtros or []) + [('gt', 'id', ultimo_id - VENTANA_IDS)]))
+    if not paginas:
+        return pd.DataFrame()
+    filas = pd.concat(paginas, ignore_index=True)
+    return filas[~filas['id'].isin(list(vistos))].reset_index(drop=True)
+
+
+# Función para conservar los ids procesados que siguen dentro de la ventana de relectura
+def ids_en_ventana(vistos, nuevos, ultimo_id):
+    return {int(i) for i in list(vistos) + list(nuevos) if i > ultimo_id - VENTANA_IDS}
+
+
+# Función para leer las líneas de detalle nuevas (ver leer_filas_nuevas), junto con columnas de su cabecera
+# (por ejemplo compra_detalles con la fecha de su compra); las cabeceras se consultan por lotes de ids
+# filtros se aplica a las líneas de detalle, por ejemplo [('eq', 'sucursal_id', 2)]
+def leer_lineas_nuevas(sb, tabla_detalle, tabla, columna_fk, columnas_cabecera, ultimo_id, vistos, filtros=None):
+    detalles = leer_filas_nuevas(sb, tabla_detalle, ultimo_id, vistos, filtros=filtros)
+    if detalles.empty:
+        return detalles
+
+    ids = detalles[columna_fk].unique().tolist()
+    paginas_cabecera = []
+    for i in range(0, len(ids), TAMANO_LOTE_IDS):
+        filtros = [('in_', 'id', ids[i:i + TAMANO_LOTE_IDS])]
+        paginas_cabecera.extend(leer_paginado(sb, tabla, 'id,' + ','.join(columnas_cabecera), filtros))
+    if paginas_cabecera:
+        cabeceras = pd.concat(paginas_cabecera, ignore_index=True)
+    else:
+        cabeceras = pd.DataFrame(columns=['id'] + columnas_cabecera)
+    return detalles.merge(cabeceras.rename(columns={'id': columna_fk}), on=columna_fk, how='left')
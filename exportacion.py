@@ -0,0 +1,119 @@
+import csv
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from datos import TAMANO_LOTE_IDS, leer_paginado
+
+# Tipos de exportación disponibles
+EXPORTACIONES = {
+    'compras': 'Compras (con detalle)',
+    'consumos': 'Consumos (con detalle)',
+    'produccion': 'Producción',
+    'historico_precios': 'Histórico de Precios',
+}
+
+# Tipos de columna conocidos de las tablas exportadas: los montos y cantidades son numeric en la base
+# (PostgREST devuelve los valores enteros como int) y los ids pueden venir vacíos (por ejemplo produccion_id).
+# El resto de las columnas se exporta como texto.
+COLUMNAS_NUMERICAS = {
+    'cantidad', 'precio', 'precio_unitario', 'subtotal', 'total', 'costo_total', 'precio_venta',
+    'stock_actual', 'stock_minimo', 'costo', 'costo_adicional', 'costo_unitario',
+}
+
+
+def _es_id(columna):
+    return columna == 'id' or columna.endswith('_id')
+
+
+def _tipo_arrow(columna):
+    if columna in COLUMNAS_NUMERICAS:
+        return pa.float64()
+    if _es_id(columna):
+        return pa.int64()
+    return pa.string()
+
+
+# Función para convertir un bloque a los tipos conocidos, sin depender de lo que traiga cada página
+def _normalizar(bloque, columnas):
+    bloque = bloque.reindex(columns=columnas)
+    for columna in columnas:
+        if columna in COLUMNAS_NUMERICAS:
+            bloque[columna] = pd.to_numeric(bloque[columna], errors='coerce').astype('float64')
+        elif _es_id(columna):
+            bloque[columna] = pd.to_numeric(bloque[columna], errors='coerce').astype('Int64')
+        else:
+            bloque[columna] = bloque[columna].astype('string')
+    return bloque
+
+
+def _filtros_fecha(fecha_inicio, fecha_fin):
+    return [
+        ('gte', 'fecha', fecha_inicio.strftime('%Y-%m-%d')),
+        ('lte', 'fecha', fecha_fin.strftime('%Y-%m-%d')),
+    ]
+
+
+# Función para recorrer cabeceras y sus detalles página por página
+# Cada bloque devuelto contiene las líneas de detalle con los datos de su cabecera
+# Los detalles de cada página de cabeceras se consultan por lotes de ids (ver TAMANO_LOTE_IDS)
+def _paginas_con_detalle(sb, tabla, tabla_detalle, columna_fk, fecha_inicio, fecha_fin):
+    for cabeceras in leer_paginado(sb, tabla, filtros=_filtros_fecha(fecha_inicio, fecha_fin)):
+        cabeceras = cabeceras.rename(columns={'id': columna_fk})
+        ids = cabeceras[columna_fk].tolist()
+
+        for i in range(0, len(ids), TAMANO_LOTE_IDS):
+            filtros = [('in_', columna_fk, ids[i:i + TAMANO_LOTE_IDS])]
+            for detalles in leer_paginado(sb, tabla_detalle, filtros=filtros):
+                yield detalles.merge(cabeceras, on=columna_fk, how='left', suffixes=('', '_cabecera'))
+
+
+# Función que devuelve un generador de bloques (DataFrames) para el tipo de exportación
+def paginas_exportacion(sb, tipo, fecha_inicio, fecha_fin):
+    if tipo == 'compras':
+        return _paginas_con_detalle(sb, 'compras', 'compra_detalles', 'compra_id', fecha_inicio, fecha_fin)
+    if tipo == 'consumos':
+        return _paginas_con_detalle(sb, 'consumos', 'consumo_detalles', 'consumo_id', fecha_inicio, fecha_fin)
+    if tipo in ('produccion', 'historico_precios'):
+        return leer_paginado(sb, tipo, filtros=_filtros_fecha(fecha_inicio, fecha_fin))
+    raise ValueError(f"Tipo de exportación desconocido: {tipo}")
+
+
+def _escribir_csv(bloques, destino):
+    filas = 0
+    with open(destino, 'w', newline='', encoding='utf-8') as archivo:
+        for bloque in bloques:
+            bloque.to_csv(archivo, header=(filas == 0), index=False, quoting=csv.QUOTE_MINIMAL)
+            filas += len(bloque)
+    return filas
+
+
+def _escribir_parquet(bloques, destino):
+    filas = 0
+    escritor = None
+    esquema = None
+    try:
+        for bloque in bloques:
+            if escritor is None:
+                # El esquema sale de los tipos conocidos de cada columna, no de los valores del primer bloque
+                esquema = pa.schema([pa.field(columna, _tipo_arrow(columna)) for columna in bloque.columns])
+                escritor = pq.ParquetWriter(destino, esquema)
+            bloque = _normalizar(bloque, esquema.names)
+            escritor.write_table(pa.Table.from_pandas(bloque, schema=esquema, preserve_index=False))
+            filas += len(bloque)
+    finally:
+        if escritor is not None:
+            escritor.close()
+    return filas
+
+
+# Función para exportar un rango de fechas a CSV o Parquet sin cargar todo el histórico en memoria
+# Devuelve el número de filas escritas
+def exportar(sb, tipo, fecha_inicio, fecha_fin, destino, formato='csv'):
+    bloques = paginas_exportacion(sb, tipo, fecha_inicio, fecha_fin)
+    if formato == 'csv':
+        return _escribir_csv(bloques, destino)
+    if formato == 'parquet':
+        return _escribir_parquet(bloques, destino)
+    raise ValueError(f"Formato de exportación desconocido: {formato}")
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+# Puntos por serie que vale la pena enviar al navegador (del orden del ancho del gráfico en píxeles)
+PUNTOS_MAXIMOS = 1000
+
+# A partir de esta cantidad de puntos se dibuja con WebGL (Scattergl) en lugar de SVG
+UMBRAL_WEBGL = 1000
+
+# Periodos posibles para agrupar series diarias, de menor a mayor
+FRECUENCIAS = [('D', 'Día'), ('W-MON', 'Semana'), ('MS', 'Mes')]
+
+
+# Función para reducir una serie a lo que se puede ver en pantalla
+# Divide el eje x en tramos de igual ancho y conserva el mínimo y el máximo de cada tramo
+# (además del primer y último punto), así los picos siguen visibles
+def reducir_serie(df, x, y, puntos=PUNTOS_MAXIMOS):
+    if len(df) <= puntos:
+        return df
+    df = df.sort_values(x).reset_index(drop=True)
+    valores = df[x].astype('int64') if pd.api.types.is_datetime64_any_dtype(df[x]) else df[x].astype(float)
+    valores = valores.to_numpy()
+
+    tramos = max(puntos // 2, 1)
+    ancho = max(valores[-1] - valores[0], 1)
+    tramo = np.minimum(((valores - valores[0]) * tramos // ancho).astype('int64'), tramos - 1)
+
+    grupos = df[y].groupby(tramo)
+    indices = np.unique(np.concatenate([grupos.idxmin().to_numpy(), grupos.idxmax().to_numpy(), [0, len(df) - 1]]))
+    return df.loc[indices]
+
+
+# Función para reducir varias series (una por valor de la columna color)
+def reducir_series(df, x, y, color=None, puntos=PUNTOS_MAXIMOS):
+    if color is None:
+        return reducir_serie(df, x, y, puntos)
+    partes = [reducir_serie(grupo, x, y, puntos) for _, grupo in df.groupby(color, sort=False)]
+    return pd.concat(partes, ignore_index=True) if partes else df
+
+
+# Función para agrupar una serie diaria de sumas (consumos, gastos) en días, semanas o meses,
+# eligiendo el periodo más corto con el que cada serie tenga a lo sumo `puntos` puntos
+# Devuelve (df agrupado, nombre del periodo)
+def agrupar_periodo(df, x, y, color=None, puntos=PUNTOS_MAXIMOS):
+    if df.empty:
+        return df, FRECUENCIAS[0][1]
+    dias = (df[x].max() - df[x].min()).days + 1
+    frecuencia, nombre = FRECUENCIAS[-1]
+    for codigo, etiqueta in FRECUENCIAS:
+        if dias / {'D': 1, 'W-MON': 7, 'MS': 30}[codigo] <= puntos:
+            frecuencia, nombre = codigo, etiqueta
+            break
+    if frecuencia == 'D':
+        return df, nombre
+
+    claves = ([color] if color else []) + [pd.Grouper(key=x, freq=frecuencia, label='left', closed='left')]
+    return df.groupby(claves)[y].sum().reset_index(), nombre
+
+
+# Función para crear un gráfico de líneas con las series ya reducidas
+# Con muchos puntos se usa WebGL, que mantiene fluidos el zoom y el desplazamiento en tablets
+def figura_lineas(df, x, y, color=None, titulo=None, etiquetas=None, puntos=PUNTOS_MAXIMOS):
+    reducido = reducir_series(df, x, y, color, puntos)
+    fig = px.line(
+        reducido,
+        x=x,
+        y=y,
+        color=color,
+        title=titulo,
+        labels=etiquetas or {},
+        render_mode='webgl' if len(reducido) > UMBRAL_WEBGL else 'svg'
+    )
+    return fig
@@ -0,0 +1,282 @@
+import hashlib
+import json
+
+import pandas as pd
+
+from sucursales import SUCURSAL_PRINCIPAL
+
+# Tamaño de lote para los upserts/inserts masivos
+TAMANO_LOTE = 500
+
+# Recetas reemplazadas por llamada a reemplazar_recetas (cada llamada es una transacción)
+TAMANO_LOTE_RECETAS = 100
+
+# Columnas esperadas en cada tipo de archivo (las opcionales pueden faltar)
+IMPORTACIONES = {
+    'insumos': {
+        'titulo': 'Insumos',
+        'requeridas': ['nombre', 'categoria', 'precio_actual', 'unidad_medida'],
+        'opcionales': ['stock_actual', 'stock_minimo'],
+    },
+    'recetas': {
+        'titulo': 'Recetas (líneas y costos adicionales)',
+        'requeridas': ['producto', 'precio_venta'],
+        'opcionales': ['descripcion', 'insumo', 'cantidad', 'unidad_medida', 'concepto', 'costo'],
+    },
+    'compras': {
+        'titulo': 'Facturas de Proveedores',
+        'requeridas': ['fecha', 'proveedor', 'insumo', 'cantidad', 'precio_unitario'],
+        'opcionales': ['factura', 'tipo', 'observaciones'],
+    },
+}
+
+
+# Función para leer un archivo CSV o XLSX subido por el usuario
+def leer_archivo(archivo, nombre_archivo):
+    if nombre_archivo.lower().endswith(('.xlsx', '.xls')):
+        df = pd.read_excel(archivo)
+    else:
+        df = pd.read_csv(archivo)
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    return df
+
+
+def _normalizar(serie):
+    return serie.astype('string').str.strip().str.casefold()
+
+
+def _mapa_nombres(df, columna='nombre'):
+    if df.empty:
+        return {}
+    return dict(zip(_normalizar(df[columna]), df['id']))
+
+
+def _lotes(filas, tamano=TAMANO_LOTE):
+    for i in range(0, len(filas), tamano):
+        yield filas[i:i + tamano]
+
+
+def _upsert(sb, tabla, filas, on_conflict):
+    resultado = []
+    for lote in _lotes(filas):
+        resultado.extend(sb.table(tabla).upsert(lote, on_conflict=on_conflict).execute().data)
+    return resultado
+
+
+def _insert(sb, tabla, filas):
+    resultado = []
+    for lote in _lotes(filas):
+        resultado.extend(sb.table(tabla).insert(lote).execute().data)
+    return resultado
+
+
+def _registros(df):
+    # Convierte NaN a None para que se envíe como null
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+def _error(df, mascara, mensaje):
+    mascara = mascara.fillna(True).to_numpy(dtype=bool)
+    return pd.DataFrame({'fila': df.index[mascara] + 2, 'error': mensaje})
+
+
+# Función para validar un archivo contra los datos existentes
+# Devuelve (datos_validos, errores); los errores indican la fila del archivo (con cabecera en la fila 1)
+def validar(tipo, df, insumos, categorias):
+    especificacion = IMPORTACIONES[tipo]
+    faltantes = [c for c in especificacion['requeridas'] if c not in df.columns]
+    if faltantes:
+        return df.iloc[0:0], pd.DataFrame({'fila': [1], 'error': [f"Faltan columnas: {', '.join(faltantes)}"]})
+
+    df = df.copy()
+    for columna in especificacion['opcionales']:
+        if columna not in df.columns:
+            df[columna] = None
+
+    errores = []
+    if tipo == 'insumos':
+        df['nombre'] = df['nombre'].astype('string').str.strip()
+        df['categoria_id'] = _normalizar(df['categoria']).map(_mapa_nombres(categorias)).astype('Int64')
+        for columna in ['precio_actual', 'stock_actual', 'stock_minimo']:
+            df[columna] = pd.to_numeric(df[columna], errors='coerce')
+        df[['stock_actual', 'stock_minimo']] = df[['stock_actual', 'stock_minimo']].fillna(0.0)
+
+        errores.append(_error(df, df['nombre'].isna() | (df['nombre'] == ''), 'Nombre vacío'))
+        errores.append(_error(df, df['categoria_id'].isna(), 'Categoría no encontrada'))
+        errores.append(_error(df, ~(df['precio_actual'] > 0), 'El precio debe ser mayor que cero'))
+
+    elif tipo == 'recetas':
+        df['producto'] = df['producto'].astype('string').str.strip()
+        df['precio_venta'] = pd.to_numeric(df['precio_venta'], errors='coerce')
+        df['cantidad'] = pd.to_numeric(df['cantidad'], errors='coerce')
+        df['costo'] = pd.to_numeric(df['costo'], errors='coerce')
+        df['insumo_id'] = _normalizar(df['insumo']).map(_mapa_nombres(insumos)).astype('Int64')
+
+        es_insumo = df['insumo'].notna()
+        es_costo = df['concepto'].notna()
+        errores.append(_error(df, df['producto'].isna() | (df['producto'] == ''), 'Producto vacío'))
+        errores.append(_error(df, ~(df['precio_venta'] > 0), 'El precio de venta debe ser mayor que cero'))
+        errores.append(_error(df, es_insumo & df['insumo_id'].isna(), 'Insumo no encontrado'))
+        errores.append(_error(df, es_insumo & ~(df['cantidad'] > 0), 'La cantidad debe ser mayor que cero'))
+        errores.append(_error(df, es_costo & ~(df['costo'] >= 0), 'Costo adicional inválido'))
+        errores.append(_error(df, ~es_insumo & ~es_costo, 'La fila no tiene insumo ni concepto'))
+
+        # Cada receta se reemplaza completa: si una fila de un producto tiene errores se omite todo el producto,
+        # así una línea mal escrita no borra ese insumo de la receta existente
+        filas_con_error = df.index.isin(pd.concat(errores, ignore_index=True)['fila'] - 2)
+        claves = _normalizar(df['producto']).fillna('')
+        omitidos = set(claves[filas_con_error])
+        errores.append(_error(
+            df, pd.Series(claves.isin(omitidos) & ~filas_con_error, index=df.index),
+            'Otra fila del mismo producto tiene errores: la receta no se importa'
+        ))
+
+    elif tipo == 'compras':
+        df['fecha'] = pd.to_datetime(df['fecha'], errors='coerce')
+        df['proveedor'] = df['proveedor'].astype('string').str.strip().fillna('')
+        df['cantidad'] = pd.to_numeric(df['cantidad'], errors='coerce')
+        df['precio_unitario'] = pd.to_numeric(df['precio_unitario'], errors='coerce')
+        df['insumo_id'] = _normalizar(df['insumo']).map(_mapa_nombres(insumos)).astype('Int64')
+        df['tipo'] = df['tipo'].fillna('Regular')
+        df['observaciones'] = df['observaciones'].astype('string').fillna('')
+        df['factura'] = df['factura'].astype('string').str.strip().fillna('')
+
+        errores.append(_error(df, df['fecha'].isna(), 'Fecha inválida'))
+        errores.append(_error(df, df['insumo_id'].isna(), 'Insumo no encontrado'))
+        errores.append(_error(df, ~(df['cantidad'] > 0), 'La cantidad debe ser mayor que cero'))
+        errores.append(_error(df, ~(df['precio_unitario'] > 0), 'El precio unitario debe ser mayor que cero'))
+
+    errores = pd.concat(errores, ignore_index=True).sort_values('fila')
+    validos = df.drop(index=(errores['fila'] - 2).unique())
+    return validos, errores
+
+
+# Función para listar los productos de un archivo de recetas que no se importarán (alguna de sus filas tiene errores)
+def recetas_omitidas(df, validos):
+    if 'producto' not in df.columns:
+        return []
+    productos = df['producto'].astype('string').str.strip()
+    importados = set(_normalizar(validos['producto'])) if not validos.empty else set()
+    omitidas = {}
+    for producto, clave in zip(productos, _normalizar(productos)):
+        if not pd.isna(producto) and producto != '' and clave not in importados:
+            omitidas.setdefault(clave, producto)
+    return sorted(omitidas.values())
+
+
+# Función para importar insumos: crea los nuevos y actualiza los existentes
+# El stock actual solo se toma del archivo para insumos nuevos
+def importar_insumos(sb, df, insumos):
+    fecha = pd.Timestamp.now().strftime('%Y-%m-%d')
+    df = df.assign(clave=_normalizar(df['nombre'])).drop_duplicates('clave', keep='last')
+
+    existentes = insumos.assign(clave=_normalizar(insumos['nombre'])) if not insumos.empty else pd.DataFrame(columns=['clave', 'nombre', 'precio_actual'])
+    df = df.merge(existentes[['clave', 'nombre', 'precio_actual']], on='clave', how='left', suffixes=('', '_actual'))
+    es_nuevo = df['nombre_actual'].isna()
+    # Se respeta el nombre ya registrado para que el upsert coincida con la restricción única
+    df['nombre'] = df['nombre_actual'].fillna(df['nombre'])
+
+    columnas = ['nombre', 'categoria_id', 'precio_actual', 'stock_minimo', 'unidad_medida']
+    nuevos = _upsert(sb, 'insumos', _registros(df.loc[es_nuevo, columnas + ['stock_actual']]), 'nombre')
+    actualizados = _upsert(sb, 'insumos', _registros(df.loc[~es_nuevo, columnas]), 'nombre')
+
+    # Registrar precio histórico de insumos nuevos o con cambio de precio
+    ids = {fila['nombre']: fila['id'] for fila in nuevos + actualizados}
+    cambio_precio = es_nuevo | (df['precio_actual'] != df['precio_actual_actual'])
+    historico = pd.DataFrame({
+        'insumo_id': df.loc[cambio_precio, 'nombre'].map(ids),
+        'precio': df.loc[cambio_precio, 'precio_actual'],
+        'fecha': fecha,
+    })
+    _insert(sb, 'historico_precios', _registros(historico))
+
+    return {'nuevos': len(nuevos), 'actualizados': len(actualizados)}
+
+
+# Función para importar recetas: crea o actualiza productos y reemplaza sus líneas y costos adicionales
+# Las líneas se reemplazan con reemplazar_recetas (sql/012), que también sube receta_version y registra
+# la versión en el historial en la misma transacción: un error no deja recetas vacías ni a medias
+# Los productos existentes se reconocen sin distinguir mayúsculas y conservan su nombre registrado
+def importar_recetas(sb, df, productos_existentes):
+    df = df.assign(clave=_normalizar(df['producto']))
+    cabeceras = df.drop_duplicates('clave', keep='last')
+    nombres = dict(zip(_normalizar(productos_existentes['nombre']), productos_existentes['nombre'])) if not productos_existentes.empty else {}
+
+    productos = _upsert(sb, 'productos', _registros(pd.DataFrame({
+        'nombre': cabeceras['clave'].map(nombres).fillna(cabeceras['producto']),
+        'descripcion': cabeceras['descripcion'].fillna(''),
+        'precio_venta': cabeceras['precio_venta'],
+    })), 'nombre')
+
+    ids = {str(p['nombre']).strip().casefold(): p['id'] for p in productos}
+    df['producto_id'] = df['clave'].map(ids)
+
+    lineas = df[df['insumo_id'].notna()].drop_duplicates(['producto_id', 'insumo_id'], keep='last')
+    lineas = lineas.assign(unidad_medida=lineas['unidad_medida'].fillna('unidad'))
+    costos = df[df['concepto'].notna()].drop_duplicates(['producto_id', 'concepto'], keep='last')
+
+    lineas_por_producto = {
+        int(k): _registros(g[['insumo_id', 'cantidad', 'unidad_medida']]) for k, g in lineas.groupby('producto_id')
+    }
+    costos_por_producto = {int(k): _registros(g[['concepto', 'costo']]) for k, g in costos.groupby('producto_id')}
+    recetas = [
+        {
+            'producto_id': int(p['id']),
+            'insumos': lineas_por_producto.get(int(p['id']), []),
+            'costos': costos_por_producto.get(int(p['id']), []),
+        }
+        for p in productos
+    ]
+    for lote in _lotes(recetas, TAMANO_LOTE_RECETAS):
+        sb.rpc('reemplazar_recetas', {'recetas': lote}).execute()
+
+    return {'productos': len(productos), 'lineas': len(lineas), 'costos': len(costos)}
+
+
+# Función para calcular la clave de idempotencia de una factura importada
+# Con número de factura la clave es (fecha, proveedor, factura); sin número se usan también sus líneas,
+# así volver a importar el mismo archivo no duplica compras ni vuelve a sumar stock
+def _clave_factura(cabecera, lineas):
+    partes = [cabecera['fecha'], cabecera['proveedor'].strip().casefold(), cabecera['factura']]
+    if not cabecera['factura']:
+        partes.append(json.dumps(sorted(
+            [linea['insumo_id'], linea['cantidad'], linea['precio_unitario']] for linea in lineas
+        )))
+    return 'importacion:' + hashlib.sha256('|'.join(partes).encode('utf-8')).hexdigest()
+
+
+# Función para importar facturas: una compra por (fecha, proveedor, factura) con sus detalles
+# Cada factura se registra con registrar_compra, igual que el formulario: suma el stock de la sucursal
+# y es idempotente gracias a su clave
+def importar_compras(sb, df, sucursal=SUCURSAL_PRINCIPAL):
+    df = df.drop_duplicates()
+    df = df.assign(
+        fecha=df['fecha'].dt.strftime('%Y-%m-%d'),
+        subtotal=(df['cantidad'] * df['precio_unitario']).round(2),
+    )
+    grupo = ['fecha', 'proveedor', 'factura']
+    cabeceras = df.groupby(grupo, sort=False).agg(
+        tipo=('tipo', 'first'),
+        observaciones=('observaciones', 'first'),
+        total=('subtotal', 'sum'),
+    ).reset_index()
+    con_factura = cabeceras['factura'] != ''
+    cabeceras.loc[con_factura, 'observaciones'] = (
+        'Factura ' + cabeceras.loc[con_factura, 'factura'] + '. ' + cabeceras.loc[con_factura, 'observaciones']
+    ).str.strip()
+
+    detalles = 0
+    lineas_por_factura = df.groupby(grupo, sort=False)
+    for cabecera in _registros(cabeceras):
+        lineas = _registros(lineas_por_factura.get_group(tuple(cabecera[c] for c in grupo))[
+            ['insumo_id', 'cantidad', 'precio_unitario', 'subtotal']
+        ])
+        sb.rpc('registrar_compra', {
+            'clave': _clave_factura(cabecera, lineas),
+            'compra': {c: cabecera[c] for c in ['fecha', 'proveedor', 'tipo', 'observaciones', 'total']},
+            'detalles': lineas,
+            'sucursal': int(sucursal),
+        }).execute()
+        detalles += len(lineas)
+
+    return {'compras': len(cabeceras), 'detalles': detalles}
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import cache_disco
+
+# Segundos entre consultas a la tabla de cambios
+INTERVALO_SONDEO = 3
+
+# Vigencia de cada tabla: más larga si llegan avisos de cambios, corta si no (sin tabla cambios)
+# Con avisos el vencimiento solo acota cuánto dura un aviso perdido
+TTL_CON_AVISOS = 10 * 60
+TTL_SIN_AVISOS = 120
+
+# Ids de la tabla cambios por debajo del último leído que se vuelven a leer en cada consulta:
+# un aviso cuya transacción confirmó después que otra con id mayor queda por debajo del último leído
+VENTANA_CAMBIOS = 200
+
+
+# Datos compartidos por todas las sesiones del proceso
+# Cada tabla se recarga una sola vez aunque varias sesiones la pidan a la vez (las demás esperan
+# y reutilizan el resultado), y se marca como desactualizada al llegar un aviso en la tabla cambios
+class Instantanea:
+    def __init__(self, sb, tablas, cargar=cache_disco.cargar_tabla, intervalo=INTERVALO_SONDEO):
+        self._sb = sb
+        self._cargar = cargar
+        self._intervalo = intervalo
+        self._datos = {}
+        self._versiones = {tabla: 0 for tabla in tablas}
+        # Contadores de avisos: la tabla está vigente si ya se cargó con el último aviso recibido
+        self._avisos = {tabla: 0 for tabla in tablas}
+        self._cargado_con = {}
+        self._vigente_hasta = {}
+        self._candados = {tabla: threading.Lock() for tabla in tablas}
+        self._despertar = threading.Event()
+        self._ultimo_cambio = None
+        self._cambios_vistos = set()
+        self._avisos_activos = False
+        self._hilo = None
+        # (momento, mensaje) del último error al consultar avisos o recargar tablas; None si el último ciclo terminó bien
+        self.error = None
+
+    def _vigente(self, tabla):
+        return (
+            tabla in self._datos
+            and self._cargado_con.get(tabla) == self._avisos[tabla]
+            and time.time() < self._vigente_hasta[tabla]
+        )
+
+    def _obtener(self, tabla):
+        if not self._vigente(tabla):
+            with self._candados[tabla]:
+                # Otra sesión pudo haberla recargado mientras se esperaba el candado
+                if not self._vigente(tabla):
+                    avisos = self._avisos[tabla]
+                    self._datos[tabla] = self._cargar(self._sb, tabla)
+                    self._cargado_con[tabla] = avisos
+                    self._vigente_hasta[tabla] = time.time() + (TTL_CON_AVISOS if self._avisos_activos else TTL_SIN_AVISOS)
+                    self._versiones[tabla] += 1
+        return self._datos[tabla]
+
+    # Función para obtener una tabla; por defecto devuelve una copia que la sesión puede modificar
+    def tabla(self, tabla, copiar=True):
+        df = self._obtener(tabla)
+        return df.copy() if copiar else df
+
+    # Función para obtener la versión de los datos de una tabla (sirve como clave de caché)
+    def version(self, tabla):
+        self._obtener(tabla)
+        return self._versiones[tabla]
+
+    # Función para marcar tablas como modificadas (por ejemplo, después de una escritura local)
+    def marcar(self, *tablas):
+        for tabla in tablas:
+            if tabla in self._avisos:
+                self._avisos[tabla] += 1
+        self._despertar.set()
+
+    # Función para iniciar el proceso que consulta la tabla cambios y recarga las tablas afectadas
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._ciclo, name="instantanea", daemon=True)
+            self._hilo.start()
+
+    def _sondear(self):
+        if self._ultimo_cambio is None:
+            filas = self._sb.table('cambios').select('id').order('id', desc=True).limit(VENTANA_CAMBIOS).execute().data
+            self._ultimo_cambio = filas[0]['id'] if filas else 0
+            self._cambios_vistos = {fila['id'] for fila in filas}
+            self._avisos_activos = True
+            return
+
+        filas = self._sb.table('cambios').select('id,tabla').gt(
+            'id', self._ultimo_cambio - VENTANA_CAMBIOS
+        ).order('id').limit(1000).execute().data
+        self._avisos_activos = True
+        nuevas = [fila for fila in filas if fila['id'] not in self._cambios_vistos]
+        if nuevas:
+            self._ultimo_cambio = max(self._ultimo_cambio, filas[-1]['id'])
+            self._cambios_vistos = {
+                id_cambio for id_cambio in self._cambios_vistos | {fila['id'] for fila in nuevas}
+                if id_cambio > self._ultimo_cambio - VENTANA_CAMBIOS
+            }
+            self.marcar(*{fila['tabla'] for fila in nuevas})
+
+    def _ciclo(self):
+        while True:
+            error = None
+            try:
+                self._sondear()
+            except Exception as e:
+                # Sin tabla cambios o sin conexión: las tablas se recargan por vencimiento
+                self._avisos_activos = False
+                error = f"Avisos de cambios: {e}"
+            # Las tablas ya cargadas se actualizan aquí para que las sesiones no esperen la recarga
+            for tabla in list(self._datos):
+                try:
+                    self._obtener(tabla)
+                except Exception as e:
+                    error = f"Recarga de {tabla}: {e}"
+            if error is None:
+                self.error = None
+            elif self.error is None:
+                self.error = (time.time(), error)
+            else:
+                # Se conserva el momento del primer error: desde entonces los datos pueden estar desactualizados
+                self.error = (self.error[0], error)
+            self._despertar.wait(self._intervalo)
+            self._despertar.clear()
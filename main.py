@@ -4,9 +4,28 @@ import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
 import os
+import tempfile
 from dotenv import load_dotenv
 from supabase import create_client
 
+import cache_disco
+from cola_escritura import ColaEscritura, ENVIADO, PENDIENTE, RECHAZADO
+from costos import IndiceCostoHistorico, desglose_costo, margenes_historicos, margenes_productos, costo_insumos_producidos
+from datos import leer_paginado
+from exportacion import EXPORTACIONES, exportar
+from graficos import agrupar_periodo, figura_lineas
+from importacion import IMPORTACIONES, leer_archivo, validar, importar_insumos, importar_recetas, importar_compras, recetas_omitidas
+from instantanea import Instantanea
+import opciones
+from precalculo import Precalculador
+import proveedores
+from recetas import ConflictoReceta, cargar_lineas, crear_receta, guardar_receta
+from reportes import PERIODOS, produccion_por_periodo
+from stock import alertas_stock
+import sucursales
+import valorizacion
+import variacion
+
 # Configuración de página
 st.set_page_config(
     page_title="Pastelería D'Pandos - Sistema de Gestión",
@@ -19,53 +38,371 @@ load_dotenv()
 #sb = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
 sb = create_client(st.secrets["supabase"]["SUPABASE_URL"],st.secrets["supabase"]["SUPABASE_KEY"])
 
+# Datos compartidos por todas las sesiones: cada tabla se carga una sola vez por proceso
+# (a través de la caché en disco) y se actualiza al recibir avisos de la tabla cambios
+TABLAS_COMPARTIDAS = ['insumos', 'categorias', 'productos', 'historico_precios', 'receta_versiones', 'proveedores', 'sucursales']
+
+@st.cache_resource
+def obtener_instantanea():
+    instantanea = Instantanea(sb, TABLAS_COMPARTIDAS)
+    instantanea.iniciar()
+    return instantanea
+
+# Instantáneas de sucursal ya creadas en el proceso, para que la cola de escrituras las marque
+# desde su hilo sin llamar a funciones cacheadas de Streamlit
+@st.cache_resource
+def instantaneas_sucursales():
+    return {}
+
+# Producción, compras y stock pertenecen a una sucursal: cada sucursal tiene su propia instantánea
+# y sus propios archivos de caché, así agregar una sucursal no agranda las cargas de las demás
+@st.cache_resource
+def obtener_instantanea_sucursal(sucursal_id):
+    instantanea = Instantanea(
+        sb,
+        sucursales.TABLAS_POR_SUCURSAL,
+        cargar=lambda sb, tabla: cache_disco.cargar_tabla(sb, tabla, sucursal_id)
+    )
+    instantanea.iniciar()
+    instantaneas_sucursales()[sucursal_id] = instantanea
+    return instantanea
+
+def cargar_sucursales():
+    return obtener_instantanea().tabla('sucursales', copiar=False)
+
+def ids_sucursales():
+    sucursales_df = cargar_sucursales()
+    if sucursales_df.empty:
+        return [sucursales.SUCURSAL_PRINCIPAL]
+    return sucursales_df[sucursales_df['activa']].sort_values('id')['id'].tolist()
+
+# Sucursal elegida en la barra lateral para esta sesión
+def sucursal_actual():
+    return st.session_state.get('sucursal_id', sucursales.SUCURSAL_PRINCIPAL)
+
 # Función para cargar datos
-@st.cache_data(ttl=300)
-def cargar_insumos():
-    response = sb.table('insumos').select('*').execute()
-    return pd.DataFrame(response.data)
+# Los insumos son del catálogo compartido, con el stock de la sucursal indicada (por defecto la actual)
+def cargar_insumos(sucursal_id=None):
+    sucursal_id = sucursal_actual() if sucursal_id is None else sucursal_id
+    return sucursales.insumos_con_stock(
+        obtener_instantanea().tabla('insumos'),
+        obtener_instantanea_sucursal(sucursal_id).tabla('stock_sucursal', copiar=False)
+    )
 
-@st.cache_data(ttl=300)
 def cargar_categorias():
-    response = sb.table('categorias').select('*').execute()
-    return pd.DataFrame(response.data)
+    return obtener_instantanea().tabla('categorias')
 
-@st.cache_data(ttl=300)
 def cargar_productos():
-    response = sb.table('productos').select('*').execute()
-    return pd.DataFrame(response.data)
+    return obtener_instantanea().tabla('productos')
 
-@st.cache_data(ttl=300)
-def cargar_receta_insumos(producto_id):
+# Las líneas de receta se cachean por versión: al guardar una receta se incrementa su versión
+# y solo se invalida la caché de ese producto
+@st.cache_data(ttl=3600)
+def _cargar_receta_insumos(producto_id, version):
     response = sb.table('receta_insumos').select('*').eq('producto_id', producto_id).execute()
     return pd.DataFrame(response.data)
 
-@st.cache_data(ttl=300)
-def cargar_historico_precios():
-    response = sb.table('historico_precios').select('*').execute()
+@st.cache_data(ttl=3600)
+def _cargar_costos_adicionales(producto_id, version):
+    response = sb.table('receta_costos_adicionales').select('*').eq('producto_id', producto_id).execute()
     return pd.DataFrame(response.data)
 
-@st.cache_data(ttl=300)
+def obtener_version_receta(producto_id):
+    productos = obtener_instantanea().tabla('productos', copiar=False)
+    producto = productos[productos['id'] == producto_id]
+    if not producto.empty and 'receta_version' in producto.columns:
+        return int(producto.iloc[0]['receta_version'])
+    return 1
+
+def cargar_receta_insumos(producto_id):
+    return _cargar_receta_insumos(producto_id, obtener_version_receta(producto_id))
+
+def cargar_costos_adicionales(producto_id):
+    return _cargar_costos_adicionales(producto_id, obtener_version_receta(producto_id))
+
+def cargar_historico_precios():
+    return obtener_instantanea().tabla('historico_precios')
+
+# Listas de opciones (id, etiqueta) compartidas por todos los formularios
+# Se reconstruyen solo cuando cambia la versión de la tabla de origen
+# Las opciones con stock dependen además de la sucursal y de la versión de su stock
+@st.cache_resource(max_entries=32)
+def _cargar_opciones(tipo, version, sucursal_id=None):
+    if sucursal_id is not None:
+        return opciones.construir(tipo, cargar_insumos(sucursal_id))
+    tabla = opciones.TIPOS[tipo][0]
+    return opciones.construir(tipo, obtener_instantanea().tabla(tabla, copiar=False))
+
+def cargar_opciones(tipo):
+    version = obtener_instantanea().version(opciones.TIPOS[tipo][0])
+    if tipo == 'insumos_stock':
+        sucursal_id = sucursal_actual()
+        version = (version, obtener_instantanea_sucursal(sucursal_id).version('stock_sucursal'))
+        return _cargar_opciones(tipo, version, sucursal_id)
+    return _cargar_opciones(tipo, version)
+
+# Función para mostrar un selectbox con opciones precalculadas
+# Con catálogos grandes agrega una búsqueda por texto y muestra solo los resultados; dentro de un
+# formulario la búsqueda no se actualiza hasta enviarlo, por eso allí se usa buscar=False
+def seleccionar_opcion(etiqueta, tipo, key=None, buscar=True):
+    lista = cargar_opciones(tipo)
+    ids = lista.ids
+    if buscar and len(lista) > opciones.LIMITE_SIN_BUSQUEDA:
+        texto = st.text_input(f"Buscar {etiqueta.rstrip(':').lower()}:", key=f"buscar_{key or etiqueta}")
+        ids = lista.buscar(texto)
+        # La opción elegida se mantiene aunque no esté entre los resultados
+        actual = st.session_state.get(key) if key else None
+        if actual is not None and actual not in ids:
+            ids = [actual] + ids
+    return st.selectbox(etiqueta, options=ids, format_func=lista.etiqueta, key=key)
+
+# Índice de versiones de receta y precios históricos para costear en fechas pasadas
+# Se reconstruye solo cuando cambia la versión de alguna de las dos tablas
+@st.cache_resource(max_entries=2)
+def _cargar_indice_costos(version_recetas, version_precios):
+    instantanea = obtener_instantanea()
+    return IndiceCostoHistorico(
+        instantanea.tabla('receta_versiones', copiar=False),
+        instantanea.tabla('historico_precios', copiar=False)
+    )
+
+def cargar_indice_costos():
+    instantanea = obtener_instantanea()
+    return _cargar_indice_costos(instantanea.version('receta_versiones'), instantanea.version('historico_precios'))
+
 def cargar_produccion():
-    response = sb.table('produccion').select('*').execute()
-    return pd.DataFrame(response.data)
+    return obtener_instantanea_sucursal(sucursal_actual()).tabla('produccion')
 
-@st.cache_data(ttl=300)
 def cargar_compras():
-    response = sb.table('compras').select('*').execute()
-    return pd.DataFrame(response.data)
+    return obtener_instantanea_sucursal(sucursal_actual()).tabla('compras')
+
+def cargar_proveedores():
+    return obtener_instantanea().tabla('proveedores')
+
+# Índice de líneas de compra por (insumo, proveedor, fecha): se restaura desde disco y
+# solo consulta líneas nuevas cuando cambia la versión de la tabla compras de alguna sucursal
+# (los precios de proveedores se comparan entre todas las sucursales)
+@st.cache_resource
+def obtener_indice_compras():
+    return proveedores.cargar()
+
+def cargar_indice_compras():
+    indice = obtener_indice_compras()
+    version = tuple(obtener_instantanea_sucursal(s).version('compras') for s in ids_sucursales())
+    if indice.version_datos != version:
+        indice.actualizar(sb)
+        indice.version_datos = version
+    return indice
+
+# Con sucursal_id=None se consolidan todas las sucursales
+@st.cache_data(ttl=300)
+def cargar_resumen_produccion(fecha_inicio, fecha_fin, periodo, sucursal_id=None):
+    return produccion_por_periodo(sb, fecha_inicio, fecha_fin, periodo, cargar_productos(), sucursal_id)
+
+@st.cache_data(ttl=300)
+def cargar_costos_produccion(fecha_inicio, fecha_fin, sucursal_id=None):
+    filtros = [('gte', 'fecha', str(fecha_inicio)), ('lte', 'fecha', str(fecha_fin))]
+    if sucursal_id is not None:
+        filtros.append(('eq', 'sucursal_id', sucursal_id))
+    paginas = list(leer_paginado(sb, 'produccion_costos', filtros=filtros, clave='produccion_id'))
+    return pd.concat(paginas, ignore_index=True) if paginas else pd.DataFrame()
+
+# Valorización de inventario por proceso y sucursal: se restaura desde disco y se actualiza solo con movimientos nuevos
+@st.cache_resource
+def obtener_valorizador(metodo, sucursal_id):
+    return valorizacion.cargar(metodo, sucursal_id)
+
+# Resumen diario de consumo teórico vs real por sucursal: se restaura desde disco y se actualiza solo con movimientos nuevos
+@st.cache_resource
+def obtener_variacion(sucursal_id):
+    return variacion.cargar(sucursal_id)
+
+# Márgenes, consumo diario y alertas de stock se calculan en segundo plano cuando cambian sus tablas
+# o después de una escritura; las páginas solo leen el último resultado publicado
+# Las tareas de cada sucursal se registran la primera vez que se usan (ver tareas_sucursal)
+@st.cache_resource
+def obtener_precalculador():
+    instantanea = obtener_instantanea()
+    precalculador = Precalculador(instantanea)
+    
+    def margenes():
+        receta_insumos, costos_adicionales = cargar_lineas(sb)
+        return margenes_productos(
+            instantanea.tabla('productos', copiar=False),
+            instantanea.tabla('insumos', copiar=False),
+            receta_insumos,
+            costos_adicionales
+        )
+    
+    precalculador.registrar('margenes', margenes, tablas=['productos', 'insumos'])
+    precalculador.iniciar()
+    return precalculador
+
+# Función para registrar (una sola vez) las tareas de una sucursal y devolver sus nombres
+# (consumo diario, alertas de stock); dependen de las tablas de la instantánea de la sucursal
+@st.cache_resource
+def tareas_sucursal(sucursal_id):
+    instantanea = obtener_instantanea()
+    instantanea_sucursal = obtener_instantanea_sucursal(sucursal_id)
+    variacion_diaria = obtener_variacion(sucursal_id)
+    precalculador = obtener_precalculador()
+    nombres = {'consumo_diario': f"consumo_diario_{sucursal_id}", 'alertas_stock': f"alertas_stock_{sucursal_id}"}
+    
+    def consumo_diario():
+        variacion_diaria.actualizar(sb, instantanea.tabla('receta_versiones', copiar=False))
+        return variacion_diaria.consumo_diario()
+    
+    def alertas():
+        return alertas_stock(cargar_insumos(sucursal_id))
+    
+    # Los consumos manuales no tienen tabla en la instantánea, pero siempre mueven stock_sucursal
+    precalculador.registrar(
+        nombres['consumo_diario'], consumo_diario, tablas=['produccion', 'compras', 'stock_sucursal'], instantanea=instantanea_sucursal
+    )
+    precalculador.registrar(
+        nombres['alertas_stock'], alertas, tablas=['stock_sucursal'], instantanea=instantanea_sucursal
+    )
+    precalculador.solicitar(*nombres.values())
+    return nombres
+
+# Función para elegir el alcance de un reporte: la sucursal actual o todas (consolidado)
+# Devuelve la lista de sucursales a sumar
+def seleccionar_alcance(key):
+    ids = ids_sucursales()
+    if len(ids) < 2:
+        return [sucursal_actual()]
+    alcance = st.radio(
+        "Alcance:",
+        ["Sucursal actual", "Todas las sucursales"],
+        horizontal=True,
+        key=key
+    )
+    return ids if alcance == "Todas las sucursales" else [sucursal_actual()]
+
+# Figuras de reportes cacheadas por parámetros de filtro y versión de los datos
+# (los argumentos con guion bajo no forman parte de la clave de la caché)
+@st.cache_resource(max_entries=32)
+def _figura_precios(_historico_precios, insumo_ids, fecha_inicio, fecha_fin, version):
+    historico = _historico_precios
+    fechas = pd.to_datetime(historico['fecha'])
+    datos_filtrados = historico[
+        (historico['insumo_id'].isin(insumo_ids)) &
+        (fechas >= pd.to_datetime(fecha_inicio)) &
+        (fechas < pd.to_datetime(fecha_fin) + timedelta(days=1))
+    ].assign(fecha=lambda df: pd.to_datetime(df['fecha']))
+    insumos = obtener_instantanea().tabla('insumos', copiar=False)
+    nombres = dict(zip(insumos['id'], insumos['nombre']))
+    datos_filtrados['insumo'] = datos_filtrados['insumo_id'].map(nombres)
+    
+    fig = figura_lineas(
+        datos_filtrados,
+        x='fecha',
+        y='precio',
+        color='insumo',
+        titulo='Evolución de Precios de Insumos',
+        etiquetas={'fecha': 'Fecha', 'precio': 'Precio (S/)', 'insumo': 'Insumo'}
+    )
+    return fig, datos_filtrados[['fecha', 'insumo', 'precio']]
+
+@st.cache_resource(max_entries=32)
+def _figura_tendencia_consumo(_consumos, insumos_seleccionados, fecha_inicio, fecha_fin, version):
+    tendencia = _consumos[_consumos['insumo_nombre'].isin(insumos_seleccionados)]
+    # Con rangos largos se agrupa por semana o mes para no enviar más puntos de los que se ven
+    tendencia, periodo = agrupar_periodo(tendencia, 'dia', 'cantidad', color='insumo_nombre')
+    return figura_lineas(
+        tendencia,
+        x='dia',
+        y='cantidad',
+        color='insumo_nombre',
+        titulo=f'Tendencia de Consumo por {periodo}',
+        etiquetas={'dia': 'Fecha', 'cantidad': 'Cantidad Consumida', 'insumo_nombre': 'Insumo'}
+    )
+
+# Función para leer un resultado calculado en segundo plano; si aún no hay uno lo indica en la página
+def leer_precalculado(nombre):
+    datos, _, calculado = obtener_precalculador().resultado(nombre)
+    if datos is None:
+        st.info("Los datos se están calculando. Vuelve a cargar la página en unos segundos.")
+    else:
+        st.caption(f"Actualizado: {datetime.fromtimestamp(calculado).strftime('%d/%m/%Y %H:%M')}")
+    return datos
+
+# Función para leer el mismo resultado de varias sucursales y sumarlo por claves
+# Si alguna sucursal aún no tiene resultado se indica en la página y se devuelve None
+def leer_precalculado_sucursales(tarea, sucursal_ids, claves, valores):
+    resultados = [obtener_precalculador().resultado(tareas_sucursal(s)[tarea]) for s in sucursal_ids]
+    if any(datos is None for datos, _, _ in resultados):
+        st.info("Los datos se están calculando. Vuelve a cargar la página en unos segundos.")
+        return None, 0
+    calculado = min(calculado for _, _, calculado in resultados)
+    st.caption(f"Actualizado: {datetime.fromtimestamp(calculado).strftime('%d/%m/%Y %H:%M')}")
+    version = tuple((s, version) for s, (_, version, _) in zip(sucursal_ids, resultados))
+    if len(resultados) == 1:
+        return resultados[0][0], version
+    return sucursales.consolidar([datos for datos, _, _ in resultados], claves, valores), version
+
+# Cola local de escrituras: las operaciones se guardan al instante y se envían en segundo plano
+# La cola es del proceso (no conoce la sesión), por eso se marcan las tablas de todas las sucursales.
+# Al enviar corre en el hilo de la cola: solo marca tablas de instantáneas ya creadas (seguro entre hilos)
+# y las sesiones y el precalculador ven la nueva versión en su siguiente lectura
+@st.cache_resource
+def obtener_cola():
+    instantanea = obtener_instantanea()
+    por_sucursal = instantaneas_sucursales()
+    
+    def limpiar_cache_movimientos():
+        instantanea.marcar('insumos', 'historico_precios', 'proveedores')
+        for instantanea_sucursal in list(por_sucursal.values()):
+            instantanea_sucursal.marcar(*sucursales.TABLAS_POR_SUCURSAL)
+    
+    cola = ColaEscritura(sb, al_enviar=limpiar_cache_movimientos)
+    cola.iniciar()
+    return cola
+
+# Función para guardar una operación en la cola y esperar brevemente su confirmación
+# La operación se registra en la sucursal actual de la sesión
+# Devuelve (estado, error, resultado); con conexión lenta la operación queda pendiente
+def guardar_en_cola(tipo, datos):
+    cola = obtener_cola()
+    clave = cola.encolar(tipo, dict(datos, sucursal=int(sucursal_actual())))
+    return cola.esperar(clave)
+
+def mostrar_estado_cola(estado, error, mensaje_exito):
+    if estado == ENVIADO:
+        st.success(mensaje_exito)
+    elif estado == RECHAZADO:
+        st.error(error)
+    else:
+        st.info("Guardado localmente. Se sincronizará automáticamente cuando la conexión responda.")
+
+# Función para eliminar un archivo temporal (por ejemplo una exportación descartada)
+def eliminar_archivo(ruta):
+    try:
+        os.remove(ruta)
+    except OSError:
+        pass
 
 # Función para obtener nombre de insumo
 def obtener_nombre_insumo(insumo_id):
-    insumos = cargar_insumos()
+    insumos = obtener_instantanea().tabla('insumos', copiar=False)
     insumo = insumos[insumos['id'] == insumo_id]
     if not insumo.empty:
         return insumo.iloc[0]['nombre']
     return "Insumo no encontrado"
 
+# Función para obtener nombre de proveedor
+def obtener_nombre_proveedor(proveedor_id):
+    proveedores_df = obtener_instantanea().tabla('proveedores', copiar=False)
+    if proveedores_df.empty:
+        return "Proveedor no encontrado"
+    proveedor = proveedores_df[proveedores_df['id'] == proveedor_id]
+    if not proveedor.empty:
+        return proveedor.iloc[0]['nombre']
+    return "Proveedor no encontrado"
+
 # Función para obtener nombre de categoría
 def obtener_nombre_categoria(categoria_id):
-    categorias = cargar_categorias()
+    categorias = obtener_instantanea().tabla('categorias', copiar=False)
     categoria = categorias[categorias['id'] == categoria_id]
     if not categoria.empty:
         return categoria.iloc[0]['nombre']
@@ -73,7 +410,7 @@ def obtener_nombre_categoria(categoria_id):
 
 # Nueva función para obtener el precio actual directamente de la tabla insumos
 def obtener_precio_actual(insumo_id):
-    insumos = cargar_insumos()
+    insumos = obtener_instantanea().tabla('insumos', copiar=False)
     insumo = insumos[insumos['id'] == insumo_id]
     if not insumo.empty:
         return insumo.iloc[0]['precio_actual']
@@ -83,7 +420,7 @@ def obtener_precio_actual(insumo_id):
 def calcular_costo_receta(producto_id):
     # Obtener insumos de la receta
     receta_insumos = cargar_receta_insumos(producto_id)
-    insumos = cargar_insumos()
+    insumos = obtener_instantanea().tabla('insumos', copiar=False)
     
     costo_total = 0
     detalles = []
@@ -106,8 +443,7 @@ def calcular_costo_receta(producto_id):
             })
     
     # Obtener costos adicionales
-    response = sb.table('receta_costos_adicionales').select('*').eq('producto_id', producto_id).execute()
-    costos_adicionales = pd.DataFrame(response.data)
+    costos_adicionales = cargar_costos_adicionales(producto_id)
     
     for _, costo in costos_adicionales.iterrows():
         costo_total += costo['costo']
@@ -125,12 +461,46 @@ def calcular_costo_receta(producto_id):
 st.sidebar.image("https://scontent.flim9-1.fna.fbcdn.net/v/t39.30808-6/301893190_443547794459140_2944011405632948968_n.jpg?_nc_cat=109&ccb=1-7&_nc_sid=6ee11a&_nc_eui2=AeHPs2DTVyE6QunWMvboCNhPe05rJlI_0CN7TmsmUj_QIwZVNGi7n9miYoyx_6voNOX3rzyYuRPDJNhCcibugrpu&_nc_ohc=P3MOKoAaHw4Q7kNvwHHIMcE&_nc_oc=Adkbu6xjQ67RXJicCtJkeK4qt7alhVdta5c8pvD9lkq-9-0CE585UDdS3KY_ybotHdRTiizftD2p7OVl8NjVPbpQ&_nc_zt=23&_nc_ht=scontent.flim9-1.fna&_nc_gid=wLYEMkiGf_tJSHMrfD96Tw&oh=00_AfHVcPIxfQew61sET-hCOFeJQAtbtW6dDR00VRrVsqLMbw&oe=681D4DE8", width=150)
 st.sidebar.title("Pastelería D'Pandos")
 
+# Sucursal de trabajo: compras, consumos, producción y stock se registran y muestran por sucursal
+sucursales_activas = cargar_sucursales()
+if len(ids_sucursales()) > 1:
+    nombres_sucursales = dict(zip(sucursales_activas['id'], sucursales_activas['nombre']))
+    st.sidebar.selectbox(
+        "Sucursal:",
+        options=ids_sucursales(),
+        format_func=lambda x: nombres_sucursales.get(x, f"Sucursal {x}"),
+        key='sucursal_id'
+    )
+
 # Menú principal
 menu = st.sidebar.radio(
     "Menú Principal",
     ["Compras", "Consumos", "Recetas", "Registrar Insumos", "Reportes", "Configuración"]
 )
 
+# Aviso si los datos compartidos no se pudieron actualizar en el último ciclo
+for instantanea_pagina in (obtener_instantanea(), obtener_instantanea_sucursal(sucursal_actual())):
+    if instantanea_pagina.error:
+        desde, mensaje = instantanea_pagina.error
+        st.sidebar.warning(f"Datos posiblemente desactualizados desde {datetime.fromtimestamp(desde).strftime('%H:%M')} ({mensaje}).")
+        break
+
+# Estado de la cola de escrituras
+resumen_cola = obtener_cola().resumen()
+if resumen_cola.get(PENDIENTE):
+    st.sidebar.warning(f"{resumen_cola[PENDIENTE]} operación(es) pendiente(s) de sincronizar.")
+if resumen_cola.get(RECHAZADO):
+    with st.sidebar.expander(f"{resumen_cola[RECHAZADO]} operación(es) rechazada(s)"):
+        for operacion in obtener_cola().rechazadas():
+            st.write(f"**{operacion['tipo'].capitalize()}** ({datetime.fromtimestamp(operacion['creado']).strftime('%d/%m %H:%M')}): {operacion['error']}")
+            col1, col2 = st.columns(2)
+            if col1.button("Reintentar", key=f"reintentar_{operacion['clave']}"):
+                obtener_cola().reintentar(operacion['clave'])
+                st.rerun()
+            if col2.button("Descartar", key=f"descartar_{operacion['clave']}"):
+                obtener_cola().descartar(operacion['clave'])
+                st.rerun()
+
 # Página de Compras
 if menu == "Compras":
     st.title("Compra del Día")
@@ -142,7 +512,12 @@ if menu == "Compras":
             "Tipo de Compra:",
             ["Regular", "Extra"]
         )
-        proveedor = st.text_input("Proveedor:", "")
+        # Proveedores registrados; uno nuevo se crea al guardar la compra
+        proveedores_df = cargar_proveedores()
+        nombres_proveedores = sorted(proveedores_df['nombre'].tolist()) if not proveedores_df.empty else []
+        proveedor = st.selectbox("Proveedor:", [""] + nombres_proveedores + ["Nuevo proveedor..."])
+        if proveedor == "Nuevo proveedor...":
+            proveedor = st.text_input("Nombre del Proveedor:", "")
     
     # Inicializar la sesión si no existe
     if 'items_compra' not in st.session_state:
@@ -156,12 +531,7 @@ if menu == "Compras":
         st.session_state.insumo_id = insumos['id'].iloc[0] if not insumos.empty else None
     
     # Actualizar el precio cuando cambia el insumo (fuera del formulario)
-    insumo_id = st.selectbox(
-        "Insumo:",
-        options=insumos['id'].tolist(),
-        format_func=lambda x: obtener_nombre_insumo(x),
-        key="insumo_id"
-    )
+    insumo_id = seleccionar_opcion("Insumo:", 'insumos', key="insumo_id")
     
     # Actualizar el precio cuando el insumo cambia
     if "ultimo_insumo_id" not in st.session_state:
@@ -171,6 +541,16 @@ if menu == "Compras":
         st.session_state.ultimo_insumo_id = insumo_id
         st.session_state.precio = obtener_precio_actual(insumo_id)
     
+    # Proveedor con el menor último precio en los últimos días para el insumo seleccionado
+    indice_compras = cargar_indice_compras()
+    sugerencia = indice_compras.sugerir_proveedor(insumo_id)
+    if sugerencia is not None:
+        proveedor_sugerido, precio_sugerido, fecha_sugerida = sugerencia
+        st.caption(
+            f"Mejor precio reciente: {obtener_nombre_proveedor(proveedor_sugerido)} "
+            f"a S/ {precio_sugerido:.2f} ({fecha_sugerida:%d/%m/%Y})"
+        )
+    
     # Crear forma para agregar compra
     with st.form("form_compra"):
         st.subheader("Agregar Insumo a la Compra")
@@ -218,8 +598,16 @@ if menu == "Compras":
         # Convertir lista de diccionarios a DataFrame
         df_items = pd.DataFrame(st.session_state.items_compra)
         
+        # Proveedor sugerido por ítem (menor último precio reciente)
+        def proveedor_sugerido_item(insumo_id):
+            sugerencia = indice_compras.sugerir_proveedor(insumo_id)
+            if sugerencia is None:
+                return ""
+            return f"{obtener_nombre_proveedor(sugerencia[0])} (S/ {sugerencia[1]:.2f})"
+        df_items['proveedor_sugerido'] = df_items['insumo_id'].apply(proveedor_sugerido_item)
+        
         # Mostrar tabla
-        st.dataframe(df_items[['nombre', 'cantidad', 'precio_unitario', 'subtotal']])
+        st.dataframe(df_items[['nombre', 'cantidad', 'precio_unitario', 'subtotal', 'proveedor_sugerido']])
         
         # Calcular total
         total = sum(item['subtotal'] for item in st.session_state.items_compra)
@@ -229,39 +617,38 @@ if menu == "Compras":
         if st.button("Guardar Compra"):
             fecha_actual = datetime.now().date()
             
-            try:
-                # Crear la compra principal
-                compra_data = {
-                    "fecha": fecha_actual.strftime("%Y-%m-%d"),
-                    "proveedor": proveedor,
-                    "tipo": tipo_compra,
-                    "observaciones": "",
-                    "total": total
+            # Crear la compra principal con sus detalles
+            compra_data = {
+                "fecha": fecha_actual.strftime("%Y-%m-%d"),
+                "proveedor": proveedor,
+                "tipo": tipo_compra,
+                "observaciones": "",
+                "total": total
+            }
+            detalles_data = [
+                {
+                    "insumo_id": item['insumo_id'],
+                    "cantidad": item['cantidad'],
+                    "precio_unitario": item['precio_unitario'],
+                    "subtotal": item['subtotal']
                 }
-                
-                # Insertar en la tabla de compras
-                resultado_compra = sb.table('compras').insert(compra_data).execute()
-                compra_id = resultado_compra.data[0]['id']
-                
-                # Insertar detalles de la compra
-                for item in st.session_state.items_compra:
-                    detalle_data = {
-                        "compra_id": compra_id,
-                        "insumo_id": item['insumo_id'],
-                        "cantidad": item['cantidad'],
-                        "precio_unitario": item['precio_unitario'],
-                        "subtotal": item['subtotal']
-                    }
-                    sb.table('compra_detalles').insert(detalle_data).execute()
-                
+                for item in st.session_state.items_compra
+            ]
+            
+            estado, error, _ = guardar_en_cola('compra', {'compra': compra_data, 'detalles': detalles_data})
+            
+            if estado == RECHAZADO:
+                st.error(f"Error al guardar la compra: {error}")
+            else:
                 # Limpiar los items de la compra
                 st.session_state.items_compra = []
-                
-                st.success("Compra guardada exitosamente!")
+                st.session_state.estado_compra = estado
                 st.rerun()  # Recargar la página para mostrar los cambios
-            except Exception as e:
-                st.error(f"Error al guardar la compra: {str(e)}")
     else:
+        # Resultado de la última compra guardada (se muestra después de recargar la página)
+        estado_compra = st.session_state.pop('estado_compra', None)
+        if estado_compra is not None:
+            mostrar_estado_cola(estado_compra, None, "Compra guardada exitosamente!")
         st.info("No hay insumos agregados a la compra.")
 
 # Página de Consumos
@@ -282,11 +669,7 @@ elif menu == "Consumos":
             col1, col2 = st.columns(2)
             
             with col1:
-                insumo_id = st.selectbox(
-                    "Insumo a Consumir:",
-                    options=insumos['id'].tolist(),
-                    format_func=lambda x: f"{obtener_nombre_insumo(x)} (Stock: {insumos[insumos['id'] == x].iloc[0]['stock_actual']})"
-                )
+                insumo_id = seleccionar_opcion("Insumo a Consumir:", 'insumos_stock', buscar=False)
             
             with col2:
                 cantidad = st.number_input("Cantidad a Consumir:", min_value=0.01, step=0.01)
@@ -296,30 +679,17 @@ elif menu == "Consumos":
             submit_button = st.form_submit_button("Registrar Consumo")
             
             if submit_button:
-                # Verificar stock disponible
-                stock_actual = insumos[insumos['id'] == insumo_id].iloc[0]['stock_actual']
-                
-                if cantidad > stock_actual:
-                    st.error(f"No hay suficiente stock. Disponible: {stock_actual}")
-                else:
-                    # Crear nuevo consumo
-                    nuevo_consumo = {
-                        'fecha': datetime.now().strftime('%Y-%m-%d'),
-                        'produccion_id': None,  # No está relacionado a producción
-                        'observaciones': observaciones
-                    }
-                    result = sb.table('consumos').insert(nuevo_consumo).execute()
-                    consumo_id = result.data[0]['id']
-                    
-                    # Agregar detalle de consumo
-                    detalle_consumo = {
-                        'consumo_id': consumo_id,
-                        'insumo_id': insumo_id,
-                        'cantidad': cantidad
-                    }
-                    sb.table('consumo_detalles').insert(detalle_consumo).execute()
-                    
-                    st.success(f"Consumo de {cantidad} {insumos[insumos['id'] == insumo_id].iloc[0]['unidad_medida']} de {obtener_nombre_insumo(insumo_id)} registrado correctamente!")
+                # El stock se verifica y descuenta en el servidor, en la misma transacción que el consumo
+                estado, error, _ = guardar_en_cola('consumo', {
+                    'detalles': [{'insumo_id': insumo_id, 'cantidad': cantidad}],
+                    'fecha': datetime.now().strftime('%Y-%m-%d'),
+                    'observaciones': observaciones
+                })
+                mostrar_estado_cola(
+                    estado,
+                    error,
+                    f"Consumo de {cantidad} {insumos[insumos['id'] == insumo_id].iloc[0]['unidad_medida']} de {obtener_nombre_insumo(insumo_id)} registrado correctamente!"
+                )
     
     with tab2:
         st.subheader("Consumo por Producción")
@@ -333,11 +703,7 @@ elif menu == "Consumos":
             
             with col1:
                 if not productos.empty:
-                    producto_id = st.selectbox(
-                        "Producto a Elaborar:",
-                        options=productos['id'].tolist(),
-                        format_func=lambda x: productos[productos['id'] == x].iloc[0]['nombre']
-                    )
+                    producto_id = seleccionar_opcion("Producto a Elaborar:", 'productos', buscar=False)
                 else:
                     st.warning("No hay productos/recetas registradas.")
                     producto_id = None
@@ -354,52 +720,37 @@ elif menu == "Consumos":
                 costo_unitario, detalles_receta = calcular_costo_receta(producto_id)
                 costo_total = costo_unitario * cantidad_produccion
                 
-                # Verificar stock disponible para todos los insumos
                 insumos = cargar_insumos()
                 receta_insumos = cargar_receta_insumos(producto_id)
                 
-                stock_insuficiente = False
-                for _, ingrediente in receta_insumos.iterrows():
-                    insumo = insumos[insumos['id'] == ingrediente['insumo_id']]
-                    if not insumo.empty:
-                        stock_actual = insumo.iloc[0]['stock_actual']
-                        cantidad_necesaria = ingrediente['cantidad'] * cantidad_produccion
-                        
-                        if cantidad_necesaria > stock_actual:
-                            st.error(f"Stock insuficiente de {obtener_nombre_insumo(ingrediente['insumo_id'])}. Necesario: {cantidad_necesaria}, Disponible: {stock_actual}")
-                            stock_insuficiente = True
+                # Producción, consumo e insumos se registran en una sola llamada que verifica
+                # y descuenta el stock de todos los insumos de forma atómica
+                detalles_consumo = [
+                    {'insumo_id': ingrediente['insumo_id'], 'cantidad': ingrediente['cantidad'] * cantidad_produccion}
+                    for _, ingrediente in receta_insumos.iterrows()
+                ]
+                lineas_costo, costo_adicional = desglose_costo(receta_insumos, insumos, cargar_costos_adicionales(producto_id))
+                estado, error, _ = guardar_en_cola('produccion', {
+                    'producto_id': producto_id,
+                    'cantidad': cantidad_produccion,
+                    'costo_total': costo_total,
+                    'detalles': detalles_consumo,
+                    'fecha': datetime.now().strftime('%Y-%m-%d'),
+                    'observaciones': observaciones,
+                    # Datos para congelar el desglose de costos con los precios del momento
+                    'precio_venta': productos[productos['id'] == producto_id].iloc[0]['precio_venta'],
+                    'lineas_costo': lineas_costo.to_dict('records'),
+                    'costo_adicional': costo_adicional
+                })
                 
-                if not stock_insuficiente:
-                    # Registrar producción
-                    nueva_produccion = {
-                        'producto_id': producto_id,
-                        'fecha': datetime.now().strftime('%Y-%m-%d'),
-                        'cantidad': cantidad_produccion,
-                        'costo_total': costo_total,
-                        'observaciones': observaciones
-                    }
-                    result = sb.table('produccion').insert(nueva_produccion).execute()
-                    produccion_id = result.data[0]['id']
-                    
-                    # Registrar consumo asociado a la producción
-                    nuevo_consumo = {
-                        'fecha': datetime.now().strftime('%Y-%m-%d'),
-                        'produccion_id': produccion_id,
-                        'observaciones': f"Consumo para producción #{produccion_id}"
-                    }
-                    result = sb.table('consumos').insert(nuevo_consumo).execute()
-                    consumo_id = result.data[0]['id']
-                    
-                    # Registrar consumo de cada insumo
-                    for _, ingrediente in receta_insumos.iterrows():
-                        detalle_consumo = {
-                            'consumo_id': consumo_id,
-                            'insumo_id': ingrediente['insumo_id'],
-                            'cantidad': ingrediente['cantidad'] * cantidad_produccion
-                        }
-                        sb.table('consumo_detalles').insert(detalle_consumo).execute()
-                    
-                    st.success(f"Producción de {cantidad_produccion} unidades de {productos[productos['id'] == producto_id].iloc[0]['nombre']} registrada correctamente!")
+                if estado == RECHAZADO:
+                    st.error(error)
+                else:
+                    mostrar_estado_cola(
+                        estado,
+                        error,
+                        f"Producción de {cantidad_produccion} unidades de {productos[productos['id'] == producto_id].iloc[0]['nombre']} registrada correctamente!"
+                    )
                     
                     # Mostrar detalles de la producción
                     st.subheader("Detalles de la Producción:")
@@ -423,11 +774,7 @@ elif menu == "Recetas":
         
         if not productos.empty:
             # Mostrar lista de recetas
-            producto_id = st.selectbox(
-                "Seleccionar Receta:",
-                options=productos['id'].tolist(),
-                format_func=lambda x: productos[productos['id'] == x].iloc[0]['nombre']
-            )
+            producto_id = seleccionar_opcion("Seleccionar Receta:", 'productos', key="ver_receta")
             
             if producto_id:
                 producto = productos[productos['id'] == producto_id].iloc[0]
@@ -458,8 +805,7 @@ elif menu == "Recetas":
                     st.table(insumos_df)
                 
                 # Mostrar costos adicionales
-                response = sb.table('receta_costos_adicionales').select('*').eq('producto_id', producto_id).execute()
-                costos_adicionales = pd.DataFrame(response.data)
+                costos_adicionales = cargar_costos_adicionales(producto_id)
                 
                 if not costos_adicionales.empty:
                     st.subheader("Costos Adicionales:")
@@ -477,6 +823,31 @@ elif menu == "Recetas":
                 col1.metric("Costo Total", f"S/ {costo_total:.2f}")
                 col2.metric("Precio de Venta", f"S/ {precio_venta:.2f}")
                 col3.metric("Margen de Ganancia", f"S/ {margen:.2f} ({margen_porcentaje:.1f}%)")
+                
+                # Costo con la receta y los precios vigentes en una fecha pasada
+                st.subheader("Costo en una Fecha")
+                fecha_costo = st.date_input("Fecha:", value=datetime.now() - timedelta(days=30), key="receta_fecha_costo")
+                costo_fecha, detalles_fecha, sin_precio = cargar_indice_costos().costo(producto_id, fecha_costo)
+                
+                if costo_fecha is not None:
+                    if sin_precio:
+                        st.warning(
+                            f"Sin precio registrado al {fecha_costo} para: {', '.join(obtener_nombre_insumo(i) for i in sin_precio)}. "
+                            "El costo no incluye estos insumos."
+                        )
+                    if detalles_fecha:
+                        detalles_df = pd.DataFrame(detalles_fecha)
+                        detalles_df['insumo'] = detalles_df['insumo'].fillna(detalles_df['insumo_id'].map(obtener_nombre_insumo))
+                        detalles_df = detalles_df[['insumo', 'cantidad', 'unidad', 'precio_unitario', 'subtotal']]
+                        detalles_df.columns = ['Insumo', 'Cantidad', 'Unidad', 'Precio Unitario', 'Subtotal']
+                        st.table(detalles_df)
+                    
+                    margen_fecha = precio_venta - costo_fecha
+                    col1, col2 = st.columns(2)
+                    col1.metric(f"Costo al {fecha_costo}", f"S/ {costo_fecha:.2f}", f"S/ {costo_total - costo_fecha:.2f} hasta hoy", delta_color="inverse")
+                    col2.metric("Margen con Precio Actual", f"S/ {margen_fecha:.2f}")
+                else:
+                    st.info("No hay una versión de esta receta registrada hasta esa fecha.")
         else:
             st.info("No hay recetas registradas.")
     
@@ -501,11 +872,7 @@ elif menu == "Recetas":
             # Agregar insumo
             col1, col2, col3 = st.columns(3)
             with col1:
-                insumo_id = st.selectbox(
-                    "Insumo:",
-                    options=insumos['id'].tolist(),
-                    format_func=lambda x: obtener_nombre_insumo(x)
-                )
+                insumo_id = seleccionar_opcion("Insumo:", 'insumos', buscar=False)
             
             with col2:
                 cantidad = st.number_input("Cantidad:", min_value=0.01, step=0.01, value=1.0)
@@ -535,8 +902,8 @@ elif menu == "Recetas":
             # Sección para costos adicionales
             st.subheader("Costos Adicionales")
             
-            # if 'costos_adicionales_temp' not in st.session_state:
-            #     st.session_state.costos_adicionales_temp = []
+            if 'costos_adicionales_temp' not in st.session_state:
+                st.session_state.costos_adicionales_temp = []
             
             # col1, col2 = st.columns(2)
             # with col1:
@@ -568,27 +935,11 @@ elif menu == "Recetas":
                         'precio_venta': precio_venta
                     }
                     
-                    result = sb.table('productos').insert(nueva_receta).execute()
-                    producto_id = result.data[0]['id']
+                    # Producto, líneas, costos adicionales y primera versión en una sola transacción
+                    crear_receta(sb, nueva_receta, st.session_state.insumos_temp, st.session_state.costos_adicionales_temp)
                     
-                    # Guardar insumos de la receta
-                    for insumo in st.session_state.insumos_temp:
-                        receta_insumo = {
-                            'producto_id': producto_id,
-                            'insumo_id': insumo['insumo_id'],
-                            'cantidad': insumo['cantidad'],
-                            'unidad_medida': insumo['unidad_medida']
-                        }
-                        sb.table('receta_insumos').insert(receta_insumo).execute()
-                    
-                    # Guardar costos adicionales
-                    for costo in st.session_state.costos_adicionales_temp:
-                        costo_adicional = {
-                            'producto_id': producto_id,
-                            'concepto': costo['concepto'],
-                            'costo': costo['costo']
-                        }
-                        sb.table('receta_costos_adicionales').insert(costo_adicional).execute()
+                    # Recargar productos para que la nueva receta aparezca en las listas
+                    obtener_instantanea().marcar('productos')
                     
                     st.success(f"Receta {nombre_receta} guardada correctamente!")
                     # Limpiar variables temporales
@@ -611,16 +962,18 @@ elif menu == "Recetas":
         productos = cargar_productos()
         
         if not productos.empty:
-            producto_id = st.selectbox(
-                "Seleccionar Receta a Editar:",
-                options=productos['id'].tolist(),
-                format_func=lambda x: productos[productos['id'] == x].iloc[0]['nombre'],
-                key="editar_receta"
-            )
+            producto_id = seleccionar_opcion("Seleccionar Receta a Editar:", 'productos', key="editar_receta")
             
             if producto_id:
                 producto = productos[productos['id'] == producto_id].iloc[0]
                 
+                # Reiniciar la edición al cambiar de receta
+                if st.session_state.get('receta_edit_producto') != producto_id:
+                    st.session_state.receta_edit_producto = producto_id
+                    st.session_state.receta_edit_version = obtener_version_receta(producto_id)
+                    st.session_state.pop('insumos_edit', None)
+                    st.session_state.pop('costos_adicionales_edit', None)
+                
                 with st.form("form_editar_receta"):
                     nombre_receta = st.text_input("Nombre del Producto:", value=producto['nombre'])
                     descripcion = st.text_area("Descripción:", value=producto['descripcion'] if producto['descripcion'] else "")
@@ -648,6 +1001,18 @@ elif menu == "Recetas":
                     if st.session_state.insumos_edit:
                         insumos_df = pd.DataFrame(st.session_state.insumos_edit)
                         st.table(insumos_df[['nombre', 'cantidad', 'unidad_medida']])
+                        
+                        insumos_quitar = st.multiselect(
+                            "Quitar Insumos:",
+                            options=list(range(len(st.session_state.insumos_edit))),
+                            format_func=lambda i: st.session_state.insumos_edit[i]['nombre'],
+                            key="insumos_quitar_edit"
+                        )
+                        if st.form_submit_button("Quitar Insumos Seleccionados"):
+                            st.session_state.insumos_edit = [
+                                insumo for i, insumo in enumerate(st.session_state.insumos_edit) if i not in insumos_quitar
+                            ]
+                            st.rerun()
                     
                     # Agregar nuevo insumo
                     st.subheader("Agregar Nuevo Insumo")
@@ -656,12 +1021,7 @@ elif menu == "Recetas":
                     
                     col1, col2, col3 = st.columns(3)
                     with col1:
-                        nuevo_insumo_id = st.selectbox(
-                            "Insumo:",
-                            options=insumos['id'].tolist(),
-                            format_func=lambda x: obtener_nombre_insumo(x),
-                            key="nuevo_insumo_edit"
-                        )
+                        nuevo_insumo_id = seleccionar_opcion("Insumo:", 'insumos', key="nuevo_insumo_edit", buscar=False)
                     with col2:
                         nueva_cantidad = st.number_input("Cantidad:", min_value=0.01, step=0.01, value=1.0, key="nueva_cantidad_edit")
                     with col3:
@@ -682,8 +1042,7 @@ elif menu == "Recetas":
                         st.success(f"Insumo {insumo_nombre} agregado a la receta.")
                     
                     # Cargar costos adicionales
-                    response = sb.table('receta_costos_adicionales').select('*').eq('producto_id', producto_id).execute()
-                    costos_adicionales = pd.DataFrame(response.data)
+                    costos_adicionales = cargar_costos_adicionales(producto_id)
                     
                     # Lista para almacenar costos adicionales editados
                     if 'costos_adicionales_edit' not in st.session_state:
@@ -702,6 +1061,18 @@ elif menu == "Recetas":
                     if st.session_state.costos_adicionales_edit:
                         costos_df = pd.DataFrame(st.session_state.costos_adicionales_edit)
                         st.table(costos_df[['concepto', 'costo']])
+                        
+                        costos_quitar = st.multiselect(
+                            "Quitar Costos Adicionales:",
+                            options=list(range(len(st.session_state.costos_adicionales_edit))),
+                            format_func=lambda i: st.session_state.costos_adicionales_edit[i]['concepto'],
+                            key="costos_quitar_edit"
+                        )
+                        if st.form_submit_button("Quitar Costos Seleccionados"):
+                            st.session_state.costos_adicionales_edit = [
+                                costo for i, costo in enumerate(st.session_state.costos_adicionales_edit) if i not in costos_quitar
+                            ]
+                            st.rerun()
                     
                     # Agregar nuevo costo adicional
                     st.subheader("Agregar Nuevo Costo Adicional")
@@ -727,44 +1098,28 @@ elif menu == "Recetas":
                     
                     if submit_edit:
                         if nombre_receta and precio_venta > 0:
-                            # Actualizar receta/producto
-                            sb.table('productos').update({
-                                'nombre': nombre_receta,
-                                'descripcion': descripcion,
-                                'precio_venta': precio_venta,
-                                'updated_at': datetime.now().isoformat()
-                            }).eq('id', producto_id).execute()
-                            
-                            # Actualizar insumos
-                            for insumo in st.session_state.insumos_edit:
-                                if insumo['id']:  # Insumo existente, actualizar
-                                    sb.table('receta_insumos').update({
-                                        'cantidad': insumo['cantidad'],
-                                        'unidad_medida': insumo['unidad_medida']
-                                    }).eq('id', insumo['id']).execute()
-                                else:  # Nuevo insumo, insertar
-                                    receta_insumo = {
-                                        'producto_id': producto_id,
-                                        'insumo_id': insumo['insumo_id'],
-                                        'cantidad': insumo['cantidad'],
-                                        'unidad_medida': insumo['unidad_medida']
-                                    }
-                                    sb.table('receta_insumos').insert(receta_insumo).execute()
+                            try:
+                                # Solo se escriben las líneas modificadas, nuevas o eliminadas
+                                guardar_receta(
+                                    sb,
+                                    producto_id,
+                                    st.session_state.receta_edit_version,
+                                    {
+                                        'nombre': nombre_receta,
+                                        'descripcion': descripcion,
+                                        'precio_venta': precio_venta
+                                    },
+                                    st.session_state.insumos_edit,
+                                    st.session_state.costos_adicionales_edit
+                                )
+                            except ConflictoReceta as e:
+                                st.error(str(e))
+                                st.session_state.pop('receta_edit_producto', None)
+                                st.stop()
                             
-                            # Actualizar costos adicionales
-                            for costo in st.session_state.costos_adicionales_edit:
-                                if costo['id']:  # Costo existente, actualizar
-                                    sb.table('receta_costos_adicionales').update({
-                                        'concepto': costo['concepto'],
-                                        'costo': costo['costo']
-                                    }).eq('id', costo['id']).execute()
-                                else:  # Nuevo costo, insertar
-                                    costo_adicional = {
-                                        'producto_id': producto_id,
-                                        'concepto': costo['concepto'],
-                                        'costo': costo['costo']
-                                    }
-                                    sb.table('receta_costos_adicionales').insert(costo_adicional).execute()
+                            # Recargar productos para leer la nueva versión de la receta
+                            obtener_instantanea().marcar('productos')
+                            st.session_state.pop('receta_edit_producto', None)
                             
                             st.success(f"Receta {nombre_receta} actualizada correctamente!")
                             # Limpiar variables temporales
@@ -828,8 +1183,11 @@ elif menu == "Registrar Insumos":
             
             st.dataframe(tabla_insumos.style.apply(highlight_stock_bajo, axis=1))
             
-            # Mostrar alerta para insumos con stock bajo
-            insumos_stock_bajo = insumos_filtrados[insumos_filtrados['stock_actual'] < insumos_filtrados['stock_minimo']]
+            # Mostrar alerta para insumos con stock bajo (calculadas en segundo plano)
+            alertas = obtener_precalculador().resultado(tareas_sucursal(sucursal_actual())['alertas_stock'])[0]
+            if alertas is None:
+                alertas = alertas_stock(insumos)
+            insumos_stock_bajo = alertas[alertas['id'].isin(insumos_filtrados['id'])]
             if not insumos_stock_bajo.empty:
                 st.warning(f"Hay {len(insumos_stock_bajo)} insumo(s) con stock por debajo del mínimo!")
                 for _, insumo in insumos_stock_bajo.iterrows():
@@ -846,13 +1204,7 @@ elif menu == "Registrar Insumos":
             with col1:
                 nombre = st.text_input("Nombre del Insumo:")
                 
-                # Cargar categorías
-                categorias = cargar_categorias()
-                categoria_id = st.selectbox(
-                    "Categoría:",
-                    options=categorias['id'].tolist(),
-                    format_func=lambda x: categorias[categorias['id'] == x].iloc[0]['nombre']
-                )
+                categoria_id = seleccionar_opcion("Categoría:", 'categorias', buscar=False)
                 
                 precio = st.number_input("Precio Actual:", min_value=0.01, step=0.01)
             
@@ -880,17 +1232,12 @@ elif menu == "Registrar Insumos":
                             'unidad_medida': unidad_medida
                         }
                         
-                        sb.table('insumos').insert(nuevo_insumo).execute()
-                        
-                        # Registrar precio histórico
-                        historico_precio = {
-                            'insumo_id': sb.table('insumos').select('id').eq('nombre', nombre).execute().data[0]['id'],
-                            'precio': precio,
+                        # El insumo y su precio histórico se registran juntos en el servidor
+                        estado, error, _ = guardar_en_cola('insumo', {
+                            'insumo': nuevo_insumo,
                             'fecha': datetime.now().strftime('%Y-%m-%d')
-                        }
-                        sb.table('historico_precios').insert(historico_precio).execute()
-                        
-                        st.success(f"Insumo {nombre} registrado correctamente!")
+                        })
+                        mostrar_estado_cola(estado, error, f"Insumo {nombre} registrado correctamente!")
                 else:
                     if not nombre:
                         st.error("Debe ingresar un nombre para el insumo.")
@@ -903,7 +1250,7 @@ elif menu == "Reportes":
     
     tipo_reporte = st.selectbox(
         "Tipo de Reporte:",
-        ["Evolución de Precios de Insumos", "Margen de Ganancia por Producto", "Consumo de Insumos", "Producción Histórica"]
+        ["Evolución de Precios de Insumos", "Margen de Ganancia por Producto", "Margen Histórico (Costos Congelados)", "Consumo de Insumos", "Producción Histórica", "Valorización de Inventario", "Mermas y Variaciones", "Análisis de Proveedores"]
     )
     
     if tipo_reporte == "Evolución de Precios de Insumos":
@@ -914,9 +1261,6 @@ elif menu == "Reportes":
         insumos = cargar_insumos()
         
         if not historico_precios.empty and not insumos.empty:
-            # Agregar nombres de insumos
-            historico_precios['insumo'] = historico_precios['insumo_id'].apply(obtener_nombre_insumo)
-            
             # Seleccionar insumos
             insumos_seleccionados = st.multiselect(
                 "Seleccionar Insumos:",
@@ -932,27 +1276,17 @@ elif menu == "Reportes":
             
             if insumos_seleccionados:
                 # Filtrar datos
-                insumos_ids = insumos[insumos['nombre'].isin(insumos_seleccionados)]['id'].tolist()
-                datos_filtrados = historico_precios[
-                    (historico_precios['insumo_id'].isin(insumos_ids)) &
-                    (pd.to_datetime(historico_precios['fecha']) >= pd.to_datetime(fecha_inicio)) &
-                    (pd.to_datetime(historico_precios['fecha']) <= pd.to_datetime(fecha_fin))
-                ]
+                insumos_ids = tuple(insumos[insumos['nombre'].isin(insumos_seleccionados)]['id'].tolist())
+                fig, datos_filtrados = _figura_precios(
+                    historico_precios, insumos_ids, fecha_inicio, fecha_fin,
+                    (obtener_instantanea().version('historico_precios'), obtener_instantanea().version('insumos'))
+                )
                 
                 if not datos_filtrados.empty:
-                    # Crear gráfico
-                    fig = px.line(
-                        datos_filtrados,
-                        x='fecha',
-                        y='precio',
-                        color='insumo',
-                        title='Evolución de Precios de Insumos',
-                        labels={'fecha': 'Fecha', 'precio': 'Precio (S/)', 'insumo': 'Insumo'}
-                    )
                     st.plotly_chart(fig, use_container_width=True)
                     
                     # Mostrar tabla de datos
-                    tabla_datos = datos_filtrados[['fecha', 'insumo', 'precio']]
+                    tabla_datos = datos_filtrados.copy()
                     tabla_datos.columns = ['Fecha', 'Insumo', 'Precio']
                     st.dataframe(tabla_datos.sort_values(['Insumo', 'Fecha']), use_container_width=True)
                 else:
@@ -965,29 +1299,12 @@ elif menu == "Reportes":
     elif tipo_reporte == "Margen de Ganancia por Producto":
         st.subheader("Análisis de Margen de Ganancia")
         
-        # Cargar datos
-        productos = cargar_productos()
+        # Márgenes calculados en segundo plano para todos los productos
+        margenes_df = leer_precalculado('margenes')
         
-        if not productos.empty:
-            # Calcular márgenes para todos los productos
-            margenes = []
-            
-            for _, producto in productos.iterrows():
-                costo, _ = calcular_costo_receta(producto['id'])
-                precio_venta = producto['precio_venta']
-                margen = precio_venta - costo
-                margen_porcentaje = (margen / precio_venta) * 100 if precio_venta > 0 else 0
-                
-                margenes.append({
-                    'producto': producto['nombre'],
-                    'costo': costo,
-                    'precio_venta': precio_venta,
-                    'margen': margen,
-                    'margen_porcentaje': margen_porcentaje
-                })
-            
-            margenes_df = pd.DataFrame(margenes)
-            
+        if margenes_df is None:
+            pass
+        elif not margenes_df.empty:
             # Crear gráfico de barras para margen por producto
             fig1 = px.bar(
                 margenes_df,
@@ -1011,30 +1328,72 @@ elif menu == "Reportes":
             st.plotly_chart(fig2, use_container_width=True)
             
             # Mostrar tabla de datos
-            tabla_margenes = margenes_df.copy()
+            tabla_margenes = margenes_df[['producto', 'costo', 'precio_venta', 'margen', 'margen_porcentaje']].copy()
             tabla_margenes.columns = ['Producto', 'Costo (S/)', 'Precio Venta (S/)', 'Margen (S/)', 'Margen (%)']
             st.dataframe(tabla_margenes, use_container_width=True)
         else:
             st.info("No hay productos registrados para analizar márgenes.")
     
+    elif tipo_reporte == "Margen Histórico (Costos Congelados)":
+        st.subheader("Margen Histórico por Producto")
+        
+        # Rango de fechas
+        col1, col2 = st.columns(2)
+        with col1:
+            fecha_inicio = st.date_input("Fecha Inicio:", value=datetime.now() - timedelta(days=30), key="margen_fecha_inicio")
+        with col2:
+            fecha_fin = st.date_input("Fecha Fin:", value=datetime.now(), key="margen_fecha_fin")
+        alcance = seleccionar_alcance("margen_alcance")
+        
+        # Los costos se congelaron al registrar cada producción, no se recalculan las recetas
+        costos_produccion = cargar_costos_produccion(fecha_inicio, fecha_fin, alcance[0] if len(alcance) == 1 else None)
+        
+        if not costos_produccion.empty:
+            productos = cargar_productos()
+            margenes_df = margenes_historicos(costos_produccion).merge(
+                productos[['id', 'nombre']].rename(columns={'id': 'producto_id', 'nombre': 'producto'}),
+                on='producto_id',
+                how='left'
+            )
+            
+            fig = px.bar(
+                margenes_df,
+                x='producto',
+                y=['costo', 'margen'],
+                title='Costo vs Margen Realizado por Producto',
+                barmode='stack',
+                labels={'value': 'Monto (S/)', 'producto': 'Producto', 'variable': 'Tipo'}
+            )
+            st.plotly_chart(fig, use_container_width=True)
+            
+            tabla_margenes = margenes_df[['producto', 'unidades', 'costo', 'ingreso', 'margen', 'margen_porcentaje']]
+            tabla_margenes.columns = ['Producto', 'Unidades', 'Costo (S/)', 'Ingreso Teórico (S/)', 'Margen (S/)', 'Margen (%)']
+            st.dataframe(tabla_margenes, use_container_width=True)
+            
+            # Costo de insumos utilizados en la producción del periodo
+            st.subheader("Costo de Insumos Utilizados")
+            costo_insumos = costo_insumos_producidos(costos_produccion)
+            costo_insumos['insumo'] = costo_insumos['insumo_id'].apply(obtener_nombre_insumo)
+            tabla_costo_insumos = costo_insumos[['insumo', 'cantidad', 'costo']]
+            tabla_costo_insumos.columns = ['Insumo', 'Cantidad', 'Costo (S/)']
+            st.dataframe(tabla_costo_insumos, use_container_width=True)
+            
+            col1, col2 = st.columns(2)
+            col1.metric("Costo Total de Producción", f"S/ {margenes_df['costo'].sum():.2f}")
+            col2.metric("Margen Total", f"S/ {margenes_df['margen'].sum():.2f}")
+        else:
+            st.info("No hay producciones con costos congelados en el rango de fechas seleccionado.")
+    
     elif tipo_reporte == "Consumo de Insumos":
         st.subheader("Análisis de Consumo de Insumos")
         
-        # Cargar datos de consumos
-        response = sb.table('consumo_detalles').select('*').execute()
-        consumos = pd.DataFrame(response.data)
+        # Consumo por día e insumo calculado en segundo plano por sucursal; el consolidado suma esos resúmenes
+        alcance = seleccionar_alcance("consumo_alcance")
+        consumo_diario, version_consumo = leer_precalculado_sucursales(
+            'consumo_diario', alcance, ['dia', 'insumo_id'], ['cantidad']
+        )
         
-        if not consumos.empty:
-            # Cargar datos de consumos con fechas
-            query = """
-            SELECT cd.*, c.fecha, i.nombre as insumo_nombre, i.unidad_medida
-            FROM consumo_detalles cd
-            JOIN consumos c ON cd.consumo_id = c.id
-            JOIN insumos i ON cd.insumo_id = i.id
-            """
-            response = sb.table('consumo_detalles').select('*').execute()
-            consumos_completos = pd.DataFrame(response.data)
-            
+        if consumo_diario is not None and not consumo_diario.empty:
             # Rango de fechas
             col1, col2 = st.columns(2)
             with col1:
@@ -1043,12 +1402,19 @@ elif menu == "Reportes":
                 fecha_fin = st.date_input("Fecha Fin:", value=datetime.now(), key="consumo_fecha_fin")
             
             # Filtrar datos por fecha
-            consumos_filtrados = consumos_completos[
-                (pd.to_datetime(consumos_completos['fecha']) >= pd.to_datetime(fecha_inicio)) &
-                (pd.to_datetime(consumos_completos['fecha']) <= pd.to_datetime(fecha_fin))
+            consumos_filtrados = consumo_diario[
+                (consumo_diario['dia'] >= pd.to_datetime(fecha_inicio)) &
+                (consumo_diario['dia'] <= pd.to_datetime(fecha_fin))
             ]
             
             if not consumos_filtrados.empty:
+                insumos = cargar_insumos()
+                consumos_filtrados = consumos_filtrados.merge(
+                    insumos[['id', 'nombre', 'unidad_medida']].rename(columns={'id': 'insumo_id', 'nombre': 'insumo_nombre'}),
+                    on='insumo_id',
+                    how='left'
+                )
+                
                 # Agrupar por insumo
                 consumo_por_insumo = consumos_filtrados.groupby('insumo_id').agg({
                     'cantidad': 'sum',
@@ -1071,32 +1437,391 @@ elif menu == "Reportes":
                 tabla_consumo.columns = ['Insumo', 'Cantidad Consumida', 'Unidad']
                 st.dataframe(tabla_consumo.sort_values('Cantidad Consumida', ascending=False), use_container_width=True)
                 
-                # Análisis de tendencia de consumo (consumo por día)
-                consumos_filtrados['fecha'] = pd.to_datetime(consumos_filtrados['fecha'])
-                consumo_diario = consumos_filtrados.groupby([consumos_filtrados['fecha'].dt.date, 'insumo_nombre']).agg({
-                    'cantidad': 'sum'
-                }).reset_index()
-                
                 # Seleccionar insumos para tendencia
-                insumos_disponibles = consumos_filtrados['insumo_nombre'].unique().tolist()
+                insumos_disponibles = consumo_por_insumo.sort_values('cantidad', ascending=False)['insumo_nombre'].tolist()
                 insumos_seleccionados = st.multiselect(
                     "Ver Tendencia de Consumo para Insumos:",
                     options=insumos_disponibles,
-                    default=insumos_disponibles[:3] if len(insumos_disponibles) >= 3 else insumos_disponibles
+                    default=insumos_disponibles[:3]
                 )
                 
                 if insumos_seleccionados:
-                    tendencia_filtrada = consumo_diario[consumo_diario['insumo_nombre'].isin(insumos_seleccionados)]
-                    
-                    # Crear gráfico de tendencia
-                    fig_tendencia = px.line(
-                        tendencia_filtrada,
-                        x='fecha',
-                        y='cantidad',
-                        color='insumo_nombre',
-                        title='Tendencia de Consumo Diario',
-                        labels={'fecha': 'Fecha', 'cantidad': 'Cantidad Consumida', 'insumo_nombre': 'Insumo'}
+                    fig_tendencia = _figura_tendencia_consumo(
+                        consumos_filtrados, tuple(insumos_seleccionados), fecha_inicio, fecha_fin, version_consumo
                     )
                     st.plotly_chart(fig_tendencia, use_container_width=True)
-            # else:
-            #     st.info("No hay datos de consumo para
+            else:
+                st.info("No hay datos de consumo en el rango de fechas seleccionado.")
+        elif consumo_diario is not None:
+            st.info("No hay consumos registrados.")
+    
+    elif tipo_reporte == "Producción Histórica":
+        st.subheader("Producción Histórica")
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            fecha_inicio = st.date_input("Fecha Inicio:", value=datetime.now() - timedelta(days=365), key="produccion_fecha_inicio")
+        with col2:
+            fecha_fin = st.date_input("Fecha Fin:", value=datetime.now(), key="produccion_fecha_fin")
+        with col3:
+            periodo = st.selectbox("Agrupar por:", list(PERIODOS.keys()), index=2)
+        alcance = seleccionar_alcance("produccion_alcance")
+        
+        # Consulta por rango de fechas agrupada en el servidor (o en un resumen local)
+        resumen = cargar_resumen_produccion(
+            fecha_inicio, fecha_fin, PERIODOS[periodo], alcance[0] if len(alcance) == 1 else None
+        )
+        
+        if not resumen.empty:
+            productos = cargar_productos()
+            resumen = resumen.merge(
+                productos[['id', 'nombre']].rename(columns={'id': 'producto_id', 'nombre': 'producto'}),
+                on='producto_id',
+                how='left'
+            )
+            
+            productos_seleccionados = st.multiselect(
+                "Filtrar Productos:",
+                options=sorted(resumen['producto'].dropna().unique().tolist())
+            )
+            if productos_seleccionados:
+                resumen = resumen[resumen['producto'].isin(productos_seleccionados)]
+            
+            # Unidades producidas por periodo y producto
+            fig_unidades = px.bar(
+                resumen,
+                x='inicio_periodo',
+                y='unidades',
+                color='producto',
+                title='Unidades Producidas',
+                labels={'inicio_periodo': 'Periodo', 'unidades': 'Unidades', 'producto': 'Producto'}
+            )
+            st.plotly_chart(fig_unidades, use_container_width=True)
+            
+            # Costo vs ingreso teórico por periodo
+            totales = resumen.groupby('inicio_periodo', as_index=False)[['costo', 'ingreso']].sum()
+            fig_montos = px.line(
+                totales,
+                x='inicio_periodo',
+                y=['costo', 'ingreso'],
+                title='Costo vs Ingreso Teórico',
+                labels={'inicio_periodo': 'Periodo', 'value': 'Monto (S/)', 'variable': 'Tipo'}
+            )
+            st.plotly_chart(fig_montos, use_container_width=True)
+            
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Unidades Producidas", f"{resumen['unidades'].sum():,.0f}")
+            col2.metric("Costo Total", f"S/ {resumen['costo'].sum():.2f}")
+            col3.metric("Ingreso Teórico", f"S/ {resumen['ingreso'].sum():.2f}")
+            
+            tabla_produccion = resumen[['inicio_periodo', 'producto', 'unidades', 'costo', 'ingreso']]
+            tabla_produccion.columns = ['Periodo', 'Producto', 'Unidades', 'Costo (S/)', 'Ingreso Teórico (S/)']
+            st.dataframe(tabla_produccion.sort_values(['Periodo', 'Producto']), use_container_width=True)
+        else:
+            st.info("No hay producción registrada en el rango de fechas seleccionado.")
+    
+    elif tipo_reporte == "Valorización de Inventario":
+        st.subheader("Valorización de Inventario")
+        
+        metodo = st.selectbox(
+            "Método de Valorización:",
+            options=list(valorizacion.METODOS.keys()),
+            format_func=lambda x: valorizacion.METODOS[x]
+        )
+        
+        # Solo se procesan las compras y consumos de la sucursal registrados desde la última actualización
+        insumos = cargar_insumos()
+        valorizador = obtener_valorizador(metodo, sucursal_actual())
+        valorizacion.actualizar(valorizador, sb, dict(zip(insumos['id'], insumos['precio_actual'])))
+        
+        with valorizador.candado:
+            valor_total = valorizador.valor_total
+            resumen_valor = valorizador.resumen()
+            costos_reales = valorizador.costo_producciones()
+        
+        st.metric("Valor Total del Inventario", f"S/ {valor_total:,.2f}")
+        
+        if not resumen_valor.empty:
+            resumen_valor['insumo'] = resumen_valor['insumo_id'].apply(obtener_nombre_insumo)
+            tabla_valor = resumen_valor[['insumo', 'cantidad', 'costo_unitario', 'valor', 'capas', 'faltante']]
+            tabla_valor.columns = ['Insumo', 'Cantidad en Capas', 'Costo Unitario (S/)', 'Valor (S/)', 'Capas', 'Consumido sin Compra']
+            st.dataframe(tabla_valor.sort_values('Valor (S/)', ascending=False), use_container_width=True)
+            
+            # Consumos mayores a lo comprado: se valorizan al último costo conocido y no descuentan capas
+            sin_compra = resumen_valor[resumen_valor['faltante'] > 0]
+            if not sin_compra.empty:
+                st.warning(
+                    f"{len(sin_compra)} insumo(s) tienen consumos sin compra registrada que los cubra "
+                    "(por ejemplo stock inicial): la cantidad en capas no incluye ese stock."
+                )
+        else:
+            st.info("No hay compras registradas para valorizar.")
+        
+        # Costo real de cada producción según las capas consumidas, frente al costo registrado
+        st.subheader("Costo Real por Producción")
+        produccion = cargar_produccion()
+        
+        if not costos_reales.empty and not produccion.empty:
+            productos = cargar_productos()
+            costo_produccion = produccion.merge(
+                costos_reales, left_on='id', right_on='produccion_id', how='inner'
+            ).merge(
+                productos[['id', 'nombre']].rename(columns={'id': 'producto_id', 'nombre': 'producto'}),
+                on='producto_id',
+                how='left'
+            )
+            costo_produccion['diferencia'] = costo_produccion['costo_real'] - costo_produccion['costo_total']
+            tabla_costo = costo_produccion.sort_values('fecha', ascending=False)[
+                ['fecha', 'producto', 'cantidad', 'costo_total', 'costo_real', 'diferencia']
+            ]
+            tabla_costo.columns = ['Fecha', 'Producto', 'Cantidad', 'Costo Registrado (S/)', 'Costo Real (S/)', 'Diferencia (S/)']
+            st.dataframe(tabla_costo, use_container_width=True)
+        else:
+            st.info("No hay producciones con consumos valorizados.")
+    
+    elif tipo_reporte == "Mermas y Variaciones":
+        st.subheader("Mermas y Variaciones de Consumo")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            fecha_inicio = st.date_input("Fecha Inicio:", value=datetime.now() - timedelta(days=365), key="variacion_fecha_inicio")
+        with col2:
+            fecha_fin = st.date_input("Fecha Fin:", value=datetime.now(), key="variacion_fecha_fin")
+        
+        alcance = seleccionar_alcance("variacion_alcance")
+        
+        # El resumen diario de cada sucursal se actualiza en segundo plano con los movimientos nuevos;
+        # el periodo solo suma filas diarias y el consolidado suma los resúmenes de las sucursales
+        for sucursal_id in alcance:
+            tareas_sucursal(sucursal_id)
+        if len(alcance) == 1:
+            variacion_diaria = obtener_variacion(alcance[0])
+        else:
+            variacion_diaria = variacion.consolidar([obtener_variacion(s) for s in alcance])
+        
+        insumos = cargar_insumos()
+        precios = dict(zip(insumos['id'], insumos['precio_actual']))
+        resumen_variacion = variacion_diaria.periodo(fecha_inicio, fecha_fin, precios)
+        
+        if not resumen_variacion.empty:
+            resumen_variacion = resumen_variacion.merge(
+                insumos[['id', 'nombre', 'unidad_medida']].rename(columns={'id': 'insumo_id', 'nombre': 'insumo'}),
+                on='insumo_id',
+                how='left'
+            )
+            
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Pérdida No Explicada", f"S/ {resumen_variacion['costo_perdida'].clip(lower=0).sum():,.2f}")
+            col2.metric("Consumo Manual", f"S/ {(resumen_variacion['consumo_manual'] * resumen_variacion['insumo_id'].map(precios).fillna(0)).sum():,.2f}")
+            col3.metric("Insumos con Pérdida", f"{(resumen_variacion['perdida'] > 0).sum()}")
+            
+            # Insumos con mayor pérdida valorizada
+            mayores_perdidas = resumen_variacion[resumen_variacion['costo_perdida'] > 0].head(15)
+            if not mayores_perdidas.empty:
+                fig_perdidas = px.bar(
+                    mayores_perdidas,
+                    x='insumo',
+                    y='costo_perdida',
+                    title='Insumos con Mayor Pérdida No Explicada',
+                    labels={'insumo': 'Insumo', 'costo_perdida': 'Pérdida (S/)'}
+                )
+                st.plotly_chart(fig_perdidas, use_container_width=True)
+            
+            tendencia = variacion_diaria.tendencia(fecha_inicio, fecha_fin, precios)
+            fig_tendencia = figura_lineas(
+                tendencia,
+                x='dia',
+                y='costo_perdida',
+                titulo='Pérdida No Explicada por Día',
+                etiquetas={'dia': 'Fecha', 'costo_perdida': 'Pérdida (S/)'}
+            )
+            st.plotly_chart(fig_tendencia, use_container_width=True)
+            
+            tabla_variacion = resumen_variacion[[
+                'insumo', 'unidad_medida', 'teorico', 'consumo_produccion', 'consumo_manual', 'comprado',
+                'perdida', 'perdida_porcentaje', 'costo_perdida'
+            ]]
+            tabla_variacion.columns = [
+                'Insumo', 'Unidad', 'Consumo Teórico', 'Consumo en Producción', 'Consumo Manual', 'Comprado',
+                'Pérdida', 'Pérdida (%)', 'Pérdida (S/)'
+            ]
+            st.dataframe(tabla_variacion, use_container_width=True)
+        else:
+            st.info("No hay movimientos registrados en el rango de fechas seleccionado.")
+    
+    elif tipo_reporte == "Análisis de Proveedores":
+        st.subheader("Análisis de Proveedores")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            fecha_inicio = st.date_input("Fecha Inicio:", value=datetime.now() - timedelta(days=365), key="proveedores_fecha_inicio")
+        with col2:
+            fecha_fin = st.date_input("Fecha Fin:", value=datetime.now(), key="proveedores_fecha_fin")
+        
+        indice_compras = cargar_indice_compras()
+        gasto = indice_compras.gasto_mensual(fecha_inicio, fecha_fin)
+        
+        if not gasto.empty:
+            gasto['proveedor'] = gasto['proveedor_id'].apply(obtener_nombre_proveedor)
+            
+            # Gasto por proveedor y mes
+            fig_gasto = px.bar(
+                gasto,
+                x='mes',
+                y='gasto',
+                color='proveedor',
+                title='Gasto Mensual por Proveedor',
+                labels={'mes': 'Mes', 'gasto': 'Gasto (S/)', 'proveedor': 'Proveedor'}
+            )
+            st.plotly_chart(fig_gasto, use_container_width=True)
+            
+            gasto_total = gasto.groupby('proveedor', as_index=False)['gasto'].sum().sort_values('gasto', ascending=False)
+            gasto_total.columns = ['Proveedor', 'Gasto Total (S/)']
+            st.dataframe(gasto_total, use_container_width=True)
+            
+            # Comparación de precios entre proveedores para un insumo
+            st.subheader("Precios por Proveedor")
+            insumos_comprados = sorted(indice_compras.lineas['insumo_id'].unique().tolist())
+            insumo_id = st.selectbox(
+                "Insumo:",
+                options=insumos_comprados,
+                format_func=lambda x: obtener_nombre_insumo(x),
+                key="proveedores_insumo"
+            )
+            
+            dispersion = indice_compras.dispersion_precios(fecha_inicio, fecha_fin, insumo_id)
+            if not dispersion.empty:
+                ultimo = indice_compras.ultimo_precio(insumo_id)
+                if ultimo is not None:
+                    st.write(
+                        f"**Último precio pagado:** S/ {ultimo[1]:.2f} a {obtener_nombre_proveedor(ultimo[0])} "
+                        f"({ultimo[2]:%d/%m/%Y})"
+                    )
+                
+                dispersion['proveedor'] = dispersion['proveedor_id'].apply(obtener_nombre_proveedor)
+                tabla_dispersion = dispersion.sort_values('precio_promedio')[[
+                    'proveedor', 'compras', 'cantidad', 'precio_minimo', 'precio_maximo',
+                    'precio_promedio', 'diferencia_vs_mejor', 'ultima_fecha'
+                ]]
+                tabla_dispersion.columns = [
+                    'Proveedor', 'Compras', 'Cantidad', 'Precio Mínimo (S/)', 'Precio Máximo (S/)',
+                    'Precio Promedio (S/)', 'Diferencia vs Mejor (S/)', 'Última Compra'
+                ]
+                st.dataframe(tabla_dispersion, use_container_width=True)
+            else:
+                st.info("No hay compras de este insumo en el rango de fechas seleccionado.")
+        else:
+            st.info("No hay compras con proveedor en el rango de fechas seleccionado.")
+
+# Página de Configuración
+elif menu == "Configuración":
+    st.title("Configuración")
+    
+    tab1, tab2 = st.tabs(["Exportar Datos", "Importar Datos"])
+    
+    with tab1:
+        st.subheader("Exportar Datos")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            tipo_exportacion = st.selectbox(
+                "Datos a Exportar:",
+                options=list(EXPORTACIONES.keys()),
+                format_func=lambda x: EXPORTACIONES[x]
+            )
+            formato = st.selectbox("Formato:", ["csv", "parquet"])
+        with col2:
+            fecha_inicio = st.date_input("Fecha Inicio:", value=datetime.now() - timedelta(days=365), key="exportar_fecha_inicio")
+            fecha_fin = st.date_input("Fecha Fin:", value=datetime.now(), key="exportar_fecha_fin")
+        
+        if st.button("Generar Exportación"):
+            # El archivo de la exportación anterior de esta sesión ya no se puede descargar
+            anterior = st.session_state.pop('exportacion', None)
+            if anterior is not None:
+                eliminar_archivo(anterior['ruta'])
+            
+            # Se escribe a un archivo temporal por bloques para no cargar todo el histórico en memoria
+            archivo = tempfile.NamedTemporaryFile(suffix=f".{formato}", delete=False)
+            archivo.close()
+            
+            try:
+                with st.spinner("Exportando datos..."):
+                    filas = exportar(sb, tipo_exportacion, fecha_inicio, fecha_fin, archivo.name, formato)
+                
+                if filas > 0:
+                    st.session_state.exportacion = {
+                        'ruta': archivo.name,
+                        'nombre': f"{tipo_exportacion}_{fecha_inicio}_{fecha_fin}.{formato}",
+                        'filas': filas
+                    }
+                else:
+                    eliminar_archivo(archivo.name)
+                    st.info("No hay datos para el rango de fechas seleccionado.")
+            except Exception as e:
+                eliminar_archivo(archivo.name)
+                st.error(f"Error al exportar los datos: {str(e)}")
+        
+        if 'exportacion' in st.session_state and os.path.exists(st.session_state.exportacion['ruta']):
+            exportacion = st.session_state.exportacion
+            st.success(f"Exportación lista: {exportacion['filas']} filas.")
+            with open(exportacion['ruta'], 'rb') as f:
+                st.download_button("Descargar Archivo", data=f, file_name=exportacion['nombre'])
+    
+    with tab2:
+        st.subheader("Importar Datos desde Archivo")
+        
+        tipo_importacion = st.selectbox(
+            "Datos a Importar:",
+            options=list(IMPORTACIONES.keys()),
+            format_func=lambda x: IMPORTACIONES[x]['titulo']
+        )
+        especificacion = IMPORTACIONES[tipo_importacion]
+        st.caption(
+            f"Columnas requeridas: {', '.join(especificacion['requeridas'])}. "
+            f"Opcionales: {', '.join(especificacion['opcionales'])}."
+        )
+        
+        archivo = st.file_uploader("Archivo CSV o XLSX:", type=["csv", "xlsx"])
+        
+        if archivo is not None:
+            try:
+                df_archivo = leer_archivo(archivo, archivo.name)
+            except Exception as e:
+                st.error(f"No se pudo leer el archivo: {str(e)}")
+                df_archivo = None
+            
+            if df_archivo is not None:
+                insumos = cargar_insumos()
+                validos, errores = validar(tipo_importacion, df_archivo, insumos, cargar_categorias())
+                
+                st.write(f"Filas en el archivo: {len(df_archivo)} — válidas: {len(validos)}")
+                if not errores.empty:
+                    st.warning(f"Se encontraron {len(errores)} error(es). Las filas con errores no se importarán.")
+                    tabla_errores = errores.copy()
+                    tabla_errores.columns = ['Fila', 'Error']
+                    st.dataframe(tabla_errores, use_container_width=True)
+                    if tipo_importacion == 'recetas':
+                        omitidas = recetas_omitidas(df_archivo, validos)
+                        if omitidas:
+                            st.warning(
+                                f"Las recetas con alguna fila con errores no se importan completas: {', '.join(omitidas)}. "
+                                "Sus recetas actuales no se modifican."
+                            )
+                
+                if not validos.empty and st.button("Importar Datos"):
+                    try:
+                        with st.spinner("Importando datos..."):
+                            if tipo_importacion == 'insumos':
+                                resumen = importar_insumos(sb, validos, insumos)
+                            elif tipo_importacion == 'recetas':
+                                resumen = importar_recetas(sb, validos, cargar_productos())
+                            else:
+                                resumen = importar_compras(sb, validos, sucursal_actual())
+                        
+                        st.cache_data.clear()
+                        obtener_instantanea().marcar(*TABLAS_COMPARTIDAS)
+                        for sucursal_id in ids_sucursales():
+                            obtener_instantanea_sucursal(sucursal_id).marcar(*sucursales.TABLAS_POR_SUCURSAL)
+                        st.success("Importación completada: " + ", ".join(f"{k}: {v}" for k, v in resumen.items()))
+                    except Exception as e:
+                        st.error(f"Error al importar los datos: {str(e)}")
@@ -0,0 +1,73 @@
+from bisect import bisect_left
+
+# Cantidad de opciones a partir de la cual los formularios muestran una búsqueda por texto
+LIMITE_SIN_BUSQUEDA = 200
+
+# Cantidad máxima de resultados de una búsqueda
+LIMITE_RESULTADOS = 50
+
+
+def _nombre(columnas):
+    return columnas['nombre']
+
+
+def _nombre_con_stock(columnas):
+    return [f"{nombre} (Stock: {stock})" for nombre, stock in zip(columnas['nombre'], columnas['stock_actual'])]
+
+
+# Listas de opciones por tipo: (tabla de origen, columnas usadas, función que arma las etiquetas)
+TIPOS = {
+    'insumos': ('insumos', ['nombre'], _nombre),
+    'insumos_stock': ('insumos', ['nombre', 'stock_actual'], _nombre_con_stock),
+    'productos': ('productos', ['nombre'], _nombre),
+    'categorias': ('categorias', ['nombre'], _nombre),
+    'proveedores': ('proveedores', ['nombre'], _nombre),
+}
+
+
+# Lista de opciones (id, etiqueta) lista para un selectbox
+# Las etiquetas se consultan en un diccionario y la búsqueda usa un índice ordenado de palabras,
+# así el costo por opción no depende del tamaño del catálogo
+class ListaOpciones:
+    def __init__(self, ids, etiquetas):
+        self.ids = list(ids)
+        self._etiquetas = dict(zip(self.ids, etiquetas))
+        # Cada palabra de la etiqueta (en minúsculas) apunta a su id, ordenadas para búsqueda por prefijo
+        self._palabras = sorted(
+            (palabra, orden)
+            for orden, etiqueta in enumerate(etiquetas)
+            for palabra in set(str(etiqueta).lower().split())
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    # Función para obtener la etiqueta de un id (se usa como format_func)
+    def etiqueta(self, id_opcion):
+        return self._etiquetas.get(id_opcion, "No encontrado")
+
+    # Función para buscar opciones cuyas palabras empiecen con las palabras del texto, en el orden del catálogo
+    def buscar(self, texto, limite=LIMITE_RESULTADOS):
+        palabras = str(texto or '').lower().split()
+        if not palabras:
+            return self.ids[:limite]
+
+        coincidencias = None
+        for palabra in palabras:
+            encontrados = set()
+            posicion = bisect_left(self._palabras, (palabra, -1))
+            while posicion < len(self._palabras) and self._palabras[posicion][0].startswith(palabra):
+                encontrados.add(self._palabras[posicion][1])
+                posicion += 1
+            coincidencias = encontrados if coincidencias is None else coincidencias & encontrados
+            if not coincidencias:
+                return []
+        return [self.ids[orden] for orden in sorted(coincidencias)[:limite]]
+
+
+# Función para armar la lista de opciones de un tipo a partir de su tabla
+def construir(tipo, df):
+    _, columnas, etiquetas = TIPOS[tipo]
+    if df.empty:
+        return ListaOpciones([], [])
+    return ListaOpciones(df['id'].tolist(), list(etiquetas({columna: df[columna].tolist() for columna in columnas})))
@@ -0,0 +1,110 @@
+import threading
+import time
+
+import cache_disco
+
+# Segundos entre revisiones de tareas pendientes
+INTERVALO_REVISION = 5
+
+# Cada cuántos segundos se recalcula una tarea aunque no cambien sus tablas
+PERIODO_POR_DEFECTO = 15 * 60
+
+
+# Cálculos pesados en segundo plano (márgenes, consumo diario, alertas de stock)
+# Cada tarea se recalcula cuando cambia la versión de alguna de sus tablas en la instantánea, cuando se
+# solicita explícitamente (por ejemplo después de una escritura) o cuando vence su periodo. Los resultados
+# se publican con un número de versión y se guardan en disco, así las páginas solo leen resultados terminados.
+class Precalculador:
+    def __init__(self, instantanea, intervalo=INTERVALO_REVISION):
+        self._instantanea = instantanea
+        self._intervalo = intervalo
+        self._tareas = {}
+        self._resultados = {}
+        self._candado = threading.Lock()
+        self._despertar = threading.Event()
+        self._hilo = None
+
+    # Función para registrar una tarea: funcion() devuelve un DataFrame
+    # instantanea: la instantánea de la que dependen sus tablas, si no es la del precalculador
+    # (por ejemplo la de una sucursal)
+    def registrar(self, nombre, funcion, tablas=(), periodo=PERIODO_POR_DEFECTO, instantanea=None):
+        datos, meta = cache_disco.leer_derivado_con_version(f"precalculo_{nombre}")
+        with self._candado:
+            self._tareas[nombre] = {
+                'funcion': funcion,
+                'tablas': list(tablas),
+                'instantanea': instantanea or self._instantanea,
+                'periodo': periodo,
+                'versiones': None,
+                'siguiente': 0,
+                'solicitada': True,
+            }
+            # Último resultado guardado: se muestra mientras se calcula el nuevo
+            if datos is not None and meta:
+                self._resultados[nombre] = (datos, meta['version'], meta['calculado'])
+
+    # Función para pedir que se recalculen tareas lo antes posible
+    def solicitar(self, *nombres):
+        with self._candado:
+            for nombre in nombres or list(self._tareas):
+                if nombre in self._tareas:
+                    self._tareas[nombre]['solicitada'] = True
+        self._despertar.set()
+
+    def registrada(self, nombre):
+        with self._candado:
+            return nombre in self._tareas
+
+    # Función para obtener el último resultado publicado: (datos, version, calculado) o (None, 0, None)
+    def resultado(self, nombre):
+        with self._candado:
+            return self._resultados.get(nombre, (None, 0, None))
+
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._ciclo, name="precalculo", daemon=True)
+            self._hilo.start()
+
+    def _versiones(self, tarea):
+        return tuple(tarea['instantanea'].version(tabla) for tabla in tarea['tablas'])
+
+    # Función que ejecuta las tareas pendientes; devuelve los nombres de las tareas calculadas
+    def ejecutar_pendientes(self):
+        calculadas = []
+        with self._candado:
+            tareas = list(self._tareas.items())
+
+        for nombre, tarea in tareas:
+            versiones = self._versiones(tarea)
+            if not (tarea['solicitada'] or versiones != tarea['versiones'] or time.time() >= tarea['siguiente']):
+                continue
+
+            # Una solicitud que llegue durante el cálculo vuelve a marcar la tarea
+            with self._candado:
+                solicitada, tarea['solicitada'] = tarea['solicitada'], False
+            try:
+                datos = tarea['funcion']()
+            except Exception:
+                # Un error de conexión no detiene las demás tareas; esta se reintenta en la siguiente revisión
+                with self._candado:
+                    tarea['solicitada'] = tarea['solicitada'] or solicitada
+                continue
+            calculado = time.time()
+            with self._candado:
+                version = self._resultados.get(nombre, (None, 0, None))[1] + 1
+                self._resultados[nombre] = (datos, version, calculado)
+            tarea['versiones'] = versiones
+            tarea['siguiente'] = calculado + tarea['periodo']
+            cache_disco.guardar_derivado(f"precalculo_{nombre}", datos, {'version': version, 'calculado': calculado})
+            calculadas.append(nombre)
+        return calculadas
+
+    def _ciclo(self):
+        while True:
+            try:
+                self.ejecutar_pendientes()
+            except Exception:
+                # Por ejemplo, sin conexión al cargar las tablas de la instantánea
+                pass
+            self._despertar.wait(self._intervalo)
+            self._despertar.clear()
@@ -0,0 +1,170 @@
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import cache_disco
+from datos import ids_en_ventana, leer_lineas_nuevas
+
+# Versión del formato del índice guardado en disco
+VERSION_INDICE = 2
+
+NOMBRE_DERIVADO = 'indice_compras'
+
+COLUMNAS = ['id', 'insumo_id', 'proveedor_id', 'fecha', 'cantidad', 'precio_unitario', 'subtotal']
+
+# Días en que el último precio de un proveedor se considera vigente para sugerirlo
+DIAS_RECIENTES = 90
+
+
+# Función para normalizar el nombre de un proveedor (igual que normalizar_proveedor en la base de datos)
+def normalizar_nombre(nombre):
+    normalizado = ' '.join(str(nombre or '').split()).lower()
+    return normalizado or None
+
+
+def _vacio():
+    return pd.DataFrame({
+        'id': pd.Series(dtype='int64'),
+        'insumo_id': pd.Series(dtype='int64'),
+        'proveedor_id': pd.Series(dtype='int64'),
+        'fecha': pd.Series(dtype='datetime64[ns]'),
+        'cantidad': pd.Series(dtype='float64'),
+        'precio_unitario': pd.Series(dtype='float64'),
+        'subtotal': pd.Series(dtype='float64'),
+    })
+
+
+# Índice de líneas de compra ordenadas por (insumo, proveedor, fecha)
+# Las consultas por insumo usan búsqueda binaria sobre el arreglo de insumos; el último precio
+# de cada (insumo, proveedor) se mantiene en un diccionario para sugerir proveedores sin recorrer el historial
+class IndiceCompras:
+    def __init__(self, lineas=None, ultima_linea=0, vistas=()):
+        self.lineas = _vacio() if lineas is None else lineas
+        self.ultima_linea = ultima_linea
+        self.vistas = set(vistas)
+        self.version_datos = None
+        self.candado = threading.Lock()
+        self._ultimos = {}
+        self._agregar_ultimos(self.lineas)
+
+    def _agregar_ultimos(self, lineas):
+        # Las líneas llegan ordenadas por fecha dentro de cada (insumo, proveedor): la última gana
+        for insumo_id, proveedor_id, fecha, precio in zip(
+            lineas['insumo_id'], lineas['proveedor_id'], lineas['fecha'], lineas['precio_unitario']
+        ):
+            por_proveedor = self._ultimos.setdefault(int(insumo_id), {})
+            anterior = por_proveedor.get(int(proveedor_id))
+            if anterior is None or fecha >= anterior[0]:
+                por_proveedor[int(proveedor_id)] = (fecha, float(precio))
+
+    # Función para incorporar las líneas de compra registradas después de la última procesada
+    # Devuelve la cantidad de líneas nuevas
+    def actualizar(self, sb):
+        with self.candado:
+            nuevas = leer_lineas_nuevas(
+                sb, 'compra_detalles', 'compras', 'compra_id', ['fecha', 'proveedor_id'], self.ultima_linea, self.vistas
+            )
+            if nuevas.empty:
+                return 0
+            self.ultima_linea = max(self.ultima_linea, int(nuevas['id'].max()))
+            self.vistas = ids_en_ventana(self.vistas, nuevas['id'], self.ultima_linea)
+
+            # Solo se indexan las compras con proveedor
+            nuevas = nuevas.dropna(subset=['proveedor_id'])
+            if not nuevas.empty:
+                nuevas = nuevas.assign(
+                    insumo_id=nuevas['insumo_id'].astype('int64'),
+                    proveedor_id=nuevas['proveedor_id'].astype('int64'),
+                    fecha=pd.to_datetime(nuevas['fecha']),
+                    cantidad=nuevas['cantidad'].astype(float),
+                    precio_unitario=nuevas['precio_unitario'].astype(float),
+                    subtotal=nuevas['subtotal'].astype(float),
+                )[COLUMNAS].sort_values(['insumo_id', 'proveedor_id', 'fecha', 'id'])
+                self.lineas = pd.concat([self.lineas, nuevas], ignore_index=True).sort_values(
+                    ['insumo_id', 'proveedor_id', 'fecha', 'id'], kind='mergesort', ignore_index=True
+                )
+                self._agregar_ultimos(nuevas)
+
+            guardar(self)
+            return len(nuevas)
+
+    def _lineas_insumo(self, insumo_id):
+        lineas = self.lineas
+        insumos = lineas['insumo_id'].to_numpy()
+        inicio = int(np.searchsorted(insumos, insumo_id, side='left'))
+        fin = int(np.searchsorted(insumos, insumo_id, side='right'))
+        return lineas.iloc[inicio:fin]
+
+    # Función para obtener el último precio pagado por un insumo: (proveedor_id, precio, fecha) o None
+    # Sin proveedor_id devuelve la compra más reciente entre todos los proveedores
+    def ultimo_precio(self, insumo_id, proveedor_id=None):
+        with self.candado:
+            por_proveedor = dict(self._ultimos.get(insumo_id, {}))
+        if proveedor_id is not None:
+            if proveedor_id not in por_proveedor:
+                return None
+            fecha, precio = por_proveedor[proveedor_id]
+            return proveedor_id, precio, fecha
+        if not por_proveedor:
+            return None
+        proveedor_id, (fecha, precio) = max(por_proveedor.items(), key=lambda item: item[1][0])
+        return proveedor_id, precio, fecha
+
+    # Función para sugerir el proveedor con el menor último precio entre los que vendieron el insumo
+    # en los últimos `dias` días: (proveedor_id, precio, fecha) o None
+    def sugerir_proveedor(self, insumo_id, dias=DIAS_RECIENTES, hoy=None):
+        desde = pd.Timestamp(hoy or datetime.now().date()) - timedelta(days=dias)
+        with self.candado:
+            recientes = [
+                (precio, proveedor_id, fecha)
+                for proveedor_id, (fecha, precio) in self._ultimos.get(insumo_id, {}).items()
+                if fecha >= desde
+            ]
+        if not recientes:
+            return None
+        precio, proveedor_id, fecha = min(recientes)
+        return proveedor_id, precio, fecha
+
+    # Función para comparar precios entre proveedores en un periodo, por insumo y proveedor
+    # Incluye precio mínimo, máximo, promedio ponderado por cantidad y la diferencia con el mejor promedio
+    def dispersion_precios(self, fecha_inicio, fecha_fin, insumo_id=None):
+        lineas = self.lineas if insumo_id is None else self._lineas_insumo(insumo_id)
+        lineas = lineas[(lineas['fecha'] >= pd.Timestamp(fecha_inicio)) & (lineas['fecha'] <= pd.Timestamp(fecha_fin))]
+
+        resumen = lineas.groupby(['insumo_id', 'proveedor_id'], as_index=False).agg(
+            compras=('id', 'count'),
+            cantidad=('cantidad', 'sum'),
+            gasto=('subtotal', 'sum'),
+            precio_minimo=('precio_unitario', 'min'),
+            precio_maximo=('precio_unitario', 'max'),
+            ultima_fecha=('fecha', 'max'),
+        )
+        resumen['precio_promedio'] = (resumen['gasto'] / resumen['cantidad']).where(resumen['cantidad'] > 0, 0.0)
+        mejor = resumen.groupby('insumo_id')['precio_promedio'].transform('min')
+        resumen['diferencia_vs_mejor'] = resumen['precio_promedio'] - mejor
+        return resumen
+
+    # Función para obtener el gasto por proveedor y mes en un periodo
+    def gasto_mensual(self, fecha_inicio, fecha_fin):
+        lineas = self.lineas
+        lineas = lineas[(lineas['fecha'] >= pd.Timestamp(fecha_inicio)) & (lineas['fecha'] <= pd.Timestamp(fecha_fin))]
+        return lineas.assign(mes=lineas['fecha'].dt.to_period('M').dt.to_timestamp()).groupby(
+            ['proveedor_id', 'mes'], as_index=False
+        )['subtotal'].sum().rename(columns={'subtotal': 'gasto'})
+
+
+# Función para guardar el índice en la caché en disco
+def guardar(indice):
+    cache_disco.guardar_derivado(NOMBRE_DERIVADO, indice.lineas, {
+        'formato': VERSION_INDICE, 'linea': indice.ultima_linea, 'vistas': sorted(indice.vistas)
+    })
+
+
+# Función para restaurar el índice guardado, o crear uno vacío si no hay uno válido
+def cargar():
+    lineas, version = cache_disco.leer_derivado_con_version(NOMBRE_DERIVADO)
+    if lineas is None or not version or version.get('formato') != VERSION_INDICE:
+        return IndiceCompras()
+    return IndiceCompras(lineas, version['linea'], version['vistas'])
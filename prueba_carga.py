@@ -0,0 +1,775 @@
+import argparse
+import contextlib
+import itertools
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta, timezone
+from unittest import mock
+
+from postgrest.exceptions import APIError
+
+# Prueba de carga: simula sesiones concurrentes de tablets recorriendo main.py sin navegador
+# (Streamlit AppTest) contra una base local en memoria con latencia agregada en cada llamada.
+# Para cada nivel de concurrencia informa acciones por segundo, latencia p50/p95 de cada rerun
+# y llamadas a la base por acción, separando las de la sesión de las de los procesos en segundo plano.
+#
+# Uso:
+#     python prueba_carga.py --sesiones 1 5 10 20 30 --duracion 60 --latencia 0.05
+#
+# Todas las sesiones corren en un mismo proceso, igual que en el servidor: comparten st.cache_resource,
+# la instantánea, el precalculador y la cola de escrituras.
+
+RUTA_APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+# Clave de session_state con el id de la acción en curso; la base local la usa para atribuir cada llamada
+CLAVE_ACCION = '_prueba_carga_accion'
+
+# Peso de cada flujo en la mezcla de acciones de una sesión
+PESOS_FLUJOS = {'compra': 4, 'produccion': 4, 'reporte': 2}
+
+REPORTES = [
+    "Evolución de Precios de Insumos",
+    "Margen de Ganancia por Producto",
+    "Margen Histórico (Costos Congelados)",
+    "Consumo de Insumos",
+    "Producción Histórica",
+    "Valorización de Inventario",
+    "Mermas y Variaciones",
+    "Análisis de Proveedores",
+]
+
+# Tablas que registran avisos en la tabla cambios (triggers de sql/009, 010 y 011)
+TABLAS_CON_AVISO = {
+    'insumos', 'categorias', 'productos', 'historico_precios', 'produccion', 'produccion_costos',
+    'compras', 'compra_detalles', 'consumos', 'consumo_detalles', 'receta_insumos',
+    'receta_costos_adicionales', 'receta_versiones', 'proveedores', 'sucursales', 'stock_sucursal',
+}
+
+# Después de un rerun fallido la sesión espera antes de seguir (espera exponencial con tope),
+# y se detiene tras varios fallos seguidos para no medir un ciclo de errores
+ESPERA_TRAS_FALLO = 0.5
+ESPERA_MAXIMA_TRAS_FALLO = 10
+MAX_FALLOS_SEGUIDOS = 5
+
+# Clave primaria de las tablas que no usan id (para upsert)
+CLAVES = {'produccion_costos': 'produccion_id'}
+
+
+def _ahora():
+    return datetime.now(timezone.utc).isoformat()
+
+
+# Las marcas updated_at llegan desde la caché en disco con otro formato de texto; se comparan como fechas
+def _comparable(columna, valor):
+    if columna == 'updated_at' and isinstance(valor, str):
+        return datetime.fromisoformat(valor.replace(' ', 'T'))
+    return valor
+
+
+# Acción a la que se atribuyen las llamadas del hilo actual fuera de una sesión (por ejemplo la cola de escrituras)
+_accion_hilo = threading.local()
+
+
+def _accion_actual():
+    if getattr(_accion_hilo, 'accion', None) is not None:
+        return _accion_hilo.accion
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        contexto = get_script_run_ctx(suppress_warning=True)
+        if contexto is None:
+            return None
+        return contexto.session_state[CLAVE_ACCION]
+    except Exception:
+        return None
+
+
+class _Respuesta:
+    def __init__(self, data):
+        self.data = data
+
+
+# Consulta al estilo de postgrest (select/insert/upsert/update/delete con filtros encadenados)
+class _Consulta:
+    def __init__(self, base, tabla):
+        self._base = base
+        self.tabla = tabla
+        self.operacion = 'select'
+        self.columnas = None
+        self.filas = None
+        self.valores = None
+        self.on_conflict = None
+        self.filtros = []
+        self.orden = None
+        self.limite = None
+
+    def select(self, columnas='*'):
+        self.operacion = 'select'
+        self.columnas = None if columnas == '*' else [columna.strip() for columna in columnas.split(',')]
+        return self
+
+    def insert(self, filas):
+        self.operacion = 'insert'
+        self.filas = filas if isinstance(filas, list) else [filas]
+        return self
+
+    def upsert(self, filas, on_conflict=None):
+        self.operacion = 'upsert'
+        self.filas = filas if isinstance(filas, list) else [filas]
+        self.on_conflict = on_conflict
+        return self
+
+    def update(self, valores):
+        self.operacion = 'update'
+        self.valores = valores
+        return self
+
+    def delete(self):
+        self.operacion = 'delete'
+        return self
+
+    def _filtro(self, operador, columna, valor):
+        self.filtros.append((operador, columna, valor))
+        return self
+
+    def eq(self, columna, valor):
+        return self._filtro('eq', columna, valor)
+
+    def neq(self, columna, valor):
+        return self._filtro('neq', columna, valor)
+
+    def gt(self, columna, valor):
+        return self._filtro('gt', columna, valor)
+
+    def gte(self, columna, valor):
+        return self._filtro('gte', columna, valor)
+
+    def lt(self, columna, valor):
+        return self._filtro('lt', columna, valor)
+
+    def lte(self, columna, valor):
+        return self._filtro('lte', columna, valor)
+
+    def in_(self, columna, valores):
+        return self._filtro('in', columna, set(valores))
+
+    def order(self, columna, desc=False):
+        self.orden = (columna, desc)
+        return self
+
+    def limit(self, cantidad):
+        self.limite = cantidad
+        return self
+
+    def cumple(self, fila):
+        for operador, columna, valor in self.filtros:
+            actual = fila.get(columna)
+            if actual is None:
+                return False
+            if operador == 'in':
+                if actual not in valor:
+                    return False
+                continue
+            actual, valor_filtro = _comparable(columna, actual), _comparable(columna, valor)
+            if not {
+                'eq': actual == valor_filtro,
+                'neq': actual != valor_filtro,
+                'gt': actual > valor_filtro,
+                'gte': actual >= valor_filtro,
+                'lt': actual < valor_filtro,
+                'lte': actual <= valor_filtro,
+            }[operador]:
+                return False
+        return True
+
+    def execute(self):
+        return self._base.ejecutar(self)
+
+
+class _Llamada:
+    def __init__(self, base, nombre, parametros):
+        self._base = base
+        self.nombre = nombre
+        self.parametros = parametros
+
+    def execute(self):
+        return self._base.ejecutar_rpc(self)
+
+
+# Base de datos local en memoria con la interfaz del cliente de Supabase que usa la aplicación
+# Cada execute() espera la latencia configurada (fuera del candado, como una red real) y se cuenta
+# por acción de la sesión que la hizo o como llamada de segundo plano
+class BaseLocal:
+    def __init__(self, latencia=0.05, variacion=0.25, semilla=0):
+        self.latencia = latencia
+        self.variacion = variacion
+        self._azar = random.Random(semilla)
+        self._candado = threading.Lock()
+        self._tablas = defaultdict(list)
+        self._por_id = defaultdict(dict)
+        self._siguiente_id = defaultdict(lambda: 1)
+        self._claves = {}
+        self._stock = {}
+        self._llamadas_accion = Counter()
+        self.llamadas = Counter()
+
+    def table(self, tabla):
+        return _Consulta(self, tabla)
+
+    def rpc(self, nombre, parametros=None):
+        return _Llamada(self, nombre, parametros or {})
+
+    # Función para cargar filas iniciales sin latencia ni avisos
+    def poblar(self, tabla, filas):
+        with self._candado:
+            for fila in filas:
+                self._insertar(tabla, dict(fila), avisar=False)
+
+    def _esperar(self, destino):
+        accion = _accion_actual()
+        with self._candado:
+            self.llamadas[('sesion' if accion is not None else 'fondo', destino)] += 1
+            if accion is not None:
+                self._llamadas_accion[accion] += 1
+            espera = self.latencia * (1 + self._azar.uniform(-self.variacion, self.variacion))
+        time.sleep(max(espera, 0))
+
+    # Función para traducir las etiquetas de un selectbox (nombres) a los ids de su tabla de origen
+    def ids_por_nombre(self, tabla):
+        with self._candado:
+            return {fila['nombre']: fila['id'] for fila in self._tablas[tabla]}
+
+    # Función para obtener cuántas llamadas hizo una acción (y olvidarla)
+    def llamadas_de(self, accion):
+        with self._candado:
+            return self._llamadas_accion.pop(accion, 0)
+
+    def _avisar(self, tabla):
+        if tabla in TABLAS_CON_AVISO:
+            self._insertar('cambios', {'tabla': tabla}, avisar=False)
+
+    def _insertar(self, tabla, fila, avisar=True):
+        clave = CLAVES.get(tabla, 'id')
+        if clave == 'id' and fila.get('id') is None:
+            fila['id'] = self._siguiente_id[tabla]
+        if clave == 'id':
+            self._siguiente_id[tabla] = max(self._siguiente_id[tabla], fila['id'] + 1)
+        if tabla != 'cambios' and 'updated_at' not in fila:
+            fila['updated_at'] = _ahora()
+        self._tablas[tabla].append(fila)
+        self._por_id[tabla][fila[clave]] = fila
+        if tabla == 'stock_sucursal':
+            self._stock[(fila['sucursal_id'], fila['insumo_id'])] = fila
+        if avisar:
+            self._avisar(tabla)
+        return fila
+
+    def _actualizar(self, tabla, fila, valores):
+        fila.update(valores)
+        fila['updated_at'] = _ahora()
+        self._avisar(tabla)
+
+    def ejecutar(self, consulta):
+        self._esperar(consulta.tabla)
+        with self._candado:
+            tabla = consulta.tabla
+            if consulta.operacion == 'insert':
+                return _Respuesta([dict(self._insertar(tabla, dict(fila))) for fila in consulta.filas])
+
+            if consulta.operacion == 'upsert':
+                clave = consulta.on_conflict or CLAVES.get(tabla, 'id')
+                resultado = []
+                for fila in consulta.filas:
+                    existente = next((f for f in self._tablas[tabla] if f.get(clave) == fila.get(clave)), None)
+                    if existente is None:
+                        resultado.append(dict(self._insertar(tabla, dict(fila))))
+                    else:
+                        self._actualizar(tabla, existente, fila)
+                        resultado.append(dict(existente))
+                return _Respuesta(resultado)
+
+            filas = [fila for fila in self._tablas[tabla] if consulta.cumple(fila)]
+            if consulta.operacion == 'update':
+                for fila in filas:
+                    self._actualizar(tabla, fila, consulta.valores)
+                return _Respuesta([dict(fila) for fila in filas])
+
+            if consulta.operacion == 'delete':
+                eliminadas = {id(fila) for fila in filas}
+                self._tablas[tabla] = [fila for fila in self._tablas[tabla] if id(fila) not in eliminadas]
+                clave = CLAVES.get(tabla, 'id')
+                for fila in filas:
+                    self._por_id[tabla].pop(fila.get(clave), None)
+                if filas:
+                    self._avisar(tabla)
+                return _Respuesta([dict(fila) for fila in filas])
+
+            # Las filas se guardan en orden de id, así el orden por id ascendente no requiere ordenar
+            if consulta.orden is not None and consulta.orden != ('id', False):
+                columna, descendente = consulta.orden
+                filas = sorted(filas, key=lambda fila: _comparable(columna, fila.get(columna)), reverse=descendente)
+            if consulta.limite is not None:
+                filas = filas[:consulta.limite]
+            if consulta.columnas is None:
+                return _Respuesta([dict(fila) for fila in filas])
+            return _Respuesta([{columna: fila.get(columna) for columna in consulta.columnas} for fila in filas])
+
+    def ejecutar_rpc(self, llamada):
+        self._esperar(f"rpc:{llamada.nombre}")
+        funcion = getattr(self, f"_rpc_{llamada.nombre}", None)
+        if funcion is None:
+            # Igual que PostgREST sin la función: la aplicación usa su cálculo local
+            raise APIError({'message': f"Función {llamada.nombre} no disponible", 'code': 'PGRST202', 'hint': None, 'details': None})
+        with self._candado:
+            clave = (llamada.nombre, llamada.parametros.get('clave'))
+            if clave[1] is not None and clave in self._claves:
+                return _Respuesta(self._claves[clave])
+            resultado = funcion(**llamada.parametros)
+            if clave[1] is not None:
+                self._claves[clave] = resultado
+            return _Respuesta(resultado)
+
+    # Funciones del servidor (sql/011_sucursales.sql) con el mismo efecto sobre stock y movimientos
+    def _sumar_stock(self, sucursal, insumo_id, cantidad):
+        fila = self._stock.get((sucursal, insumo_id))
+        if fila is None:
+            fila = self._insertar('stock_sucursal', {
+                'sucursal_id': sucursal, 'insumo_id': insumo_id, 'stock_actual': 0.0, 'stock_minimo': 0.0
+            })
+        self._actualizar('stock_sucursal', fila, {'stock_actual': fila['stock_actual'] + cantidad})
+        insumo = self._por_id['insumos'][insumo_id]
+        self._actualizar('insumos', insumo, {'stock_actual': insumo['stock_actual'] + cantidad})
+
+    def _descontar_stock(self, detalles, sucursal):
+        for detalle in detalles:
+            fila = self._stock.get((sucursal, detalle['insumo_id']))
+            if fila is None or fila['stock_actual'] < detalle['cantidad']:
+                raise APIError({
+                    'message': f"Stock insuficiente del insumo {detalle['insumo_id']}",
+                    'code': 'P0001', 'hint': None, 'details': None
+                })
+        for detalle in detalles:
+            self._sumar_stock(sucursal, detalle['insumo_id'], -detalle['cantidad'])
+
+    def _registrar_consumo_detalles(self, fecha, produccion_id, observaciones, detalles, sucursal):
+        consumo = self._insertar('consumos', {
+            'fecha': fecha, 'produccion_id': produccion_id, 'observaciones': observaciones, 'sucursal_id': sucursal
+        })
+        for detalle in detalles:
+            self._insertar('consumo_detalles', {
+                'consumo_id': consumo['id'], 'insumo_id': detalle['insumo_id'],
+                'cantidad': detalle['cantidad'], 'sucursal_id': sucursal
+            })
+        return consumo['id']
+
+    def _rpc_registrar_compra(self, clave, compra, detalles, sucursal=1):
+        nombre = (compra.get('proveedor') or '').strip()
+        proveedor = next((p for p in self._tablas['proveedores'] if p['nombre_normalizado'] == nombre.lower()), None)
+        if proveedor is None and nombre:
+            proveedor = self._insertar('proveedores', {'nombre': nombre, 'nombre_normalizado': nombre.lower()})
+        cabecera = self._insertar('compras', dict(
+            compra, proveedor_id=proveedor['id'] if proveedor else None, sucursal_id=sucursal
+        ))
+        for detalle in detalles:
+            self._insertar('compra_detalles', dict(detalle, compra_id=cabecera['id'], sucursal_id=sucursal))
+            self._sumar_stock(sucursal, detalle['insumo_id'], detalle['cantidad'])
+        return cabecera['id']
+
+    def _rpc_registrar_consumo(self, clave, detalles, fecha, observaciones='', sucursal=1):
+        self._descontar_stock(detalles, sucursal)
+        return self._registrar_consumo_detalles(fecha, None, observaciones, detalles, sucursal)
+
+    def _rpc_registrar_produccion(self, producto_id, cantidad, costo_total, detalles, fecha, observaciones='', clave=None, sucursal=1, costo=None):
+        self._descontar_stock(detalles, sucursal)
+        produccion = self._insertar('produccion', {
+            'producto_id': producto_id, 'fecha': fecha, 'cantidad': cantidad,
+            'costo_total': costo_total, 'observaciones': observaciones, 'sucursal_id': sucursal
+        })
+        self._registrar_consumo_detalles(fecha, produccion['id'], f"Consumo para producción #{produccion['id']}", detalles, sucursal)
+        if costo is not None:
+            self._insertar('produccion_costos', dict(
+                costo, produccion_id=produccion['id'], producto_id=producto_id, sucursal_id=sucursal,
+                fecha=fecha, cantidad=cantidad
+            ))
+        return dict(produccion)
+
+    def _rpc_registrar_insumo(self, clave, insumo, fecha, sucursal=1):
+        fila = self._insertar('insumos', dict(insumo, stock_actual=0.0))
+        for sucursal_id in self._por_id['sucursales']:
+            self._insertar('stock_sucursal', {
+                'sucursal_id': sucursal_id, 'insumo_id': fila['id'], 'stock_actual': 0.0,
+                'stock_minimo': insumo.get('stock_minimo', 0.0)
+            })
+        self._sumar_stock(sucursal, fila['id'], insumo.get('stock_actual', 0.0))
+        self._insertar('historico_precios', {'insumo_id': fila['id'], 'precio': insumo['precio_actual'], 'fecha': fecha})
+        return fila['id']
+
+
+# Función para poblar la base local con un catálogo y un historial de movimientos de tamaño configurable
+def poblar_datos(base, insumos=300, productos=40, proveedores=25, sucursales=2, dias=365, semilla=1):
+    azar = random.Random(semilla)
+    hoy = date.today()
+    unidades = ["kg", "g", "l", "ml", "unidad", "paquete", "saco"]
+
+    base.poblar('sucursales', [
+        {'id': s, 'nombre': "Principal" if s == 1 else f"Sucursal {s}", 'activa': True} for s in range(1, sucursales + 1)
+    ])
+    base.poblar('categorias', [{'id': c, 'nombre': f"Categoría {c}"} for c in range(1, 11)])
+    base.poblar('proveedores', [
+        {'id': p, 'nombre': f"Proveedor {p}", 'nombre_normalizado': f"proveedor {p}"} for p in range(1, proveedores + 1)
+    ])
+
+    precios = {i: round(azar.uniform(1, 60), 2) for i in range(1, insumos + 1)}
+    # Stock alto: la prueba mide la carga, no los rechazos por falta de stock
+    base.poblar('insumos', [{
+        'id': i, 'nombre': f"Insumo {i:04d}", 'categoria_id': azar.randint(1, 10), 'precio_actual': precios[i],
+        'stock_actual': 1e6 * sucursales, 'stock_minimo': 10.0, 'unidad_medida': azar.choice(unidades)
+    } for i in range(1, insumos + 1)])
+    base.poblar('stock_sucursal', [
+        {'sucursal_id': s, 'insumo_id': i, 'stock_actual': 1e6, 'stock_minimo': 10.0}
+        for s in range(1, sucursales + 1) for i in range(1, insumos + 1)
+    ])
+    base.poblar('historico_precios', [
+        {'insumo_id': i, 'precio': round(precios[i] * azar.uniform(0.8, 1.2), 2), 'fecha': str(hoy - timedelta(days=d))}
+        for i in range(1, insumos + 1) for d in range(dias, 0, -30)
+    ])
+
+    recetas = {}
+    for p in range(1, productos + 1):
+        recetas[p] = [(i, round(azar.uniform(0.05, 2), 3)) for i in azar.sample(range(1, insumos + 1), azar.randint(4, 12))]
+    base.poblar('productos', [
+        {'id': p, 'nombre': f"Producto {p:03d}", 'descripcion': "", 'precio_venta': round(azar.uniform(20, 120), 2), 'receta_version': 1}
+        for p in range(1, productos + 1)
+    ])
+    base.poblar('receta_insumos', [
+        {'producto_id': p, 'insumo_id': i, 'cantidad': c, 'unidad_medida': "kg"} for p, lineas in recetas.items() for i, c in lineas
+    ])
+    base.poblar('receta_costos_adicionales', [
+        {'producto_id': p, 'concepto': "Mano de obra", 'costo': 5.0} for p in range(1, productos + 1)
+    ])
+    base.poblar('receta_versiones', [{
+        'producto_id': p, 'version': 1, 'vigente_desde': str(hoy - timedelta(days=dias + 1)) + "T00:00:00+00:00",
+        'insumo_ids': [i for i, _ in lineas], 'cantidades': [c for _, c in lineas], 'unidades': ["kg"] * len(lineas),
+        'conceptos': ["Mano de obra"], 'costos': [5.0]
+    } for p, lineas in recetas.items()])
+
+    # Historial: algunas compras y producciones por día y sucursal
+    for d in range(dias, 0, -1):
+        fecha = str(hoy - timedelta(days=d))
+        for s in range(1, sucursales + 1):
+            for _ in range(2):
+                proveedor = azar.randint(1, proveedores)
+                lineas = [(i, round(azar.uniform(1, 20), 2)) for i in azar.sample(range(1, insumos + 1), 5)]
+                compra = base._insertar('compras', {
+                    'fecha': fecha, 'proveedor': f"Proveedor {proveedor}", 'proveedor_id': proveedor, 'tipo': "Regular",
+                    'observaciones': "", 'total': sum(c * precios[i] for i, c in lineas), 'sucursal_id': s
+                }, avisar=False)
+                for i, c in lineas:
+                    base._insertar('compra_detalles', {
+                        'compra_id': compra['id'], 'insumo_id': i, 'cantidad': c, 'precio_unitario': precios[i],
+                        'subtotal': round(c * precios[i], 2), 'sucursal_id': s
+                    }, avisar=False)
+            for _ in range(5):
+                producto_id = azar.randint(1, productos)
+                cantidad = azar.randint(1, 20)
+                produccion = base._insertar('produccion', {
+                    'producto_id': producto_id, 'fecha': fecha, 'cantidad': cantidad, 'costo_total': 0.0,
+                    'observaciones': "", 'sucursal_id': s
+                }, avisar=False)
+                consumo = base._insertar('consumos', {
+                    'fecha': fecha, 'produccion_id': produccion['id'], 'observaciones': "", 'sucursal_id': s
+                }, avisar=False)
+                for i, c in recetas[producto_id]:
+                    base._insertar('consumo_detalles', {
+                        'consumo_id': consumo['id'], 'insumo_id': i, 'cantidad': c * cantidad * azar.uniform(1, 1.08),
+                        'sucursal_id': s
+                    }, avisar=False)
+
+
+# Función para atribuir las escrituras de la cola a la acción que las encoló: encolar corre en la sesión
+# y guarda la acción por clave; el manejador corre en el hilo de la cola con esa acción como la del hilo
+def atribuir_cola():
+    import cola_escritura
+
+    acciones = {}
+    encolar = cola_escritura.ColaEscritura.encolar
+
+    def encolar_con_accion(cola, tipo, datos):
+        clave = encolar(cola, tipo, datos)
+        acciones[clave] = _accion_actual()
+        return clave
+
+    def con_accion(manejador):
+        def enviar(sb, clave, datos):
+            _accion_hilo.accion = acciones.get(clave)
+            try:
+                return manejador(sb, clave, datos)
+            finally:
+                _accion_hilo.accion = None
+        return enviar
+
+    return [
+        mock.patch.object(cola_escritura.ColaEscritura, 'encolar', encolar_con_accion),
+        mock.patch.dict(cola_escritura.MANEJADORES, {tipo: con_accion(f) for tipo, f in cola_escritura.MANEJADORES.items()}),
+    ]
+
+
+# Función para que varias AppTest puedan correr en hilos a la vez. AppTest.run deja estado global por
+# ejecución: asigna y luego borra Runtime._instance (las demás sesiones fallan con "Runtime hasn't been
+# created!"), reemplaza st.secrets y config.get_option, y compila main.py en cada rerun (compilar desde
+# varios hilos a la vez falla en CPython con "AST constructor recursion depth mismatch"). Se fija un
+# runtime, secretos y configuración comunes para todo el proceso, como en el servidor, y main.py se
+# compila una sola vez bajo un candado
+def aislar_apptest():
+    import streamlit as st
+    from streamlit.components.v2.component_manager import BidiComponentManager
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.dataframe_source_manager import DataframeSourceManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.runtime.secrets import Secrets
+    from streamlit.testing.v1 import app_test
+    from streamlit.testing.v1.util import patch_config_options
+
+    runtime = mock.MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.dataframe_source_mgr = DataframeSourceManager()
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    runtime.bidi_component_registry = BidiComponentManager()
+    runtime.bidi_component_registry.discover_and_register_components(start_file_watching=False)
+
+    secretos = Secrets()
+    secretos._secrets = {'supabase': {'SUPABASE_URL': "http://localhost", 'SUPABASE_KEY': "local"}}
+
+    compilados = {}
+    candado = threading.Lock()
+    obtener_bytecode = ScriptCache.get_bytecode
+
+    def bytecode_compartido(cache, ruta):
+        with candado:
+            if ruta not in compilados:
+                compilados[ruta] = obtener_bytecode(cache, ruta)
+            return compilados[ruta]
+
+    return [
+        mock.patch.object(Runtime, '_instance', runtime),
+        # AppTest asigna su runtime de cada ejecución sobre esta clase, no sobre la real
+        mock.patch.object(app_test, 'Runtime', type('RuntimeDeCadaEjecucion', (), {'_instance': None})),
+        mock.patch.object(st, 'secrets', secretos),
+        patch_config_options({'global.appTest': True}),
+        mock.patch.object(app_test, 'patch_config_options', lambda opciones: contextlib.nullcontext()),
+        mock.patch.object(ScriptCache, 'get_bytecode', bytecode_compartido),
+    ]
+
+
+def _por_etiqueta(widgets, etiqueta):
+    for widget in widgets:
+        if widget.label == etiqueta:
+            return widget
+    raise LookupError(f"No se encontró el control '{etiqueta}'")
+
+
+# Sesión simulada (una tablet): recorre flujos de main.py y mide cada rerun
+class Sesion:
+    _ids_accion = itertools.count(1)
+
+    def __init__(self, base, semilla, tiempo_maximo=120):
+        from streamlit.testing.v1 import AppTest
+
+        self._base = base
+        self._azar = random.Random(semilla)
+        # Los secretos los fija aislar_apptest para todas las sesiones
+        self.app = AppTest.from_file(RUTA_APP, default_timeout=tiempo_maximo)
+        self.mediciones = []
+
+    # Función para ejecutar un rerun y registrar (tipo, segundos, llamadas de la sesión, error)
+    def _rerun(self, tipo, preparar=None):
+        accion = next(self._ids_accion)
+        self.app.session_state[CLAVE_ACCION] = accion
+        error = None
+        inicio = time.perf_counter()
+        try:
+            if preparar is not None:
+                preparar(self.app)
+            self.app.run()
+            if len(self.app.exception):
+                error = self.app.exception[0].message
+        except Exception as e:
+            error = str(e)
+        duracion = time.perf_counter() - inicio
+        self.mediciones.append((tipo, duracion, self._base.llamadas_de(accion), error))
+        return error is None
+
+    def iniciar(self):
+        return self._rerun('inicio')
+
+    # Función para elegir al azar una opción de un selectbox con format_func
+    # AppTest muestra las etiquetas en options, pero el valor del control es el id: se elige por id
+    # (select_index asignaría la etiqueta como valor y el siguiente rerun fallaría)
+    def _elegir_id(self, selector, tabla):
+        ids = self._base.ids_por_nombre(tabla)
+        selector.set_value(ids[self._azar.choice(selector.options)])
+
+    def _navegar(self, pagina):
+        return self._rerun('navegar', lambda app: _por_etiqueta(app.radio, "Menú Principal").set_value(pagina))
+
+    # Los flujos devuelven False si alguno de sus reruns falló
+    # Compra: elegir insumos, agregarlos como líneas y guardar
+    def compra(self):
+        if not self._navegar("Compras"):
+            return False
+        for _ in range(self._azar.randint(1, 4)):
+            if not self._rerun('compra_elegir_insumo', lambda app: self._elegir_id(app.selectbox(key="insumo_id"), 'insumos')):
+                return False
+
+            def agregar(app):
+                _por_etiqueta(app.number_input, "Cantidad:").set_value(round(self._azar.uniform(1, 10), 2))
+                _por_etiqueta(app.button, "Agregar a la Compra").click()
+            if not self._rerun('compra_agregar_linea', agregar):
+                return False
+        return self._rerun('compra_guardar', lambda app: _por_etiqueta(app.button, "Guardar Compra").click())
+
+    # Producción: elegir producto y cantidad y registrar
+    def produccion(self):
+        if not self._navegar("Consumos"):
+            return False
+
+        def registrar(app):
+            self._elegir_id(_por_etiqueta(app.selectbox, "Producto a Elaborar:"), 'productos')
+            _por_etiqueta(app.number_input, "Cantidad a Producir:").set_value(self._azar.randint(1, 10))
+            _por_etiqueta(app.button, "Registrar Producción").click()
+        return self._rerun('produccion_registrar', registrar)
+
+    def reporte(self):
+        if not self._navegar("Reportes"):
+            return False
+        nombre = self._azar.choice(REPORTES)
+        return self._rerun('reporte_abrir', lambda app: _por_etiqueta(app.selectbox, "Tipo de Reporte:").set_value(nombre))
+
+    def flujo_al_azar(self):
+        flujo = self._azar.choices(list(PESOS_FLUJOS), weights=list(PESOS_FLUJOS.values()))[0]
+        return getattr(self, flujo)()
+
+
+def _percentil(valores, porcentaje):
+    if len(valores) == 1:
+        return valores[0]
+    return statistics.quantiles(valores, n=100, method='inclusive')[porcentaje - 1]
+
+
+# Función para correr un nivel de concurrencia durante `duracion` segundos
+# Devuelve (mediciones de todas las sesiones, segundos transcurridos, llamadas de la base en el nivel,
+# sesiones detenidas por fallos seguidos)
+def correr_nivel(base, sesiones, duracion, semilla):
+    listas = [Sesion(base, semilla * 1000 + n) for n in range(sesiones)]
+    detenidas = []
+
+    # Primera ejecución de cada sesión, una a la vez y fuera de la medición (inicio de session_state)
+    activas = []
+    for sesion in listas:
+        if sesion.iniciar():
+            activas.append(sesion)
+        else:
+            detenidas.append(sesion)
+        sesion.mediciones.clear()
+    llamadas_antes = Counter(base.llamadas)
+    limite = time.time() + duracion
+    inicio = time.perf_counter()
+
+    def trabajar(sesion):
+        fallos = 0
+        while time.time() < limite:
+            if sesion.flujo_al_azar():
+                fallos = 0
+                continue
+            fallos += 1
+            if fallos >= MAX_FALLOS_SEGUIDOS:
+                detenidas.append(sesion)
+                return
+            time.sleep(min(ESPERA_TRAS_FALLO * 2 ** (fallos - 1), ESPERA_MAXIMA_TRAS_FALLO))
+
+    hilos = [threading.Thread(target=trabajar, args=(sesion,), name=f"sesion-{n}") for n, sesion in enumerate(activas)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    transcurrido = time.perf_counter() - inicio
+    llamadas = Counter(base.llamadas)
+    llamadas.subtract(llamadas_antes)
+    return [medicion for sesion in listas for medicion in sesion.mediciones], transcurrido, llamadas, len(detenidas)
+
+
+# Las latencias se calculan solo con los reruns sin error; los fallidos se informan como tasa de error
+def imprimir_nivel(sesiones, mediciones, transcurrido, llamadas, detenidas=0):
+    acciones = [m for m in mediciones if m[0] not in ('inicio', 'navegar')]
+    errores = [m for m in mediciones if m[3] is not None]
+    tasa = len(errores) / len(mediciones) * 100 if mediciones else 0.0
+    fondo = sum(cantidad for (origen, _), cantidad in llamadas.items() if origen == 'fondo')
+    print(f"\n=== {sesiones} sesión(es) · {transcurrido:.1f} s ===")
+    print(f"Reruns: {len(mediciones)} ({len(mediciones) / transcurrido:.2f}/s) · "
+          f"Acciones: {len(acciones)} ({len(acciones) / transcurrido:.2f}/s) · "
+          f"Errores: {len(errores)} ({tasa:.1f}%) · Sesiones detenidas por fallos: {detenidas}")
+    print(f"Llamadas a la base en segundo plano: {fondo} ({fondo / transcurrido:.1f}/s)")
+    print(f"{'Tipo':<24}{'n':>6}{'error %':>9}{'p50 (s)':>10}{'p95 (s)':>10}{'máx (s)':>10}{'llamadas/rerun':>16}")
+    por_tipo = defaultdict(list)
+    for medicion in mediciones:
+        por_tipo[medicion[0]].append(medicion)
+    for tipo, lista in sorted(por_tipo.items()):
+        correctos = [m for m in lista if m[3] is None]
+        error = (len(lista) - len(correctos)) / len(lista) * 100
+        if not correctos:
+            print(f"{tipo:<24}{len(lista):>6}{error:>9.1f}{'-':>10}{'-':>10}{'-':>10}{'-':>16}")
+            continue
+        duraciones = [m[1] for m in correctos]
+        print(
+            f"{tipo:<24}{len(lista):>6}{error:>9.1f}{_percentil(duraciones, 50):>10.3f}{_percentil(duraciones, 95):>10.3f}"
+            f"{max(duraciones):>10.3f}{statistics.mean(m[2] for m in correctos):>16.1f}"
+        )
+    for tipo, _, _, error in errores[:5]:
+        print(f"  Error en {tipo}: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de main.py con sesiones concurrentes simuladas")
+    parser.add_argument('--sesiones', type=int, nargs='+', default=[1, 5, 10, 20, 30], help="Niveles de concurrencia")
+    parser.add_argument('--duracion', type=float, default=60, help="Segundos por nivel")
+    parser.add_argument('--latencia', type=float, default=0.05, help="Segundos agregados a cada llamada a la base")
+    parser.add_argument('--insumos', type=int, default=300)
+    parser.add_argument('--productos', type=int, default=40)
+    parser.add_argument('--sucursales', type=int, default=2)
+    parser.add_argument('--dias', type=int, default=365, help="Días de historial de movimientos")
+    parser.add_argument('--semilla', type=int, default=1)
+    args = parser.parse_args()
+
+    # Caché en disco y cola de escrituras en un directorio temporal, antes de importar la aplicación
+    directorio = tempfile.mkdtemp(prefix="dpandos_carga_")
+    os.environ['DPANDOS_CACHE_DIR'] = os.path.join(directorio, "cache")
+    os.environ['DPANDOS_COLA_DB'] = os.path.join(directorio, "cola.sqlite3")
+
+    base = BaseLocal(latencia=args.latencia, semilla=args.semilla)
+    poblar_datos(base, args.insumos, args.productos, sucursales=args.sucursales, dias=args.dias, semilla=args.semilla)
+
+    with contextlib.ExitStack() as parches:
+        parches.enter_context(mock.patch('supabase.create_client', return_value=base))
+        for parche in aislar_apptest() + atribuir_cola():
+            parches.enter_context(parche)
+        # Calentamiento: carga inicial de la instantánea, índices y precálculos (no se mide)
+        sesion = Sesion(base, args.semilla)
+        sesion.iniciar()
+        for flujo in PESOS_FLUJOS:
+            getattr(sesion, flujo)()
+
+        for sesiones in args.sesiones:
+            mediciones, transcurrido, llamadas, detenidas = correr_nivel(base, sesiones, args.duracion, args.semilla)
+            imprimir_nivel(sesiones, mediciones, transcurrido, llamadas, detenidas)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import pandas as pd
+from postgrest.exceptions import APIError
+
+from datos import leer_paginado
+
+# Campos comparados en cada tipo de línea de receta
+CAMPOS_INSUMOS = ['insumo_id', 'cantidad', 'unidad_medida']
+CAMPOS_COSTOS = ['concepto', 'costo']
+
+# Código de error de guardar_receta cuando la versión ya no es la vigente (PostgREST responde 409)
+CODIGO_CONFLICTO = 'PT409'
+
+
+class ConflictoReceta(Exception):
+    pass
+
+
+def _nativo(valor):
+    # Convierte escalares de numpy/pandas a tipos de Python serializables a JSON
+    return valor.item() if hasattr(valor, 'item') else valor
+
+
+def _sin_id(valor):
+    return valor is None or (isinstance(valor, float) and pd.isna(valor))
+
+
+# Función para comparar las líneas editadas con las guardadas
+# Devuelve (modificadas, nuevas, eliminadas): filas a actualizar con su id, filas a insertar e ids a borrar
+def diferenciar_lineas(actuales, editadas, campos):
+    guardadas = {_nativo(fila['id']): fila for fila in actuales.to_dict('records')} if not actuales.empty else {}
+
+    modificadas, nuevas, conservadas = [], [], set()
+    for linea in editadas:
+        valores = {campo: _nativo(linea[campo]) for campo in campos}
+        linea_id = None if _sin_id(linea.get('id')) else _nativo(linea['id'])
+        actual = guardadas.get(linea_id)
+
+        if actual is None:
+            nuevas.append(valores)
+        else:
+            conservadas.add(linea_id)
+            if any(actual[campo] != valores[campo] for campo in campos):
+                modificadas.append(dict(valores, id=linea_id))
+
+    eliminadas = [linea_id for linea_id in guardadas if linea_id not in conservadas]
+    return modificadas, nuevas, eliminadas
+
+
+def _diferencias(modificadas, nuevas, eliminadas):
+    return {'modificadas': modificadas, 'nuevas': nuevas, 'eliminadas': eliminadas}
+
+
+# Función para guardar una receta editada escribiendo solo las líneas que cambiaron
+# Las líneas, el incremento de receta_version y el historial se escriben en una sola transacción (RPC guardar_receta)
+# Usa receta_version como control de concurrencia optimista: si otro usuario guardó antes, lanza ConflictoReceta
+# Devuelve la nueva versión de la receta
+def guardar_receta(sb, producto_id, version, datos_producto, insumos_editados, costos_editados):
+    insumos_actuales = pd.DataFrame(sb.table('receta_insumos').select('*').eq('producto_id', producto_id).execute().data)
+    costos_actuales = pd.DataFrame(sb.table('receta_costos_adicionales').select('*').eq('producto_id', producto_id).execute().data)
+
+    cambios_insumos = diferenciar_lineas(insumos_actuales, insumos_editados, CAMPOS_INSUMOS)
+    cambios_costos = diferenciar_lineas(costos_actuales, costos_editados, CAMPOS_COSTOS)
+    registro = None
+    if any(cambios_insumos) or any(cambios_costos):
+        registro = registro_version(producto_id, version + 1, insumos_editados, costos_editados)
+        del registro['producto_id'], registro['version']
+
+    try:
+        return sb.rpc('guardar_receta', {
+            'producto_id': _nativo(producto_id),
+            'version': _nativo(version),
+            'producto': {campo: _nativo(valor) for campo, valor in datos_producto.items()},
+            'insumos': _diferencias(*cambios_insumos),
+            'costos': _diferencias(*cambios_costos),
+            'registro': registro,
+        }).execute().data
+    except APIError as e:
+        if e.code == CODIGO_CONFLICTO:
+            raise ConflictoReceta("La receta fue modificada por otro usuario. Recargue la receta e intente nuevamente.") from e
+        raise
+
+
+# Función para armar una fila del historial de recetas (receta_versiones)
+# Las líneas se guardan en arreglos paralelos; vigente_desde lo asigna el servidor al insertar
+def registro_version(producto_id, version, insumos, costos):
+    return {
+        'producto_id': _nativo(producto_id),
+        'version': _nativo(version),
+        'insumo_ids': [_nativo(linea['insumo_id']) for linea in insumos],
+        'cantidades': [float(linea['cantidad']) for linea in insumos],
+        'unidades': [linea['unidad_medida'] for linea in insumos],
+        'conceptos': [costo['concepto'] for costo in costos],
+        'costos': [float(costo['costo']) for costo in costos],
+    }
+
+
+# Función para crear un producto con su receta: el producto, las líneas, los costos adicionales y la primera
+# versión del historial se escriben en una sola transacción (RPC crear_receta)
+# Devuelve el id del producto creado
+def crear_receta(sb, datos_producto, insumos, costos):
+    return sb.rpc('crear_receta', {
+        'producto': {campo: _nativo(valor) for campo, valor in datos_producto.items()},
+        'insumos': [{campo: _nativo(linea[campo]) for campo in CAMPOS_INSUMOS} for linea in insumos],
+        'costos': [{campo: _nativo(costo[campo]) for campo in CAMPOS_COSTOS} for costo in costos],
+    }).execute().data
+
+
+# Función para cargar las líneas de todas las recetas (insumos y costos adicionales), para cálculos por lote
+# Devuelve (receta_insumos, receta_costos_adicionales)
+def cargar_lineas(sb):
+    tablas = []
+    for tabla in ['receta_insumos', 'receta_costos_adicionales']:
+        paginas = list(leer_paginado(sb, tabla))
+        tablas.append(pd.concat(paginas, ignore_index=True) if paginas else pd.DataFrame())
+    return tablas[0], tablas[1]
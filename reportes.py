@@ -0,0 +1,61 @@
+import pandas as pd
+from postgrest.exceptions import APIError
+
+from datos import leer_paginado
+
+# Periodos de agrupación disponibles (etiqueta -> periodo de date_trunc)
+PERIODOS = {'Día': 'day', 'Semana': 'week', 'Mes': 'month'}
+
+_FRECUENCIAS = {'day': 'D', 'week': 'W-SUN', 'month': 'M'}
+
+COLUMNAS_RESUMEN = ['inicio_periodo', 'producto_id', 'unidades', 'costo', 'ingreso']
+
+# Códigos de error cuando la función produccion_resumen no existe (PostgREST y PostgreSQL)
+CODIGOS_FUNCION_INEXISTENTE = {'PGRST202', '42883'}
+
+
+# Función para agrupar la producción localmente cuando el servidor no tiene la función produccion_resumen
+def _resumen_produccion_local(sb, fecha_inicio, fecha_fin, periodo, productos, sucursal):
+    filtros = [('gte', 'fecha', str(fecha_inicio)), ('lte', 'fecha', str(fecha_fin))]
+    if sucursal is not None:
+        filtros.append(('eq', 'sucursal_id', sucursal))
+    paginas = list(leer_paginado(sb, 'produccion', 'id,fecha,producto_id,cantidad,costo_total', filtros))
+    if not paginas:
+        return pd.DataFrame(columns=COLUMNAS_RESUMEN)
+
+    produccion = pd.concat(paginas, ignore_index=True)
+    fechas = pd.to_datetime(produccion['fecha'])
+    produccion['inicio_periodo'] = fechas.dt.to_period(_FRECUENCIAS[periodo]).dt.start_time.dt.date
+    precios = productos.set_index('id')['precio_venta']
+    produccion['ingreso'] = produccion['cantidad'] * produccion['producto_id'].map(precios).fillna(0.0)
+
+    return produccion.groupby(['inicio_periodo', 'producto_id'], as_index=False).agg(
+        unidades=('cantidad', 'sum'),
+        costo=('costo_total', 'sum'),
+        ingreso=('ingreso', 'sum'),
+    )[COLUMNAS_RESUMEN]
+
+
+# Función para obtener unidades, costo e ingreso teórico por periodo y producto
+# Con sucursal=None se consolidan todas las sucursales
+def produccion_por_periodo(sb, fecha_inicio, fecha_fin, periodo, productos, sucursal=None):
+    if periodo not in _FRECUENCIAS:
+        raise ValueError(f"Periodo desconocido: {periodo}")
+
+    try:
+        response = sb.rpc('produccion_resumen', {
+            'fecha_inicio': str(fecha_inicio),
+            'fecha_fin': str(fecha_fin),
+            'periodo': periodo,
+            'sucursal': sucursal,
+        }).execute()
+    except APIError as e:
+        # Solo sin la función en el servidor se usa el resumen local; otros errores (autenticación,
+        # tiempo de espera, argumentos inválidos) se propagan
+        if e.code not in CODIGOS_FUNCION_INEXISTENTE:
+            raise
+        return _resumen_produccion_local(sb, fecha_inicio, fecha_fin, periodo, productos, sucursal)
+
+    resumen = pd.DataFrame(response.data, columns=COLUMNAS_RESUMEN)
+    resumen['inicio_periodo'] = pd.to_datetime(resumen['inicio_periodo']).dt.date
+    return resumen
@@ -0,0 +1,272 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+import cache_disco
+import variacion
+from conexion import crear_cliente
+from costos import IndiceCostoHistorico, costo_recetas
+from instantanea import Instantanea
+from recetas import cargar_lineas
+from stock import factibilidad
+from sucursales import insumos_con_stock
+
+# Dirección del servicio; por defecto solo acepta conexiones locales
+HOST = os.getenv("DPANDOS_API_HOST", "127.0.0.1")
+PUERTO = int(os.getenv("DPANDOS_API_PUERTO", "8502"))
+
+# Si se define, cada solicitud debe enviar el encabezado "Authorization: Bearer <token>"
+TOKEN = os.getenv("DPANDOS_API_TOKEN")
+
+# Tamaño máximo del cuerpo de una solicitud
+TAMANO_MAXIMO = 5 * 1024 * 1024
+
+TABLAS = ['insumos', 'productos', 'historico_precios', 'receta_versiones']
+
+# Segundos entre actualizaciones en segundo plano de los resúmenes diarios de consumo
+INTERVALO_VARIACION = 60
+
+
+class SolicitudInvalida(Exception):
+    pass
+
+
+def _registros(df):
+    # Filas como diccionarios con tipos nativos (numpy no es serializable a JSON)
+    return json.loads(df.to_json(orient='records', date_format='iso'))
+
+
+def _fecha(valor, campo):
+    try:
+        fecha = pd.Timestamp(valor)
+    except (TypeError, ValueError):
+        fecha = pd.NaT
+    if pd.isna(fecha):
+        raise SolicitudInvalida(f"'{campo}' debe ser una fecha en formato AAAA-MM-DD")
+    return fecha
+
+
+def _ids(valores, campo):
+    if not isinstance(valores, list) or not valores:
+        raise SolicitudInvalida(f"'{campo}' debe ser una lista no vacía de ids")
+    try:
+        return [int(valor) for valor in valores]
+    except (TypeError, ValueError):
+        raise SolicitudInvalida(f"'{campo}' debe contener solo ids numéricos")
+
+
+# Sucursal opcional de una solicitud; sin sucursal se usan los totales de todas las sucursales
+def _sucursal(solicitud):
+    if solicitud.get('sucursal') is None:
+        return None
+    return _ids([solicitud['sucursal']], 'sucursal')[0]
+
+
+# Cálculos de costos, stock y reportes sin Streamlit, sobre los mismos datos compartidos que la aplicación
+# Las líneas de receta se recargan solo cuando cambia la tabla productos (cada cambio de receta incrementa receta_version)
+# Los resúmenes diarios de consumo parten del archivo que guarda la aplicación, se actualizan en segundo plano
+# y no se guardan: ese archivo lo escribe solo la aplicación
+class Servicio:
+    def __init__(self, sb):
+        self._sb = sb
+        self.instantanea = Instantanea(sb, TABLAS)
+        self._candado = threading.Lock()
+        self._recetas = None
+        self._indice = None
+        self._stock = {}
+        self._variaciones = {}
+        self._hilo = None
+
+    def iniciar(self):
+        self.instantanea.iniciar()
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._ciclo_variacion, name="variacion", daemon=True)
+            self._hilo.start()
+
+    def _actualizar_variacion(self, variacion_diaria):
+        variacion_diaria.actualizar(self._sb, self.instantanea.tabla('receta_versiones', copiar=False))
+
+    def _ciclo_variacion(self):
+        while True:
+            time.sleep(INTERVALO_VARIACION)
+            with self._candado:
+                variaciones = list(self._variaciones.values())
+            for variacion_diaria in variaciones:
+                try:
+                    self._actualizar_variacion(variacion_diaria)
+                except Exception:
+                    # Sin conexión: se reintenta en el siguiente ciclo y las consultas usan el último resumen
+                    pass
+
+    # Insumos con el stock total o, si se indica sucursal, con el stock de esa sucursal
+    def _insumos(self, sucursal):
+        insumos = self.instantanea.tabla('insumos', copiar=False)
+        if sucursal is None:
+            return insumos
+        with self._candado:
+            if sucursal not in self._stock:
+                self._stock[sucursal] = Instantanea(
+                    self._sb, ['stock_sucursal'], cargar=lambda sb, tabla: cache_disco.cargar_tabla(sb, tabla, sucursal)
+                )
+                self._stock[sucursal].iniciar()
+            stock = self._stock[sucursal]
+        return insumos_con_stock(insumos, stock.tabla('stock_sucursal', copiar=False))
+
+    # Resumen diario de una sucursal (o de todas); la primera consulta lo carga y lo pone al día,
+    # las siguientes leen el último resumen actualizado en segundo plano
+    def _variacion(self, sucursal):
+        with self._candado:
+            variacion_diaria = self._variaciones.get(sucursal)
+        if variacion_diaria is None:
+            variacion_diaria = variacion.cargar(sucursal, persistir=False)
+            self._actualizar_variacion(variacion_diaria)
+            with self._candado:
+                variacion_diaria = self._variaciones.setdefault(sucursal, variacion_diaria)
+        return variacion_diaria
+
+    def _lineas_receta(self):
+        version = self.instantanea.version('productos')
+        with self._candado:
+            if self._recetas is None or self._recetas[0] != version:
+                self._recetas = (version,) + cargar_lineas(self._sb)
+            return self._recetas[1], self._recetas[2]
+
+    def _indice_costos(self):
+        versiones = (self.instantanea.version('receta_versiones'), self.instantanea.version('historico_precios'))
+        with self._candado:
+            if self._indice is None or self._indice[0] != versiones:
+                self._indice = (versiones, IndiceCostoHistorico(
+                    self.instantanea.tabla('receta_versiones', copiar=False),
+                    self.instantanea.tabla('historico_precios', copiar=False)
+                ))
+            return self._indice[1]
+
+    # Costo unitario de varios productos: con precios actuales o, si se indica fecha, con la receta y precios de esa fecha
+    def costos(self, solicitud):
+        producto_ids = _ids(solicitud.get('productos'), 'productos')
+        fecha = solicitud.get('fecha')
+
+        if fecha:
+            fecha = _fecha(fecha, 'fecha').date().isoformat()
+            indice = self._indice_costos()
+            resultado = []
+            for producto_id in producto_ids:
+                costo_total, _, sin_precio = indice.costo(producto_id, fecha)
+                # Un costo sin el precio de algún insumo no es un costo: se informa qué insumos faltan
+                resultado.append({
+                    'producto_id': producto_id,
+                    'costo_total': None if sin_precio else costo_total,
+                    'insumos_sin_precio': sin_precio,
+                })
+            return {'fecha': fecha, 'costos': resultado}
+
+        receta_insumos, costos_adicionales = self._lineas_receta()
+        costos = costo_recetas(producto_ids, receta_insumos, self.instantanea.tabla('insumos', copiar=False), costos_adicionales)
+        return {'costos': _registros(costos)}
+
+    # Verificación de un plan de producción contra el stock actual (total o de una sucursal)
+    def factibilidad(self, solicitud):
+        plan = solicitud.get('plan')
+        if not isinstance(plan, list) or not plan:
+            raise SolicitudInvalida("'plan' debe ser una lista no vacía de {producto_id, cantidad}")
+        try:
+            plan = pd.DataFrame([
+                {'producto_id': int(fila['producto_id']), 'cantidad': float(fila['cantidad'])} for fila in plan
+            ])
+        except (KeyError, TypeError, ValueError):
+            raise SolicitudInvalida("Cada elemento de 'plan' debe tener producto_id y cantidad numéricos")
+
+        receta_insumos, _ = self._lineas_receta()
+        factible, requerimientos = factibilidad(plan, receta_insumos, self._insumos(_sucursal(solicitud)))
+        return {'factible': factible, 'insumos': _registros(requerimientos)}
+
+    # Consumo teórico, real y compras por insumo en un rango de fechas (desde el resumen diario)
+    # Con sucursal solo se consideran los movimientos de esa sucursal
+    def consumo(self, solicitud):
+        fecha_inicio = _fecha(solicitud.get('fecha_inicio'), 'fecha_inicio')
+        fecha_fin = _fecha(solicitud.get('fecha_fin'), 'fecha_fin')
+
+        variacion_diaria = self._variacion(_sucursal(solicitud))
+        insumos = self.instantanea.tabla('insumos', copiar=False)
+        resumen = variacion_diaria.periodo(fecha_inicio, fecha_fin, dict(zip(insumos['id'], insumos['precio_actual'])))
+        if solicitud.get('insumos'):
+            resumen = resumen[resumen['insumo_id'].isin(_ids(solicitud['insumos'], 'insumos'))]
+        return {'insumos': _registros(resumen)}
+
+
+# Rutas POST del servicio: cada una recibe y devuelve un objeto JSON
+RUTAS = {
+    '/costos': Servicio.costos,
+    '/factibilidad': Servicio.factibilidad,
+    '/consumo': Servicio.consumo,
+}
+
+
+class Manejador(BaseHTTPRequestHandler):
+    servicio = None
+
+    def _responder(self, codigo, cuerpo):
+        datos = json.dumps(cuerpo, ensure_ascii=False).encode('utf-8')
+        self.send_response(codigo)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _autorizado(self):
+        return TOKEN is None or self.headers.get('Authorization') == f"Bearer {TOKEN}"
+
+    def do_GET(self):
+        if self.path == '/salud':
+            self._responder(200, {'estado': 'ok'})
+        else:
+            self._responder(404, {'error': 'Ruta no encontrada'})
+
+    def do_POST(self):
+        if not self._autorizado():
+            self._responder(401, {'error': 'No autorizado'})
+            return
+        if self.path not in RUTAS:
+            self._responder(404, {'error': 'Ruta no encontrada'})
+            return
+
+        try:
+            try:
+                longitud = int(self.headers.get('Content-Length') or 0)
+            except ValueError:
+                longitud = -1
+            if longitud < 0:
+                raise SolicitudInvalida("Encabezado Content-Length inválido")
+            if longitud > TAMANO_MAXIMO:
+                self._responder(413, {'error': 'Solicitud demasiado grande'})
+                return
+            solicitud = json.loads(self.rfile.read(longitud) or b'{}')
+            if not isinstance(solicitud, dict):
+                raise SolicitudInvalida("El cuerpo debe ser un objeto JSON")
+            self._responder(200, RUTAS[self.path](self.servicio, solicitud))
+        except (SolicitudInvalida, json.JSONDecodeError) as e:
+            self._responder(400, {'error': str(e)})
+        except Exception as e:
+            self._responder(500, {'error': str(e)})
+
+    def log_message(self, formato, *args):
+        # Sin registro por solicitud: el servicio puede recibir muchas llamadas por segundo
+        pass
+
+
+# Función para iniciar el servicio (bloquea hasta que se detenga el proceso)
+def servir(sb=None, host=HOST, puerto=PUERTO):
+    servicio = Servicio(sb or crear_cliente())
+    servicio.iniciar()
+    Manejador.servicio = servicio
+    servidor = ThreadingHTTPServer((host, puerto), Manejador)
+    print(f"Servicio API escuchando en http://{host}:{puerto}")
+    servidor.serve_forever()
+
+
+if __name__ == '__main__':
+    servir()
@@ -0,0 +1,3 @@
+-- Restricciones únicas usadas por los upserts de la importación masiva (on_conflict = 'nombre')
+alter table insumos add constraint insumos_nombre_key unique (nombre);
+alter table productos add constraint productos_nombre_key unique (nombre);
@@ -0,0 +1,17 @@
+-- Costos congelados por producción: el desglose de insumos se guarda en arreglos paralelos
+-- (insumo_ids[i], cantidades[i] por unidad, precios[i]) con una sola fila por producción
+create table if not exists produccion_costos (
+    produccion_id bigint primary key references produccion(id) on delete cascade,
+    producto_id bigint not null references productos(id),
+    fecha date not null,
+    cantidad numeric not null,
+    precio_venta numeric not null,
+    insumo_ids bigint[] not null,
+    cantidades numeric[] not null,
+    precios numeric[] not null,
+    costo_adicional numeric not null default 0,
+    costo_unitario numeric not null,
+    created_at timestamptz not null default now()
+);
+
+create index if not exists produccion_costos_fecha_idx on produccion_costos (fecha);
@@ -0,0 +1,20 @@
+-- Índice por fecha para las consultas de rango del reporte de Producción Histórica
+create index if not exists produccion_fecha_idx on produccion (fecha, producto_id);
+
+-- Resumen de producción por periodo ('day', 'week' o 'month') y producto, calculado en el servidor
+create or replace function produccion_resumen(fecha_inicio date, fecha_fin date, periodo text default 'day')
+returns table (inicio_periodo date, producto_id bigint, unidades numeric, costo numeric, ingreso numeric)
+language sql stable
+as $$
+    select
+        date_trunc(periodo, p.fecha)::date,
+        p.producto_id,
+        sum(p.cantidad),
+        sum(p.costo_total),
+        sum(p.cantidad * pr.precio_venta)
+    from produccion p
+    join productos pr on pr.id = p.producto_id
+    where p.fecha between fecha_inicio and fecha_fin
+    group by 1, 2
+    order by 1, 2
+$$;
@@ -0,0 +1,30 @@
+-- Marca de última modificación usada por la caché en disco para revalidar de forma incremental
+create or replace function marcar_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.updated_at = now();
+    return new;
+end;
+$$;
+
+alter table insumos add column if not exists updated_at timestamptz not null default now();
+alter table categorias add column if not exists updated_at timestamptz not null default now();
+alter table productos add column if not exists updated_at timestamptz not null default now();
+
+create index if not exists insumos_updated_at_idx on insumos (updated_at);
+create index if not exists categorias_updated_at_idx on categorias (updated_at);
+create index if not exists productos_updated_at_idx on productos (updated_at);
+
+drop trigger if exists insumos_updated_at on insumos;
+create trigger insumos_updated_at before update on insumos
+    for each row execute function marcar_updated_at();
+
+drop trigger if exists categorias_updated_at on categorias;
+create trigger categorias_updated_at before update on categorias
+    for each row execute function marcar_updated_at();
+
+drop trigger if exists productos_updated_at on productos;
+create trigger productos_updated_at before update on productos
+    for each row execute function marcar_updated_at();
@@ -0,0 +1,3 @@
+-- Versión de la receta de cada producto: se incrementa al guardar cambios en sus líneas
+-- y se usa como control de concurrencia optimista y como clave de caché
+alter table productos add column if not exists receta_version integer not null default 1;
@@ -0,0 +1,29 @@
+-- Historial de recetas de solo inserción: una fila por versión con sus líneas en arreglos paralelos
+create table if not exists receta_versiones (
+    id bigint generated always as identity primary key,
+    producto_id bigint not null references productos(id) on delete cascade,
+    version integer not null,
+    vigente_desde timestamptz not null default now(),
+    insumo_ids bigint[] not null,
+    cantidades numeric[] not null,
+    unidades text[] not null,
+    conceptos text[] not null,
+    costos numeric[] not null,
+    unique (producto_id, version)
+);
+
+create index if not exists receta_versiones_vigencia_idx on receta_versiones (producto_id, vigente_desde);
+
+-- Versión inicial con la receta actual de cada producto, considerada vigente desde siempre
+insert into receta_versiones (producto_id, version, vigente_desde, insumo_ids, cantidades, unidades, conceptos, costos)
+select
+    p.id,
+    p.receta_version,
+    '1970-01-01'::timestamptz,
+    coalesce((select array_agg(ri.insumo_id order by ri.id) from receta_insumos ri where ri.producto_id = p.id), '{}'),
+    coalesce((select array_agg(ri.cantidad order by ri.id) from receta_insumos ri where ri.producto_id = p.id), '{}'),
+    coalesce((select array_agg(ri.unidad_medida order by ri.id) from receta_insumos ri where ri.producto_id = p.id), '{}'),
+    coalesce((select array_agg(rc.concepto order by rc.id) from receta_costos_adicionales rc where rc.producto_id = p.id), '{}'),
+    coalesce((select array_agg(rc.costo order by rc.id) from receta_costos_adicionales rc where rc.producto_id = p.id), '{}')
+from productos p
+on conflict (producto_id, version) do nothing;
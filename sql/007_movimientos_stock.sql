@@ -0,0 +1,135 @@
+-- Registro atómico de consumos: verifica y descuenta el stock de todos los insumos en una sola transacción.
+-- Estas funciones pasan a ser el único punto que descuenta stock por consumos y producción; un trigger que
+-- también lo haga al insertar esos movimientos descontaría dos veces, así que la migración falla si existe uno.
+-- Las compras siguen sumando stock como antes (por ejemplo con un trigger en compra_detalles) hasta que
+-- registrar_compra lo sume en el servidor (011), que vuelve a verificar incluyendo las tablas de compras.
+
+-- Lanza un error si algún trigger sobre las tablas indicadas ejecuta una función que modifica el stock
+-- (su código menciona stock_actual o stock_sucursal)
+create or replace function verificar_sin_triggers_de_stock(tablas text[])
+returns void
+language plpgsql
+as $$
+declare
+    v_triggers text;
+begin
+    select string_agg(format('%s en %s (función %s)', t.tgname, t.tgrelid::regclass, f.proname), ', ')
+    into v_triggers
+    from pg_trigger t
+    join pg_proc f on f.oid = t.tgfoid
+    where not t.tgisinternal
+      and t.tgrelid in (
+          select to_regclass(tabla)
+          from unnest(tablas) tabla
+          where to_regclass(tabla) is not null
+      )
+      and (f.prosrc ilike '%stock_actual%' or f.prosrc ilike '%stock_sucursal%');
+
+    if v_triggers is not null then
+        raise exception 'Triggers que modifican el stock: %. Elimínelos antes de migrar: el stock lo mueven solo las funciones de registro', v_triggers;
+    end if;
+end;
+$$;
+
+select verificar_sin_triggers_de_stock(array['consumos', 'consumo_detalles', 'produccion']);
+
+-- Bloquea los insumos en orden de id (evita interbloqueos entre sesiones), verifica y descuenta.
+-- detalles: [{"insumo_id": 1, "cantidad": 2.5}, ...]
+create or replace function descontar_stock(detalles jsonb)
+returns void
+language plpgsql
+as $$
+declare
+    v_faltante record;
+begin
+    perform 1
+    from insumos i
+    where i.id in (select (d->>'insumo_id')::bigint from jsonb_array_elements(detalles) d)
+    order by i.id
+    for update;
+
+    select i.nombre, i.stock_actual, m.cantidad
+    into v_faltante
+    from (
+        select (d->>'insumo_id')::bigint as insumo_id, sum((d->>'cantidad')::numeric) as cantidad
+        from jsonb_array_elements(detalles) d
+        group by 1
+    ) m
+    join insumos i on i.id = m.insumo_id
+    where i.stock_actual < m.cantidad
+    order by i.id
+    limit 1;
+
+    if found then
+        raise exception 'Stock insuficiente de %. Necesario: %, Disponible: %',
+            v_faltante.nombre, v_faltante.cantidad, v_faltante.stock_actual
+            using errcode = 'P0001';
+    end if;
+
+    update insumos i
+    set stock_actual = i.stock_actual - m.cantidad
+    from (
+        select (d->>'insumo_id')::bigint as insumo_id, sum((d->>'cantidad')::numeric) as cantidad
+        from jsonb_array_elements(detalles) d
+        group by 1
+    ) m
+    where i.id = m.insumo_id;
+end;
+$$;
+
+-- Consumo manual: devuelve el id del consumo creado
+create or replace function registrar_consumo(detalles jsonb, fecha date, observaciones text default '')
+returns bigint
+language plpgsql
+as $$
+declare
+    v_consumo_id bigint;
+begin
+    perform descontar_stock(detalles);
+
+    insert into consumos (fecha, produccion_id, observaciones)
+    values (registrar_consumo.fecha, null, registrar_consumo.observaciones)
+    returning id into v_consumo_id;
+
+    insert into consumo_detalles (consumo_id, insumo_id, cantidad)
+    select v_consumo_id, (d->>'insumo_id')::bigint, (d->>'cantidad')::numeric
+    from jsonb_array_elements(detalles) d;
+
+    return v_consumo_id;
+end;
+$$;
+
+-- Producción con su consumo de insumos: devuelve la fila de produccion creada
+create or replace function registrar_produccion(
+    producto_id bigint,
+    cantidad numeric,
+    costo_total numeric,
+    detalles jsonb,
+    fecha date,
+    observaciones text default ''
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_produccion produccion;
+    v_consumo_id bigint;
+begin
+    perform descontar_stock(detalles);
+
+    insert into produccion (producto_id, fecha, cantidad, costo_total, observaciones)
+    values (registrar_produccion.producto_id, registrar_produccion.fecha, registrar_produccion.cantidad,
+            registrar_produccion.costo_total, registrar_produccion.observaciones)
+    returning * into v_produccion;
+
+    insert into consumos (fecha, produccion_id, observaciones)
+    values (registrar_produccion.fecha, v_produccion.id, 'Consumo para producción #' || v_produccion.id)
+    returning id into v_consumo_id;
+
+    insert into consumo_detalles (consumo_id, insumo_id, cantidad)
+    select v_consumo_id, (d->>'insumo_id')::bigint, (d->>'cantidad')::numeric
+    from jsonb_array_elements(detalles) d;
+
+    return to_jsonb(v_produccion);
+end;
+$$;
@@ -0,0 +1,145 @@
+-- Claves de idempotencia de la cola local de escrituras: reenviar una operación no la duplica
+alter table compras add column if not exists clave_idempotencia text unique;
+alter table consumos add column if not exists clave_idempotencia text unique;
+alter table produccion add column if not exists clave_idempotencia text unique;
+alter table insumos add column if not exists clave_idempotencia text unique;
+
+-- Compra con sus detalles; devuelve el id de la compra
+-- El stock comprado lo sigue sumando el trigger existente de compra_detalles (ver 007) hasta 011
+create or replace function registrar_compra(clave text, compra jsonb, detalles jsonb)
+returns bigint
+language plpgsql
+as $$
+declare
+    v_compra_id bigint;
+begin
+    select id into v_compra_id from compras where clave_idempotencia = clave;
+    if found then
+        return v_compra_id;
+    end if;
+
+    insert into compras (fecha, proveedor, tipo, observaciones, total, clave_idempotencia)
+    values (
+        (compra->>'fecha')::date,
+        compra->>'proveedor',
+        compra->>'tipo',
+        coalesce(compra->>'observaciones', ''),
+        (compra->>'total')::numeric,
+        clave
+    )
+    returning id into v_compra_id;
+
+    insert into compra_detalles (compra_id, insumo_id, cantidad, precio_unitario, subtotal)
+    select v_compra_id, (d->>'insumo_id')::bigint, (d->>'cantidad')::numeric,
+           (d->>'precio_unitario')::numeric, (d->>'subtotal')::numeric
+    from jsonb_array_elements(detalles) d;
+
+    return v_compra_id;
+end;
+$$;
+
+-- Nuevo insumo con su primer precio histórico; devuelve el id del insumo
+create or replace function registrar_insumo(clave text, insumo jsonb, fecha date)
+returns bigint
+language plpgsql
+as $$
+declare
+    v_insumo_id bigint;
+begin
+    select id into v_insumo_id from insumos where clave_idempotencia = clave;
+    if found then
+        return v_insumo_id;
+    end if;
+
+    insert into insumos (nombre, categoria_id, precio_actual, stock_actual, stock_minimo, unidad_medida, clave_idempotencia)
+    values (
+        insumo->>'nombre',
+        (insumo->>'categoria_id')::bigint,
+        (insumo->>'precio_actual')::numeric,
+        (insumo->>'stock_actual')::numeric,
+        (insumo->>'stock_minimo')::numeric,
+        insumo->>'unidad_medida',
+        clave
+    )
+    returning id into v_insumo_id;
+
+    insert into historico_precios (insumo_id, precio, fecha)
+    values (v_insumo_id, (insumo->>'precio_actual')::numeric, registrar_insumo.fecha);
+
+    return v_insumo_id;
+end;
+$$;
+
+-- Consumos y producción con clave de idempotencia (reemplazan a las versiones de 007)
+drop function if exists registrar_consumo(jsonb, date, text);
+drop function if exists registrar_produccion(bigint, numeric, numeric, jsonb, date, text);
+
+create or replace function registrar_consumo(detalles jsonb, fecha date, observaciones text default '', clave text default null)
+returns bigint
+language plpgsql
+as $$
+declare
+    v_consumo_id bigint;
+begin
+    if clave is not null then
+        select id into v_consumo_id from consumos where clave_idempotencia = clave;
+        if found then
+            return v_consumo_id;
+        end if;
+    end if;
+
+    perform descontar_stock(detalles);
+
+    insert into consumos (fecha, produccion_id, observaciones, clave_idempotencia)
+    values (registrar_consumo.fecha, null, registrar_consumo.observaciones, clave)
+    returning id into v_consumo_id;
+
+    insert into consumo_detalles (consumo_id, insumo_id, cantidad)
+    select v_consumo_id, (d->>'insumo_id')::bigint, (d->>'cantidad')::numeric
+    from jsonb_array_elements(detalles) d;
+
+    return v_consumo_id;
+end;
+$$;
+
+create or replace function registrar_produccion(
+    producto_id bigint,
+    cantidad numeric,
+    costo_total numeric,
+    detalles jsonb,
+    fecha date,
+    observaciones text default '',
+    clave text default null
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_produccion produccion;
+    v_consumo_id bigint;
+begin
+    if clave is not null then
+        select * into v_produccion from produccion p where p.clave_idempotencia = clave;
+        if found then
+            return to_jsonb(v_produccion);
+        end if;
+    end if;
+
+    perform descontar_stock(detalles);
+
+    insert into produccion (producto_id, fecha, cantidad, costo_total, observaciones, clave_idempotencia)
+    values (registrar_produccion.producto_id, registrar_produccion.fecha, registrar_produccion.cantidad,
+            registrar_produccion.costo_total, registrar_produccion.observaciones, clave)
+    returning * into v_produccion;
+
+    insert into consumos (fecha, produccion_id, observaciones)
+    values (registrar_produccion.fecha, v_produccion.id, 'Consumo para producción #' || v_produccion.id)
+    returning id into v_consumo_id;
+
+    insert into consumo_detalles (consumo_id, insumo_id, cantidad)
+    select v_consumo_id, (d->>'insumo_id')::bigint, (d->>'cantidad')::numeric
+    from jsonb_array_elements(detalles) d;
+
+    return to_jsonb(v_produccion);
+end;
+$$;
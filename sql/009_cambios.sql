@@ -0,0 +1,45 @@
+-- Registro de cambios por tabla: cada proceso de la aplicación lo consulta para actualizar
+-- sus datos compartidos en lugar de esperar a que venza la caché de cada sesión
+create table if not exists cambios (
+    id bigint generated always as identity primary key,
+    tabla text not null,
+    creado timestamptz not null default now()
+);
+
+create or replace function registrar_cambio()
+returns trigger
+language plpgsql
+as $$
+begin
+    insert into cambios (tabla) values (tg_table_name);
+    return null;
+end;
+$$;
+
+-- Un aviso por sentencia (no por fila), así una inserción masiva genera un solo aviso
+do $$
+declare
+    t text;
+begin
+    foreach t in array array[
+        'insumos', 'categorias', 'productos', 'historico_precios', 'produccion', 'produccion_costos',
+        'compras', 'compra_detalles', 'consumos', 'consumo_detalles',
+        'receta_insumos', 'receta_costos_adicionales', 'receta_versiones'
+    ] loop
+        execute format('drop trigger if exists %I on %I', t || '_cambios', t);
+        execute format(
+            'create trigger %I after insert or update or delete on %I for each statement execute function registrar_cambio()',
+            t || '_cambios', t
+        );
+    end loop;
+end;
+$$;
+
+-- Los avisos solo se necesitan por unos minutos; programar con pg_cron, por ejemplo cada hora:
+-- select cron.schedule('purgar_cambios', '0 * * * *', 'select purgar_cambios()');
+create or replace function purgar_cambios()
+returns void
+language sql
+as $$
+    delete from cambios where creado < now() - interval '1 day';
+$$;
@@ -0,0 +1,71 @@
+-- Proveedores como entidades: compras.proveedor sigue siendo el texto ingresado, y compras.proveedor_id
+-- apunta al proveedor con el mismo nombre normalizado (sin mayúsculas ni espacios repetidos)
+create table if not exists proveedores (
+    id bigint generated always as identity primary key,
+    nombre text not null,
+    nombre_normalizado text not null unique,
+    updated_at timestamptz not null default now()
+);
+
+create index if not exists proveedores_updated_at_idx on proveedores (updated_at);
+
+drop trigger if exists proveedores_updated_at on proveedores;
+create trigger proveedores_updated_at before update on proveedores
+    for each row execute function marcar_updated_at();
+
+drop trigger if exists proveedores_cambios on proveedores;
+create trigger proveedores_cambios after insert or update or delete on proveedores
+    for each statement execute function registrar_cambio();
+
+create or replace function normalizar_proveedor(nombre text)
+returns text
+language sql
+immutable
+as $$
+    select nullif(lower(regexp_replace(btrim(coalesce(nombre, '')), '\s+', ' ', 'g')), '');
+$$;
+
+alter table compras add column if not exists proveedor_id bigint references proveedores(id);
+
+create index if not exists compras_proveedor_fecha_idx on compras (proveedor_id, fecha);
+create index if not exists compra_detalles_insumo_idx on compra_detalles (insumo_id, compra_id);
+
+-- Proveedores de las compras existentes; se conserva la primera forma escrita de cada nombre
+insert into proveedores (nombre, nombre_normalizado)
+select distinct on (normalizar_proveedor(proveedor)) btrim(proveedor), normalizar_proveedor(proveedor)
+from compras
+where normalizar_proveedor(proveedor) is not null
+order by normalizar_proveedor(proveedor), id
+on conflict (nombre_normalizado) do nothing;
+
+update compras c
+set proveedor_id = p.id
+from proveedores p
+where p.nombre_normalizado = normalizar_proveedor(c.proveedor)
+  and c.proveedor_id is distinct from p.id;
+
+-- Cada compra nueva (formulario, cola o importación) se asocia a su proveedor, creándolo si no existe
+create or replace function asignar_proveedor()
+returns trigger
+language plpgsql
+as $$
+declare
+    v_normalizado text := normalizar_proveedor(new.proveedor);
+begin
+    if v_normalizado is null then
+        new.proveedor_id = null;
+        return new;
+    end if;
+
+    insert into proveedores (nombre, nombre_normalizado)
+    values (btrim(new.proveedor), v_normalizado)
+    on conflict (nombre_normalizado) do nothing;
+
+    select id into new.proveedor_id from proveedores where nombre_normalizado = v_normalizado;
+    return new;
+end;
+$$;
+
+drop trigger if exists compras_proveedor on compras;
+create trigger compras_proveedor before insert or update of proveedor on compras
+    for each row execute function asignar_proveedor();
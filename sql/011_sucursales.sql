@@ -0,0 +1,366 @@
+-- Varias sucursales: el catálogo (insumos, productos, recetas, proveedores) es compartido, mientras que
+-- el stock, las compras, los consumos y la producción pertenecen a una sucursal.
+-- Los datos existentes quedan en la sucursal 1 ("Principal"), que también es el valor por defecto.
+create table if not exists sucursales (
+    id bigint generated by default as identity primary key,
+    nombre text not null unique,
+    activa boolean not null default true,
+    updated_at timestamptz not null default now()
+);
+
+insert into sucursales (id, nombre) values (1, 'Principal') on conflict (id) do nothing;
+select setval(pg_get_serial_sequence('sucursales', 'id'), greatest((select max(id) from sucursales), 1));
+
+drop trigger if exists sucursales_updated_at on sucursales;
+create trigger sucursales_updated_at before update on sucursales
+    for each row execute function marcar_updated_at();
+
+drop trigger if exists sucursales_cambios on sucursales;
+create trigger sucursales_cambios after insert or update or delete on sucursales
+    for each statement execute function registrar_cambio();
+
+-- Sucursal de cada movimiento; los índices (sucursal_id, id) permiten leer y revalidar
+-- cada sucursal por separado sin recorrer las filas de las demás
+do $$
+declare
+    t text;
+begin
+    foreach t in array array['compras', 'compra_detalles', 'consumos', 'consumo_detalles', 'produccion'] loop
+        execute format('alter table %I add column if not exists sucursal_id bigint not null default 1 references sucursales(id)', t);
+        execute format('create index if not exists %I on %I (sucursal_id, id)', t || '_sucursal_idx', t);
+    end loop;
+end;
+$$;
+
+create index if not exists compras_sucursal_fecha_idx on compras (sucursal_id, fecha);
+create index if not exists consumos_sucursal_fecha_idx on consumos (sucursal_id, fecha);
+create index if not exists produccion_sucursal_fecha_idx on produccion (sucursal_id, fecha, producto_id);
+
+alter table produccion_costos add column if not exists sucursal_id bigint not null default 1 references sucursales(id);
+create index if not exists produccion_costos_sucursal_fecha_idx on produccion_costos (sucursal_id, fecha);
+
+-- Las líneas de detalle toman la sucursal de su cabecera
+create or replace function asignar_sucursal_compra_detalle()
+returns trigger
+language plpgsql
+as $$
+begin
+    select sucursal_id into new.sucursal_id from compras where id = new.compra_id;
+    return new;
+end;
+$$;
+
+create or replace function asignar_sucursal_consumo_detalle()
+returns trigger
+language plpgsql
+as $$
+begin
+    select sucursal_id into new.sucursal_id from consumos where id = new.consumo_id;
+    return new;
+end;
+$$;
+
+drop trigger if exists compra_detalles_sucursal on compra_detalles;
+create trigger compra_detalles_sucursal before insert on compra_detalles
+    for each row execute function asignar_sucursal_compra_detalle();
+
+drop trigger if exists consumo_detalles_sucursal on consumo_detalles;
+create trigger consumo_detalles_sucursal before insert on consumo_detalles
+    for each row execute function asignar_sucursal_consumo_detalle();
+
+-- Stock por sucursal; insumos.stock_actual pasa a ser el total de todas las sucursales
+create table if not exists stock_sucursal (
+    id bigint generated always as identity primary key,
+    sucursal_id bigint not null references sucursales(id),
+    insumo_id bigint not null references insumos(id) on delete cascade,
+    stock_actual numeric not null default 0,
+    stock_minimo numeric not null default 0,
+    updated_at timestamptz not null default now(),
+    unique (sucursal_id, insumo_id)
+);
+
+create index if not exists stock_sucursal_updated_at_idx on stock_sucursal (sucursal_id, updated_at);
+
+insert into stock_sucursal (sucursal_id, insumo_id, stock_actual, stock_minimo)
+select 1, id, stock_actual, stock_minimo from insumos
+on conflict (sucursal_id, insumo_id) do nothing;
+
+drop trigger if exists stock_sucursal_updated_at on stock_sucursal;
+create trigger stock_sucursal_updated_at before update on stock_sucursal
+    for each row execute function marcar_updated_at();
+
+drop trigger if exists stock_sucursal_cambios on stock_sucursal;
+create trigger stock_sucursal_cambios after insert or update or delete on stock_sucursal
+    for each statement execute function registrar_cambio();
+
+create or replace function sumar_stock_sucursales()
+returns trigger
+language plpgsql
+as $$
+declare
+    v_insumo_id bigint := coalesce(new.insumo_id, old.insumo_id);
+begin
+    update insumos
+    set stock_actual = (select coalesce(sum(stock_actual), 0) from stock_sucursal where insumo_id = v_insumo_id)
+    where id = v_insumo_id;
+    return null;
+end;
+$$;
+
+drop trigger if exists stock_sucursal_total on stock_sucursal;
+create trigger stock_sucursal_total after insert or update of stock_actual or delete on stock_sucursal
+    for each row execute function sumar_stock_sucursales();
+
+-- Un insumo creado fuera de registrar_insumo (por ejemplo en la importación masiva) queda con su stock en la sucursal 1
+create or replace function crear_stock_sucursal()
+returns trigger
+language plpgsql
+as $$
+begin
+    insert into stock_sucursal (sucursal_id, insumo_id, stock_actual, stock_minimo)
+    values (1, new.id, coalesce(new.stock_actual, 0), coalesce(new.stock_minimo, 0))
+    on conflict (sucursal_id, insumo_id) do nothing;
+    return null;
+end;
+$$;
+
+drop trigger if exists insumos_stock_sucursal on insumos;
+create trigger insumos_stock_sucursal after insert on insumos
+    for each row execute function crear_stock_sucursal();
+
+-- Descuento de stock en una sucursal: bloquea las filas en orden de insumo, verifica y descuenta
+drop function if exists descontar_stock(jsonb);
+
+create or replace function descontar_stock(detalles jsonb, sucursal bigint default 1)
+returns void
+language plpgsql
+as $$
+declare
+    v_faltante record;
+begin
+    insert into stock_sucursal (sucursal_id, insumo_id)
+    select distinct sucursal, (d->>'insumo_id')::bigint from jsonb_array_elements(detalles) d
+    on conflict (sucursal_id, insumo_id) do nothing;
+
+    perform 1
+    from stock_sucursal s
+    where s.sucursal_id = sucursal
+      and s.insumo_id in (select (d->>'insumo_id')::bigint from jsonb_array_elements(detalles) d)
+    order by s.insumo_id
+    for update;
+
+    select i.nombre, s.stock_actual, m.cantidad
+    into v_faltante
+    from (
+        select (d->>'insumo_id')::bigint as insumo_id, sum((d->>'cantidad')::numeric) as cantidad
+        from jsonb_array_elements(detalles) d
+        group by 1
+    ) m
+    join stock_sucursal s on s.sucursal_id = sucursal and s.insumo_id = m.insumo_id
+    join insumos i on i.id = m.insumo_id
+    where s.stock_actual < m.cantidad
+    order by m.insumo_id
+    limit 1;
+
+    if found then
+        raise exception 'Stock insuficiente de %. Necesario: %, Disponible: %',
+            v_faltante.nombre, v_faltante.cantidad, v_faltante.stock_actual
+            using errcode = 'P0001';
+    end if;
+
+    update stock_sucursal s
+    set stock_actual = s.stock_actual - m.cantidad
+    from (
+        select (d->>'insumo_id')::bigint as insumo_id, sum((d->>'cantidad')::numeric) as cantidad
+        from jsonb_array_elements(detalles) d
+        group by 1
+    ) m
+    where s.sucursal_id = sucursal and s.insumo_id = m.insumo_id;
+end;
+$$;
+
+-- Funciones de registro con sucursal (reemplazan a las versiones de 008)
+drop function if exists registrar_compra(text, jsonb, jsonb);
+drop function if exists registrar_insumo(text, jsonb, date);
+drop function if exists registrar_consumo(jsonb, date, text, text);
+drop function if exists registrar_produccion(bigint, numeric, numeric, jsonb, date, text, text);
+
+-- Desde aquí registrar_compra también suma el stock comprado: un trigger que sume stock al insertar
+-- compras (o que mueva stock con cualquier otro movimiento) lo movería dos veces (ver 007)
+select verificar_sin_triggers_de_stock(array['compras', 'compra_detalles', 'consumos', 'consumo_detalles', 'produccion']);
+
+-- Compra con sus detalles; suma lo comprado al stock de la sucursal; insumos.stock_actual se recalcula
+-- desde stock_sucursal
+create or replace function registrar_compra(clave text, compra jsonb, detalles jsonb, sucursal bigint default 1)
+returns bigint
+language plpgsql
+as $$
+declare
+    v_compra_id bigint;
+begin
+    select id into v_compra_id from compras where clave_idempotencia = clave;
+    if found then
+        return v_compra_id;
+    end if;
+
+    insert into compras (fecha, proveedor, tipo, observaciones, total, clave_idempotencia, sucursal_id)
+    values (
+        (compra->>'fecha')::date,
+        compra->>'proveedor',
+        compra->>'tipo',
+        coalesce(compra->>'observaciones', ''),
+        (compra->>'total')::numeric,
+        clave,
+        sucursal
+    )
+    returning id into v_compra_id;
+
+    insert into compra_detalles (compra_id, insumo_id, cantidad, precio_unitario, subtotal)
+    select v_compra_id, (d->>'insumo_id')::bigint, (d->>'cantidad')::numeric,
+           (d->>'precio_unitario')::numeric, (d->>'subtotal')::numeric
+    from jsonb_array_elements(detalles) d;
+
+    insert into stock_sucursal as s (sucursal_id, insumo_id, stock_actual)
+    select sucursal, (d->>'insumo_id')::bigint, sum((d->>'cantidad')::numeric)
+    from jsonb_array_elements(detalles) d
+    group by 2
+    on conflict (sucursal_id, insumo_id) do update set stock_actual = s.stock_actual + excluded.stock_actual;
+
+    return v_compra_id;
+end;
+$$;
+
+-- Nuevo insumo (compartido por todas las sucursales) con su stock inicial en la sucursal que lo registra
+create or replace function registrar_insumo(clave text, insumo jsonb, fecha date, sucursal bigint default 1)
+returns bigint
+language plpgsql
+as $$
+declare
+    v_insumo_id bigint;
+begin
+    select id into v_insumo_id from insumos where clave_idempotencia = clave;
+    if found then
+        return v_insumo_id;
+    end if;
+
+    insert into insumos (nombre, categoria_id, precio_actual, stock_actual, stock_minimo, unidad_medida, clave_idempotencia)
+    values (
+        insumo->>'nombre',
+        (insumo->>'categoria_id')::bigint,
+        (insumo->>'precio_actual')::numeric,
+        0,
+        (insumo->>'stock_minimo')::numeric,
+        insumo->>'unidad_medida',
+        clave
+    )
+    returning id into v_insumo_id;
+
+    insert into stock_sucursal as s (sucursal_id, insumo_id, stock_actual, stock_minimo)
+    values (sucursal, v_insumo_id, (insumo->>'stock_actual')::numeric, (insumo->>'stock_minimo')::numeric)
+    on conflict (sucursal_id, insumo_id) do update
+        set stock_actual = excluded.stock_actual, stock_minimo = excluded.stock_minimo;
+
+    insert into historico_precios (insumo_id, precio, fecha)
+    values (v_insumo_id, (insumo->>'precio_actual')::numeric, registrar_insumo.fecha);
+
+    return v_insumo_id;
+end;
+$$;
+
+create or replace function registrar_consumo(
+    detalles jsonb,
+    fecha date,
+    observaciones text default '',
+    clave text default null,
+    sucursal bigint default 1
+)
+returns bigint
+language plpgsql
+as $$
+declare
+    v_consumo_id bigint;
+begin
+    if clave is not null then
+        select id into v_consumo_id from consumos where clave_idempotencia = clave;
+        if found then
+            return v_consumo_id;
+        end if;
+    end if;
+
+    perform descontar_stock(detalles, sucursal);
+
+    insert into consumos (fecha, produccion_id, observaciones, clave_idempotencia, sucursal_id)
+    values (registrar_consumo.fecha, null, registrar_consumo.observaciones, clave, sucursal)
+    returning id into v_consumo_id;
+
+    insert into consumo_detalles (consumo_id, insumo_id, cantidad)
+    select v_consumo_id, (d->>'insumo_id')::bigint, (d->>'cantidad')::numeric
+    from jsonb_array_elements(detalles) d;
+
+    return v_consumo_id;
+end;
+$$;
+
+create or replace function registrar_produccion(
+    producto_id bigint,
+    cantidad numeric,
+    costo_total numeric,
+    detalles jsonb,
+    fecha date,
+    observaciones text default '',
+    clave text default null,
+    sucursal bigint default 1
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_produccion produccion;
+    v_consumo_id bigint;
+begin
+    if clave is not null then
+        select * into v_produccion from produccion p where p.clave_idempotencia = clave;
+        if found then
+            return to_jsonb(v_produccion);
+        end if;
+    end if;
+
+    perform descontar_stock(detalles, sucursal);
+
+    insert into produccion (producto_id, fecha, cantidad, costo_total, observaciones, clave_idempotencia, sucursal_id)
+    values (registrar_produccion.producto_id, registrar_produccion.fecha, registrar_produccion.cantidad,
+            registrar_produccion.costo_total, registrar_produccion.observaciones, clave, sucursal)
+    returning * into v_produccion;
+
+    insert into consumos (fecha, produccion_id, observaciones, sucursal_id)
+    values (registrar_produccion.fecha, v_produccion.id, 'Consumo para producción #' || v_produccion.id, sucursal)
+    returning id into v_consumo_id;
+
+    insert into consumo_detalles (consumo_id, insumo_id, cantidad)
+    select v_consumo_id, (d->>'insumo_id')::bigint, (d->>'cantidad')::numeric
+    from jsonb_array_elements(detalles) d;
+
+    return to_jsonb(v_produccion);
+end;
+$$;
+
+-- Resumen de producción de una sucursal, o de todas si sucursal es null
+drop function if exists produccion_resumen(date, date, text);
+
+create or replace function produccion_resumen(fecha_inicio date, fecha_fin date, periodo text default 'day', sucursal bigint default null)
+returns table (inicio_periodo date, producto_id bigint, unidades numeric, costo numeric, ingreso numeric)
+language sql stable
+as $$
+    select
+        date_trunc(periodo, p.fecha)::date,
+        p.producto_id,
+        sum(p.cantidad),
+        sum(p.costo_total),
+        sum(p.cantidad * pr.precio_venta)
+    from produccion p
+    join productos pr on pr.id = p.producto_id
+    where p.fecha between fecha_inicio and fecha_fin
+      and (sucursal is null or p.sucursal_id = sucursal)
+    group by 1, 2
+    order by 1, 2
+$$;
@@ -0,0 +1,54 @@
+-- Reemplazo atómico de recetas para la importación masiva: por cada receta se borran y vuelven a insertar
+-- sus líneas, se incrementa receta_version y se registra la versión en el historial, todo en una transacción.
+-- Si algo falla, ningún producto del lote queda con la receta vacía o a medio reemplazar.
+-- recetas: [{"producto_id": 1,
+--            "insumos": [{"insumo_id": 2, "cantidad": 0.5, "unidad_medida": "kg"}, ...],
+--            "costos": [{"concepto": "Gas", "costo": 1.2}, ...]}, ...]
+-- Devuelve la cantidad de recetas reemplazadas
+create or replace function reemplazar_recetas(recetas jsonb)
+returns integer
+language plpgsql
+as $$
+declare
+    r jsonb;
+    v_producto_id bigint;
+    v_version integer;
+    v_total integer := 0;
+begin
+    for r in select * from jsonb_array_elements(recetas) loop
+        v_producto_id := (r->>'producto_id')::bigint;
+
+        update productos p set receta_version = p.receta_version + 1
+        where p.id = v_producto_id
+        returning p.receta_version into v_version;
+        if not found then
+            raise exception 'Producto % no encontrado', v_producto_id;
+        end if;
+
+        delete from receta_insumos ri where ri.producto_id = v_producto_id;
+        delete from receta_costos_adicionales rc where rc.producto_id = v_producto_id;
+
+        insert into receta_insumos (producto_id, insumo_id, cantidad, unidad_medida)
+        select v_producto_id, (l->>'insumo_id')::bigint, (l->>'cantidad')::numeric, l->>'unidad_medida'
+        from jsonb_array_elements(coalesce(r->'insumos', '[]')) l;
+
+        insert into receta_costos_adicionales (producto_id, concepto, costo)
+        select v_producto_id, c->>'concepto', (c->>'costo')::numeric
+        from jsonb_array_elements(coalesce(r->'costos', '[]')) c;
+
+        insert into receta_versiones (producto_id, version, insumo_ids, cantidades, unidades, conceptos, costos)
+        values (
+            v_producto_id,
+            v_version,
+            array(select (l->>'insumo_id')::bigint from jsonb_array_elements(coalesce(r->'insumos', '[]')) with ordinality t(l, n) order by n),
+            array(select (l->>'cantidad')::numeric from jsonb_array_elements(coalesce(r->'insumos', '[]')) with ordinality t(l, n) order by n),
+            array(select l->>'unidad_medida' from jsonb_array_elements(coalesce(r->'insumos', '[]')) with ordinality t(l, n) order by n),
+            array(select c->>'concepto' from jsonb_array_elements(coalesce(r->'costos', '[]')) with ordinality t(c, n) order by n),
+            array(select (c->>'costo')::numeric from jsonb_array_elements(coalesce(r->'costos', '[]')) with ordinality t(c, n) order by n)
+        );
+
+        v_total := v_total + 1;
+    end loop;
+    return v_total;
+end;
+$$;
@@ -0,0 +1,70 @@
+-- El costo congelado de una producción (produccion_costos) se escribe dentro de registrar_produccion,
+-- en la misma transacción que la producción y su consumo: no quedan producciones sin costo congelado
+-- y un reintento con la misma clave devuelve la producción ya registrada sin volver a escribir el costo.
+-- costo: {"precio_venta": 25, "insumo_ids": [1, 2], "cantidades": [0.5, 0.2], "precios": [3.1, 8],
+--         "costo_adicional": 1.5, "costo_unitario": 4.65}; con null no se congela el costo
+drop function if exists registrar_produccion(bigint, numeric, numeric, jsonb, date, text, text, bigint);
+
+create or replace function registrar_produccion(
+    producto_id bigint,
+    cantidad numeric,
+    costo_total numeric,
+    detalles jsonb,
+    fecha date,
+    observaciones text default '',
+    clave text default null,
+    sucursal bigint default 1,
+    costo jsonb default null
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_produccion produccion;
+    v_consumo_id bigint;
+begin
+    if clave is not null then
+        select * into v_produccion from produccion p where p.clave_idempotencia = clave;
+        if found then
+            return to_jsonb(v_produccion);
+        end if;
+    end if;
+
+    perform descontar_stock(detalles, sucursal);
+
+    insert into produccion (producto_id, fecha, cantidad, costo_total, observaciones, clave_idempotencia, sucursal_id)
+    values (registrar_produccion.producto_id, registrar_produccion.fecha, registrar_produccion.cantidad,
+            registrar_produccion.costo_total, registrar_produccion.observaciones, clave, sucursal)
+    returning * into v_produccion;
+
+    insert into consumos (fecha, produccion_id, observaciones, sucursal_id)
+    values (registrar_produccion.fecha, v_produccion.id, 'Consumo para producción #' || v_produccion.id, sucursal)
+    returning id into v_consumo_id;
+
+    insert into consumo_detalles (consumo_id, insumo_id, cantidad)
+    select v_consumo_id, (d->>'insumo_id')::bigint, (d->>'cantidad')::numeric
+    from jsonb_array_elements(detalles) d;
+
+    if costo is not null then
+        insert into produccion_costos (
+            produccion_id, producto_id, sucursal_id, fecha, cantidad, precio_venta,
+            insumo_ids, cantidades, precios, costo_adicional, costo_unitario
+        )
+        values (
+            v_produccion.id,
+            v_produccion.producto_id,
+            sucursal,
+            v_produccion.fecha,
+            v_produccion.cantidad,
+            (costo->>'precio_venta')::numeric,
+            array(select x::bigint from jsonb_array_elements_text(costo->'insumo_ids') with ordinality t(x, n) order by n),
+            array(select x::numeric from jsonb_array_elements_text(costo->'cantidades') with ordinality t(x, n) order by n),
+            array(select x::numeric from jsonb_array_elements_text(costo->'precios') with ordinality t(x, n) order by n),
+            coalesce((costo->>'costo_adicional')::numeric, 0),
+            (costo->>'costo_unitario')::numeric
+        );
+    end if;
+
+    return to_jsonb(v_produccion);
+end;
+$$;
@@ -0,0 +1,80 @@
+-- Guardado atómico de una receta editada: los datos del producto, las líneas modificadas, nuevas y
+-- eliminadas, el incremento de receta_version y la fila del historial se escriben en una transacción.
+-- receta_version es el control de concurrencia optimista: si otro usuario guardó antes, se lanza un error
+-- con código PT409 (PostgREST responde 409) y no se escribe nada.
+-- producto: {"nombre": "...", "descripcion": "...", "precio_venta": 25}
+-- insumos / costos: {"modificadas": [{"id": 3, ...}], "nuevas": [{...}], "eliminadas": [4, 5]}
+-- registro: fila de receta_versiones sin producto_id ni version (arreglos paralelos de la receta completa);
+--           con null la receta no cambió y la versión se conserva
+-- Devuelve la versión vigente de la receta
+create or replace function guardar_receta(
+    producto_id bigint,
+    version integer,
+    producto jsonb,
+    insumos jsonb,
+    costos jsonb,
+    registro jsonb default null
+)
+returns integer
+language plpgsql
+as $$
+declare
+    v_version integer;
+begin
+    update productos p set
+        nombre = producto->>'nombre',
+        descripcion = producto->>'descripcion',
+        precio_venta = (producto->>'precio_venta')::numeric,
+        receta_version = p.receta_version + (case when registro is null then 0 else 1 end)
+    where p.id = guardar_receta.producto_id and p.receta_version = guardar_receta.version
+    returning p.receta_version into v_version;
+    if not found then
+        raise exception 'La receta del producto % fue modificada por otro usuario', guardar_receta.producto_id
+            using errcode = 'PT409';
+    end if;
+
+    update receta_insumos ri set
+        insumo_id = (l->>'insumo_id')::bigint,
+        cantidad = (l->>'cantidad')::numeric,
+        unidad_medida = l->>'unidad_medida'
+    from jsonb_array_elements(coalesce(insumos->'modificadas', '[]')) l
+    where ri.id = (l->>'id')::bigint and ri.producto_id = guardar_receta.producto_id;
+
+    insert into receta_insumos (producto_id, insumo_id, cantidad, unidad_medida)
+    select guardar_receta.producto_id, (l->>'insumo_id')::bigint, (l->>'cantidad')::numeric, l->>'unidad_medida'
+    from jsonb_array_elements(coalesce(insumos->'nuevas', '[]')) l;
+
+    delete from receta_insumos ri
+    where ri.producto_id = guardar_receta.producto_id
+      and ri.id in (select value::bigint from jsonb_array_elements_text(coalesce(insumos->'eliminadas', '[]')));
+
+    update receta_costos_adicionales rc set
+        concepto = c->>'concepto',
+        costo = (c->>'costo')::numeric
+    from jsonb_array_elements(coalesce(costos->'modificadas', '[]')) c
+    where rc.id = (c->>'id')::bigint and rc.producto_id = guardar_receta.producto_id;
+
+    insert into receta_costos_adicionales (producto_id, concepto, costo)
+    select guardar_receta.producto_id, c->>'concepto', (c->>'costo')::numeric
+    from jsonb_array_elements(coalesce(costos->'nuevas', '[]')) c;
+
+    delete from receta_costos_adicionales rc
+    where rc.producto_id = guardar_receta.producto_id
+      and rc.id in (select value::bigint from jsonb_array_elements_text(coalesce(costos->'eliminadas', '[]')));
+
+    if registro is not null then
+        insert into receta_versiones (producto_id, version, insumo_ids, cantidades, unidades, conceptos, costos)
+        values (
+            guardar_receta.producto_id,
+            v_version,
+            array(select value::bigint from jsonb_array_elements_text(registro->'insumo_ids') with ordinality t(value, n) order by n),
+            array(select value::numeric from jsonb_array_elements_text(registro->'cantidades') with ordinality t(value, n) order by n),
+            array(select value from jsonb_array_elements_text(registro->'unidades') with ordinality t(value, n) order by n),
+            array(select value from jsonb_array_elements_text(registro->'conceptos') with ordinality t(value, n) order by n),
+            array(select value::numeric from jsonb_array_elements_text(registro->'costos') with ordinality t(value, n) order by n)
+        );
+    end if;
+
+    return v_version;
+end;
+$$;
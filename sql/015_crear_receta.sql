@@ -0,0 +1,40 @@
+-- Creación atómica de una receta nueva: el producto, sus líneas, sus costos adicionales y la primera fila
+-- del historial se escriben en una transacción. Si algo falla no queda un producto sin receta ni a medias.
+-- producto: {"nombre": "...", "descripcion": "...", "precio_venta": 25}
+-- insumos: [{"insumo_id": 2, "cantidad": 0.5, "unidad_medida": "kg"}, ...]
+-- costos: [{"concepto": "Gas", "costo": 1.2}, ...]
+-- Devuelve el id del producto creado
+create or replace function crear_receta(producto jsonb, insumos jsonb, costos jsonb)
+returns bigint
+language plpgsql
+as $$
+declare
+    v_producto_id bigint;
+    v_version integer;
+begin
+    insert into productos (nombre, descripcion, precio_venta)
+    values (producto->>'nombre', producto->>'descripcion', (producto->>'precio_venta')::numeric)
+    returning id, receta_version into v_producto_id, v_version;
+
+    insert into receta_insumos (producto_id, insumo_id, cantidad, unidad_medida)
+    select v_producto_id, (l->>'insumo_id')::bigint, (l->>'cantidad')::numeric, l->>'unidad_medida'
+    from jsonb_array_elements(coalesce(insumos, '[]')) l;
+
+    insert into receta_costos_adicionales (producto_id, concepto, costo)
+    select v_producto_id, c->>'concepto', (c->>'costo')::numeric
+    from jsonb_array_elements(coalesce(costos, '[]')) c;
+
+    insert into receta_versiones (producto_id, version, insumo_ids, cantidades, unidades, conceptos, costos)
+    values (
+        v_producto_id,
+        v_version,
+        array(select (l->>'insumo_id')::bigint from jsonb_array_elements(coalesce(insumos, '[]')) with ordinality t(l, n) order by n),
+        array(select (l->>'cantidad')::numeric from jsonb_array_elements(coalesce(insumos, '[]')) with ordinality t(l, n) order by n),
+        array(select l->>'unidad_medida' from jsonb_array_elements(coalesce(insumos, '[]')) with ordinality t(l, n) order by n),
+        array(select c->>'concepto' from jsonb_array_elements(coalesce(costos, '[]')) with ordinality t(c, n) order by n),
+        array(select (c->>'costo')::numeric from jsonb_array_elements(coalesce(costos, '[]')) with ordinality t(c, n) order by n)
+    );
+
+    return v_producto_id;
+end;
+$$;
@@ -0,0 +1,86 @@
+import pandas as pd
+from postgrest.exceptions import APIError
+
+from sucursales import SUCURSAL_PRINCIPAL
+
+
+class StockInsuficiente(Exception):
+    pass
+
+
+def _detalles(detalles):
+    return [{'insumo_id': int(d['insumo_id']), 'cantidad': float(d['cantidad'])} for d in detalles]
+
+
+def _rpc(sb, funcion, parametros):
+    try:
+        return sb.rpc(funcion, parametros).execute().data
+    except APIError as e:
+        # Las funciones del servidor usan el código P0001 cuando falta stock
+        if e.code == 'P0001':
+            raise StockInsuficiente(e.message) from e
+        raise
+
+
+# Función para registrar un consumo manual verificando y descontando el stock en el servidor
+# detalles: lista de {'insumo_id', 'cantidad'}; devuelve el id del consumo
+# clave: clave de idempotencia; si ya se registró una operación con esa clave no se repite
+# El stock se descuenta en la sucursal indicada
+def registrar_consumo(sb, detalles, fecha, observaciones='', clave=None, sucursal=SUCURSAL_PRINCIPAL):
+    return _rpc(sb, 'registrar_consumo', {
+        'clave': clave,
+        'detalles': _detalles(detalles),
+        'fecha': fecha,
+        'observaciones': observaciones,
+        'sucursal': int(sucursal),
+    })
+
+
+# Función para registrar una producción y el consumo de todos sus insumos en una sola llamada
+# costo: desglose a congelar en produccion_costos (ver costos.costo_congelado), en la misma transacción
+# Devuelve la fila de produccion creada
+def registrar_produccion(sb, producto_id, cantidad, costo_total, detalles, fecha, observaciones='', clave=None, sucursal=SUCURSAL_PRINCIPAL, costo=None):
+    return _rpc(sb, 'registrar_produccion', {
+        'clave': clave,
+        'producto_id': int(producto_id),
+        'cantidad': cantidad,
+        'costo_total': float(costo_total),
+        'detalles': _detalles(detalles),
+        'fecha': fecha,
+        'observaciones': observaciones,
+        'sucursal': int(sucursal),
+        'costo': costo,
+    })
+
+
+# Función para verificar si alcanza el stock actual para un plan de producción
+# plan: DataFrame con producto_id y cantidad; receta_insumos puede incluir líneas de muchos productos
+# Devuelve (factible, requerimientos) con una fila por insumo: requerido, stock_actual y faltante
+def factibilidad(plan, receta_insumos, insumos):
+    columnas = ['insumo_id', 'requerido', 'stock_actual', 'faltante']
+    if plan.empty or receta_insumos.empty:
+        return True, pd.DataFrame(columns=columnas)
+
+    unidades = plan.groupby('producto_id')['cantidad'].sum().astype(float)
+    lineas = receta_insumos[receta_insumos['producto_id'].isin(unidades.index)]
+    requerido = (lineas['cantidad'].astype(float) * lineas['producto_id'].map(unidades)).groupby(lineas['insumo_id']).sum()
+
+    requerimientos = requerido.rename('requerido').reset_index().merge(
+        insumos[['id', 'stock_actual']].rename(columns={'id': 'insumo_id'}),
+        on='insumo_id',
+        how='left'
+    )
+    requerimientos['stock_actual'] = requerimientos['stock_actual'].fillna(0.0).astype(float)
+    requerimientos['faltante'] = (requerimientos['requerido'] - requerimientos['stock_actual']).clip(lower=0.0)
+    return bool((requerimientos['faltante'] <= 0).all()), requerimientos[columnas]
+
+
+# Función para obtener los insumos con stock por debajo del mínimo, ordenados por faltante relativo
+def alertas_stock(insumos):
+    columnas = ['id', 'nombre', 'stock_actual', 'stock_minimo', 'unidad_medida']
+    if insumos.empty:
+        return pd.DataFrame(columns=columnas + ['faltante'])
+    alertas = insumos[insumos['stock_actual'] < insumos['stock_minimo']][columnas].copy()
+    alertas['faltante'] = alertas['stock_minimo'] - alertas['stock_actual']
+    relativo = alertas['faltante'] / alertas['stock_minimo'].where(alertas['stock_minimo'] > 0)
+    return alertas.assign(_relativo=relativo).sort_values('_relativo', ascending=False).drop(columns='_relativo')
@@ -0,0 +1,29 @@
+import pandas as pd
+
+# Sucursal de los datos anteriores a la separación por sucursales y valor por defecto de las escrituras
+SUCURSAL_PRINCIPAL = 1
+
+# Tablas cuyas filas pertenecen a una sucursal (columna sucursal_id); se cargan y cachean por sucursal
+TABLAS_POR_SUCURSAL = ['produccion', 'compras', 'stock_sucursal']
+
+
+# Función para reemplazar el stock total de los insumos por el stock de una sucursal
+# Los insumos sin fila en stock_sucursal tienen stock 0 en esa sucursal y conservan el mínimo del catálogo
+def insumos_con_stock(insumos, stock):
+    if insumos.empty:
+        return insumos
+    if stock.empty:
+        return insumos.assign(stock_actual=0.0)
+    stock = stock.set_index('insumo_id')
+    return insumos.assign(
+        stock_actual=insumos['id'].map(stock['stock_actual']).fillna(0.0).astype(float),
+        stock_minimo=insumos['id'].map(stock['stock_minimo']).fillna(insumos['stock_minimo']).astype(float),
+    )
+
+
+# Función para sumar resúmenes por sucursal (mismas columnas clave) en un resumen consolidado
+def consolidar(resumenes, claves, valores):
+    resumenes = [resumen for resumen in resumenes if resumen is not None and not resumen.empty]
+    if not resumenes:
+        return pd.DataFrame(columns=claves + valores)
+    return pd.concat(resumenes, ignore_index=True).groupby(claves, as_index=False)[valores].sum()
@@ -0,0 +1,290 @@
+import threading
+import time
+from collections import deque
+
+import pandas as pd
+
+import cache_disco
+from datos import ids_en_ventana, leer_lineas_nuevas
+
+METODOS = {'fifo': 'FIFO (primeras entradas, primeras salidas)', 'promedio': 'Costo Promedio Ponderado'}
+
+# Versión del formato del estado guardado en disco
+VERSION_ESTADO = 3
+
+# Segundos mínimos entre guardados del estado en disco (cada guardado reescribe el estado completo);
+# si el proceso termina antes, al reiniciar se vuelven a aplicar los movimientos desde el último guardado
+INTERVALO_GUARDADO = 60
+
+
+# Valorización de inventario por capas de compra
+# Con 'fifo' cada compra es una capa y los consumos se descuentan desde la más antigua;
+# con 'promedio' cada insumo tiene una sola capa con su costo promedio ponderado.
+# Cada movimiento toca solo las capas que consume, y los totales se mantienen al día.
+# Un movimiento con fecha anterior o igual a la del último día aplicado obliga a reconstruir las capas desde
+# cero (una compra del mismo día llegada después de un consumo ya aplicado debe ir antes que ese consumo).
+# Con sucursal solo se valorizan los movimientos de esa sucursal (sucursal=None: todas).
+class Valorizador:
+    def __init__(self, metodo='fifo', sucursal=None):
+        if metodo not in METODOS:
+            raise ValueError(f"Método de valorización desconocido: {metodo}")
+        self.metodo = metodo
+        self.sucursal = sucursal
+        self._capas = {}
+        self._valor = {}
+        self._ultimo_costo = {}
+        self._costo_consumos = {}
+        self.valor_total = 0.0
+        self.ultima_compra = 0
+        self.ultimo_consumo = 0
+        # Día del último movimiento aplicado ('AAAA-MM-DD'), para detectar movimientos con fecha anterior o igual
+        self.ultima_fecha = None
+        # Cantidad consumida por insumo que no estaba en las capas (consumo sin compra registrada)
+        self._faltante = {}
+        self._guardado = 0.0
+        self._sin_guardar = False
+        # Ids ya aplicados dentro de la ventana de relectura, por tabla ('compra', 'consumo')
+        self.vistos = {'compra': set(), 'consumo': set()}
+        self.candado = threading.Lock()
+
+    def registrar_compra(self, insumo_id, cantidad, costo_unitario):
+        capas = self._capas.setdefault(insumo_id, deque())
+        if self.metodo == 'promedio' and capas:
+            cantidad_actual, costo_actual = capas[0]
+            cantidad_total = cantidad_actual + cantidad
+            costo_promedio = (cantidad_actual * costo_actual + cantidad * costo_unitario) / cantidad_total if cantidad_total else costo_unitario
+            capas[0] = [cantidad_total, costo_promedio]
+        else:
+            capas.append([cantidad, costo_unitario])
+
+        self._valor[insumo_id] = self._valor.get(insumo_id, 0.0) + cantidad * costo_unitario
+        self.valor_total += cantidad * costo_unitario
+        self._ultimo_costo[insumo_id] = costo_unitario
+
+    # Función para descontar un consumo de las capas; devuelve su costo
+    # Si el consumo supera las capas disponibles (stock inicial sin compra registrada), el faltante
+    # se valoriza al último costo conocido o al precio de referencia y se acumula en faltante(insumo_id)
+    def registrar_consumo(self, insumo_id, cantidad, precio_referencia=0.0):
+        capas = self._capas.get(insumo_id, deque())
+        restante = cantidad
+        costo = 0.0
+        while restante > 0 and capas:
+            capa = capas[0]
+            tomado = min(capa[0], restante)
+            costo += tomado * capa[1]
+            capa[0] -= tomado
+            restante -= tomado
+            if capa[0] <= 1e-9:
+                capas.popleft()
+
+        consumido_de_capas = costo
+        if restante > 1e-9:
+            costo += restante * self._ultimo_costo.get(insumo_id, precio_referencia)
+            self._faltante[insumo_id] = self._faltante.get(insumo_id, 0.0) + restante
+
+        self._valor[insumo_id] = self._valor.get(insumo_id, 0.0) - consumido_de_capas
+        self.valor_total -= consumido_de_capas
+        return costo
+
+    def valor(self, insumo_id):
+        return self._valor.get(insumo_id, 0.0)
+
+    def faltante(self, insumo_id):
+        return self._faltante.get(insumo_id, 0.0)
+
+    # Función para volver al estado vacío (antes de reconstruir desde el primer movimiento)
+    def reiniciar(self):
+        self._capas.clear()
+        self._valor.clear()
+        self._ultimo_costo.clear()
+        self._costo_consumos.clear()
+        self._faltante.clear()
+        self.valor_total = 0.0
+        self.ultima_compra = 0
+        self.ultimo_consumo = 0
+        self.ultima_fecha = None
+        self.vistos = {'compra': set(), 'consumo': set()}
+
+    # Función para obtener cantidad, valor, costo unitario promedio y consumo sin capas (faltante) por insumo
+    def resumen(self):
+        filas = []
+        for insumo_id in set(self._capas) | set(self._faltante):
+            capas = self._capas.get(insumo_id, ())
+            cantidad = sum(capa[0] for capa in capas)
+            valor = self._valor.get(insumo_id, 0.0)
+            filas.append({
+                'insumo_id': insumo_id,
+                'cantidad': cantidad,
+                'valor': valor,
+                'costo_unitario': valor / cantidad if cantidad > 0 else 0.0,
+                'capas': len(capas),
+                'faltante': self._faltante.get(insumo_id, 0.0),
+            })
+        return pd.DataFrame(filas, columns=['insumo_id', 'cantidad', 'valor', 'costo_unitario', 'capas', 'faltante'])
+
+    # Función para obtener el costo real (valorizado) de cada producción
+    def costo_producciones(self):
+        filas = [
+            {'produccion_id': produccion_id, 'costo_real': costo}
+            for (consumo_id, produccion_id), costo in self._costo_consumos.items()
+            if produccion_id is not None
+        ]
+        df = pd.DataFrame(filas, columns=['produccion_id', 'costo_real'])
+        return df.groupby('produccion_id', as_index=False).sum()
+
+    def _aplicar_consumo(self, consumo_id, produccion_id, insumo_id, cantidad, precio_referencia):
+        costo = self.registrar_consumo(insumo_id, cantidad, precio_referencia)
+        clave = (consumo_id, produccion_id)
+        self._costo_consumos[clave] = self._costo_consumos.get(clave, 0.0) + costo
+
+    # Funciones para guardar y restaurar el estado (capas y costos de consumos) como DataFrames
+    def a_dataframes(self):
+        capas = pd.DataFrame(
+            [(insumo_id, orden, capa[0], capa[1]) for insumo_id, lista in self._capas.items() for orden, capa in enumerate(lista)],
+            columns=['insumo_id', 'orden', 'cantidad', 'costo_unitario']
+        )
+        insumos = pd.DataFrame(
+            [
+                (insumo_id, self._valor.get(insumo_id, 0.0), self._ultimo_costo.get(insumo_id), self._faltante.get(insumo_id, 0.0))
+                for insumo_id in set(self._valor) | set(self._ultimo_costo) | set(self._faltante)
+            ],
+            columns=['insumo_id', 'valor', 'ultimo_costo', 'faltante']
+        )
+        consumos = pd.DataFrame(
+            [(consumo_id, produccion_id, costo) for (consumo_id, produccion_id), costo in self._costo_consumos.items()],
+            columns=['consumo_id', 'produccion_id', 'costo']
+        )
+        return capas, insumos, consumos
+
+    @classmethod
+    def desde_dataframes(cls, metodo, capas, insumos, consumos, ultima_compra, ultimo_consumo, sucursal=None, vistos=None, ultima_fecha=None):
+        valorizador = cls(metodo, sucursal)
+        for insumo_id, grupo in capas.sort_values(['insumo_id', 'orden']).groupby('insumo_id'):
+            valorizador._capas[insumo_id] = deque([[c, u] for c, u in zip(grupo['cantidad'], grupo['costo_unitario'])])
+        for fila in insumos.itertuples(index=False):
+            valorizador._valor[fila.insumo_id] = fila.valor
+            if not pd.isna(fila.ultimo_costo):
+                valorizador._ultimo_costo[fila.insumo_id] = fila.ultimo_costo
+            if fila.faltante:
+                valorizador._faltante[fila.insumo_id] = fila.faltante
+        for fila in consumos.itertuples(index=False):
+            produccion_id = None if pd.isna(fila.produccion_id) else int(fila.produccion_id)
+            valorizador._costo_consumos[(fila.consumo_id, produccion_id)] = fila.costo
+        valorizador.valor_total = float(insumos['valor'].sum()) if not insumos.empty else 0.0
+        valorizador.ultima_compra = ultima_compra
+        valorizador.ultimo_consumo = ultimo_consumo
+        valorizador.ultima_fecha = ultima_fecha
+        valorizador._guardado = time.time()
+        for clave, ids in (vistos or {}).items():
+            valorizador.vistos[clave] = set(ids)
+        return valorizador
+
+
+def _leer_movimientos(valorizador, sb):
+    filtros = [] if valorizador.sucursal is None else [('eq', 'sucursal_id', valorizador.sucursal)]
+    compras = leer_lineas_nuevas(
+        sb, 'compra_detalles', 'compras', 'compra_id', ['fecha'], valorizador.ultima_compra, valorizador.vistos['compra'], filtros
+    )
+    consumos = leer_lineas_nuevas(
+        sb, 'consumo_detalles', 'consumos', 'consumo_id', ['fecha', 'produccion_id'], valorizador.ultimo_consumo,
+        valorizador.vistos['consumo'], filtros
+    )
+    return compras, consumos
+
+
+def _dia(fecha):
+    return str(fecha)[:10]
+
+
+# Función para aplicar las compras y consumos registrados después del último movimiento procesado
+# Los movimientos nuevos se aplican en orden de fecha (compras antes que consumos del mismo día); si alguno
+# tiene fecha anterior o igual al último día aplicado, las capas se reconstruyen desde el primer movimiento
+# Devuelve la cantidad de movimientos aplicados
+def actualizar(valorizador, sb, precios_referencia=None):
+    precios_referencia = precios_referencia or {}
+    with valorizador.candado:
+        compras, consumos = _leer_movimientos(valorizador, sb)
+        if compras.empty and consumos.empty:
+            _guardar_si_corresponde(valorizador)
+            return 0
+
+        fechas = [_dia(fecha) for df in (compras, consumos) if not df.empty for fecha in df['fecha']]
+        reconstruir = valorizador.ultima_fecha is not None and min(fechas) <= valorizador.ultima_fecha
+        if reconstruir:
+            valorizador.reiniciar()
+            compras, consumos = _leer_movimientos(valorizador, sb)
+
+        movimientos = []
+        for fila in compras.itertuples(index=False):
+            movimientos.append((str(fila.fecha), 0, fila.id, fila))
+        for fila in consumos.itertuples(index=False):
+            movimientos.append((str(fila.fecha), 1, fila.id, fila))
+        movimientos.sort(key=lambda m: m[:3])
+
+        for _, tipo, _, fila in movimientos:
+            if tipo == 0:
+                valorizador.registrar_compra(fila.insumo_id, float(fila.cantidad), float(fila.precio_unitario))
+            else:
+                produccion_id = None if pd.isna(fila.produccion_id) else int(fila.produccion_id)
+                valorizador._aplicar_consumo(
+                    fila.consumo_id, produccion_id, fila.insumo_id, float(fila.cantidad),
+                    precios_referencia.get(fila.insumo_id, 0.0)
+                )
+
+        if not compras.empty:
+            valorizador.ultima_compra = max(valorizador.ultima_compra, int(compras['id'].max()))
+            valorizador.vistos['compra'] = ids_en_ventana(valorizador.vistos['compra'], compras['id'], valorizador.ultima_compra)
+        if not consumos.empty:
+            valorizador.ultimo_consumo = max(valorizador.ultimo_consumo, int(consumos['id'].max()))
+            valorizador.vistos['consumo'] = ids_en_ventana(valorizador.vistos['consumo'], consumos['id'], valorizador.ultimo_consumo)
+        valorizador.ultima_fecha = max([valorizador.ultima_fecha or ''] + [_dia(m[0]) for m in movimientos])
+
+        valorizador._sin_guardar = True
+        _guardar_si_corresponde(valorizador, forzar=reconstruir)
+        return len(movimientos)
+
+
+def _guardar_si_corresponde(valorizador, forzar=False):
+    if valorizador._sin_guardar and (forzar or time.time() - valorizador._guardado >= INTERVALO_GUARDADO):
+        guardar(valorizador)
+
+
+def _nombres(metodo, sucursal=None):
+    prefijo = f"valorizacion_{metodo}" if sucursal is None else f"valorizacion_{metodo}_sucursal_{sucursal}"
+    return [f"{prefijo}_{parte}" for parte in ('capas', 'insumos', 'consumos')]
+
+
+def _version(valorizador):
+    return {
+        'formato': VERSION_ESTADO,
+        'compra': valorizador.ultima_compra,
+        'consumo': valorizador.ultimo_consumo,
+        'fecha': valorizador.ultima_fecha,
+        'vistos': {clave: sorted(ids) for clave, ids in valorizador.vistos.items()},
+    }
+
+
+# Función para guardar el estado en la caché en disco (evita reprocesar todo el historial al reiniciar)
+def guardar(valorizador):
+    valorizador._guardado = time.time()
+    valorizador._sin_guardar = False
+    for nombre, df in zip(_nombres(valorizador.metodo, valorizador.sucursal), valorizador.a_dataframes()):
+        cache_disco.guardar_derivado(nombre, df, _version(valorizador))
+
+
+# Función para restaurar el estado guardado, o crear un valorizador vacío si no hay uno válido
+def cargar(metodo, sucursal=None):
+    partes = [cache_disco.leer_derivado_con_version(nombre) for nombre in _nombres(metodo, sucursal)]
+    versiones = [version for _, version in partes]
+    if (
+        any(df is None for df, _ in partes)
+        or any(version != versiones[0] for version in versiones)
+        or not versiones[0]
+        or versiones[0].get('formato') != VERSION_ESTADO
+    ):
+        return Valorizador(metodo, sucursal)
+    capas, insumos, consumos = (df for df, _ in partes)
+    return Valorizador.desde_dataframes(
+        metodo, capas, insumos, consumos, versiones[0]['compra'], versiones[0]['consumo'], sucursal, versiones[0]['vistos'],
+        versiones[0]['fecha']
+    )
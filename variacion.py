@@ -0,0 +1,222 @@
+import threading
+
+import pandas as pd
+
+import cache_disco
+from datos import ids_en_ventana, leer_filas_nuevas, leer_lineas_nuevas
+
+# Versión del formato del resumen diario guardado en disco
+VERSION_RESUMEN = 2
+
+NOMBRE_DERIVADO = 'variacion_diaria'
+
+COLUMNAS_DIARIAS = ['dia', 'insumo_id', 'teorico', 'consumo_produccion', 'consumo_manual', 'comprado']
+
+
+def _dias(serie):
+    # Día calendario sin zona horaria, para agrupar y filtrar por fecha
+    return pd.to_datetime(serie, utc=True).dt.tz_localize(None).dt.normalize()
+
+
+def _vacio():
+    return pd.DataFrame(columns=COLUMNAS_DIARIAS)
+
+
+def _nombre(sucursal):
+    return NOMBRE_DERIVADO if sucursal is None else f"{NOMBRE_DERIVADO}_sucursal_{sucursal}"
+
+
+# Función para calcular el consumo teórico de insumos de un conjunto de producciones
+# Cada producción usa la versión de receta vigente en su fecha (sin una versión anterior no se considera);
+# devuelve una fila por (dia, insumo_id) con la cantidad teórica
+def consumo_teorico(produccion, versiones):
+    if produccion.empty or versiones.empty:
+        return pd.DataFrame(columns=['dia', 'insumo_id', 'teorico'])
+
+    producciones = produccion[['producto_id', 'cantidad', 'fecha']].assign(
+        producto_id=produccion['producto_id'].astype(int),
+        dia=_dias(produccion['fecha'])
+    )
+    # Límite del día consultado, igual que IndiceCostoHistorico: versiones registradas hasta el fin del día
+    producciones['limite'] = producciones['dia'] + pd.Timedelta(days=1)
+    recetas = versiones[['producto_id', 'version', 'vigente_desde', 'insumo_ids', 'cantidades']].assign(
+        limite=pd.to_datetime(versiones['vigente_desde'], utc=True).dt.tz_localize(None)
+    ).drop(columns='vigente_desde').astype({'producto_id': int}).sort_values(['limite', 'version'])
+
+    vigentes = pd.merge_asof(
+        producciones.sort_values('limite'),
+        recetas,
+        on='limite',
+        by='producto_id',
+        direction='backward',
+        allow_exact_matches=False
+    )
+
+    # Las producciones sin versión registrada hasta su fecha no tienen consumo teórico
+    vigentes = vigentes.dropna(subset=['insumo_ids'])
+
+    lineas = vigentes[['dia', 'cantidad', 'insumo_ids', 'cantidades']].explode(['insumo_ids', 'cantidades'])
+    lineas = lineas.dropna(subset=['insumo_ids'])
+    if lineas.empty:
+        return pd.DataFrame(columns=['dia', 'insumo_id', 'teorico'])
+
+    teorico = pd.DataFrame({
+        'dia': lineas['dia'],
+        'insumo_id': lineas['insumo_ids'].astype(int),
+        'teorico': lineas['cantidad'].astype(float) * lineas['cantidades'].astype(float),
+    })
+    return teorico.groupby(['dia', 'insumo_id'], as_index=False).sum()
+
+
+# Función para resumir consumos reales y compras por (dia, insumo_id)
+# Los consumos con produccion_id son los de producción; los demás son consumos manuales (mermas, pruebas, etc.)
+def movimientos_diarios(consumos, compras):
+    partes = []
+    if not consumos.empty:
+        de_produccion = consumos['produccion_id'].notna()
+        cantidad = consumos['cantidad'].astype(float)
+        partes.append(pd.DataFrame({
+            'dia': _dias(consumos['fecha']),
+            'insumo_id': consumos['insumo_id'].astype(int),
+            'consumo_produccion': cantidad.where(de_produccion, 0.0),
+            'consumo_manual': cantidad.where(~de_produccion, 0.0),
+        }))
+    if not compras.empty:
+        partes.append(pd.DataFrame({
+            'dia': _dias(compras['fecha']),
+            'insumo_id': compras['insumo_id'].astype(int),
+            'comprado': compras['cantidad'].astype(float),
+        }))
+    if not partes:
+        return _vacio().drop(columns='teorico')
+    return pd.concat(partes, ignore_index=True).fillna(0.0).groupby(['dia', 'insumo_id'], as_index=False).sum()
+
+
+# Resumen diario de consumo teórico, consumo real y compras por insumo
+# Se actualiza solo con las producciones, consumos y compras registrados después de la última actualización,
+# y se guarda en la caché en disco; las consultas por periodo solo suman filas diarias
+# Con sucursal solo se consideran los movimientos de esa sucursal (sucursal=None: todas)
+class VariacionDiaria:
+    # vistos: ids ya procesados dentro de la ventana de relectura, por tabla ('produccion', 'consumo', 'compra')
+    # persistir: si guarda el resumen en disco al actualizar; solo un proceso (la aplicación) debe escribir el archivo
+    def __init__(self, diario=None, ultima_produccion=0, ultimo_consumo=0, ultima_compra=0, sucursal=None, vistos=None, persistir=True):
+        self.sucursal = sucursal
+        self.persistir = persistir
+        self.diario = _vacio() if diario is None else diario
+        self.ultima_produccion = ultima_produccion
+        self.ultimo_consumo = ultimo_consumo
+        self.ultima_compra = ultima_compra
+        self.vistos = {clave: set((vistos or {}).get(clave, ())) for clave in ('produccion', 'consumo', 'compra')}
+        self.candado = threading.Lock()
+
+    def _sumar(self, nuevas):
+        diario = pd.concat([self.diario] + nuevas, ignore_index=True)
+        for columna in COLUMNAS_DIARIAS[2:]:
+            diario[columna] = diario[columna].fillna(0.0).astype(float)
+        diario['dia'] = pd.to_datetime(diario['dia'])
+        diario['insumo_id'] = diario['insumo_id'].astype(int)
+        self.diario = diario.groupby(['dia', 'insumo_id'], as_index=False).sum().sort_values(['dia', 'insumo_id'], ignore_index=True)
+
+    # Función para incorporar los movimientos nuevos; versiones es la tabla receta_versiones
+    # Devuelve la cantidad de filas nuevas procesadas
+    def actualizar(self, sb, versiones):
+        filtros = [] if self.sucursal is None else [('eq', 'sucursal_id', self.sucursal)]
+        with self.candado:
+            produccion = leer_filas_nuevas(
+                sb, 'produccion', self.ultima_produccion, self.vistos['produccion'], 'id,producto_id,cantidad,fecha', filtros
+            )
+            consumos = leer_lineas_nuevas(
+                sb, 'consumo_detalles', 'consumos', 'consumo_id', ['fecha', 'produccion_id'], self.ultimo_consumo, self.vistos['consumo'], filtros
+            )
+            compras = leer_lineas_nuevas(
+                sb, 'compra_detalles', 'compras', 'compra_id', ['fecha'], self.ultima_compra, self.vistos['compra'], filtros
+            )
+            if produccion.empty and consumos.empty and compras.empty:
+                return 0
+
+            self._sumar([consumo_teorico(produccion, versiones), movimientos_diarios(consumos, compras)])
+
+            if not produccion.empty:
+                self.ultima_produccion = max(self.ultima_produccion, int(produccion['id'].max()))
+                self.vistos['produccion'] = ids_en_ventana(self.vistos['produccion'], produccion['id'], self.ultima_produccion)
+            if not consumos.empty:
+                self.ultimo_consumo = max(self.ultimo_consumo, int(consumos['id'].max()))
+                self.vistos['consumo'] = ids_en_ventana(self.vistos['consumo'], consumos['id'], self.ultimo_consumo)
+            if not compras.empty:
+                self.ultima_compra = max(self.ultima_compra, int(compras['id'].max()))
+                self.vistos['compra'] = ids_en_ventana(self.vistos['compra'], compras['id'], self.ultima_compra)
+            if self.persistir:
+                guardar(self)
+            return len(produccion) + len(consumos) + len(compras)
+
+    # Función para obtener la variación por insumo en un periodo (fechas inclusivas)
+    # La pérdida no explicada es el consumo real menos el consumo teórico de las producciones;
+    # con precios (insumo_id -> precio) se valoriza para poder ordenar insumos de distinta unidad
+    def periodo(self, fecha_inicio, fecha_fin, precios=None):
+        with self.candado:
+            diario = self.diario
+        filtro = (diario['dia'] >= pd.Timestamp(fecha_inicio)) & (diario['dia'] <= pd.Timestamp(fecha_fin))
+        resumen = diario[filtro].drop(columns='dia').groupby('insumo_id', as_index=False).sum()
+
+        resumen['consumo_real'] = resumen['consumo_produccion'] + resumen['consumo_manual']
+        resumen['perdida'] = resumen['consumo_real'] - resumen['teorico']
+        resumen['perdida_porcentaje'] = (resumen['perdida'] / resumen['teorico'] * 100).where(resumen['teorico'] > 0, 0.0)
+        resumen['costo_perdida'] = resumen['perdida'] * resumen['insumo_id'].map(precios or {}).fillna(0.0)
+        return resumen.sort_values(['costo_perdida', 'perdida'], ascending=False, ignore_index=True)
+
+    # Función para obtener la pérdida no explicada por día en un periodo, para gráficos de tendencia
+    def tendencia(self, fecha_inicio, fecha_fin, precios=None):
+        with self.candado:
+            diario = self.diario
+        filtro = (diario['dia'] >= pd.Timestamp(fecha_inicio)) & (diario['dia'] <= pd.Timestamp(fecha_fin))
+        diario = diario[filtro]
+        perdida = diario['consumo_produccion'] + diario['consumo_manual'] - diario['teorico']
+        costo = perdida * diario['insumo_id'].map(precios or {}).fillna(0.0)
+        return pd.DataFrame({'dia': diario['dia'], 'costo_perdida': costo}).groupby('dia', as_index=False).sum()
+
+    # Función para obtener el consumo real (producción y manual) por día e insumo
+    def consumo_diario(self):
+        with self.candado:
+            diario = self.diario
+        consumo = diario.assign(cantidad=diario['consumo_produccion'] + diario['consumo_manual'])
+        return consumo[consumo['cantidad'] > 0][['dia', 'insumo_id', 'cantidad']].reset_index(drop=True)
+
+
+def _version(variacion):
+    return {
+        'formato': VERSION_RESUMEN,
+        'produccion': variacion.ultima_produccion,
+        'consumo': variacion.ultimo_consumo,
+        'compra': variacion.ultima_compra,
+        'vistos': {clave: sorted(ids) for clave, ids in variacion.vistos.items()},
+    }
+
+
+# Función para guardar el resumen diario en la caché en disco
+def guardar(variacion):
+    cache_disco.guardar_derivado(_nombre(variacion.sucursal), variacion.diario, _version(variacion))
+
+
+# Función para restaurar el resumen diario guardado, o crear uno vacío si no hay uno válido
+# Con persistir=False el archivo solo se lee (por ejemplo desde otro proceso que no debe escribirlo)
+def cargar(sucursal=None, persistir=True):
+    diario, version = cache_disco.leer_derivado_con_version(_nombre(sucursal))
+    if diario is None or not version or version.get('formato') != VERSION_RESUMEN:
+        return VariacionDiaria(sucursal=sucursal, persistir=persistir)
+    return VariacionDiaria(
+        diario, version['produccion'], version['consumo'], version['compra'], sucursal, version['vistos'], persistir
+    )
+
+
+# Función para consolidar los resúmenes diarios de varias sucursales en uno de solo lectura
+# Suma filas diarias ya calculadas, sin volver a leer movimientos
+def consolidar(variaciones):
+    diarios = []
+    for variacion in variaciones:
+        with variacion.candado:
+            diarios.append(variacion.diario)
+    diarios = [diario for diario in diarios if not diario.empty]
+    if not diarios:
+        return VariacionDiaria()
+    diario = pd.concat(diarios, ignore_index=True).groupby(['dia', 'insumo_id'], as_index=False).sum()
+    return VariacionDiaria(diario.sort_values(['dia', 'insumo_id'], ignore_index=True))